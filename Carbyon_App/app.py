@@ -1,6 +1,7 @@
 import panel as pn
 from overview import Overview  
 from nav_tabs import NavTabs  
+from instrumentation import track_session
 
 
 pn.extension(
@@ -14,14 +15,13 @@ class App(pn.viewable.Viewer):
 
     def __init__(self):
         super().__init__()
-        # Create the Overview instance first and pass None temporarily to nav_tabs
-        overview = Overview(nav_tabs=None)  
+        # Counted on the metrics page while the session is open
+        track_session()
 
-        # Create the NavTabs instance
-        self._tabs = NavTabs(overview)
-
-        # Update the Overview instance with the correct nav_tabs reference
-        overview.nav_tabs = self._tabs  
+        # The Overview (map, widgets and data loads) is built once the page
+        # is shown, a loading placeholder is painted first
+        self._tabs = NavTabs()
+        self._tabs.add_tab("Location Sensitivity", build=lambda: Overview(nav_tabs=self._tabs))
 
         # Create the layout using the NavTabs instance
         self._layout = pn.template.BootstrapTemplate(
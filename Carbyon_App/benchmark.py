@@ -0,0 +1,313 @@
+"""
+Benchmarks of the map build, search and filter hot paths.
+
+Synthetic machine CSVs from 10^2 to 10^6 readings are run against the bundled
+A1FI shapefile. Every entry point gets its wall time (best of --repeat runs),
+its peak Python memory (tracemalloc, from a separate run) and the bytes it
+sends to the browser. The results are written as JSON, so runs on different
+commits can be compared:
+
+    python benchmark.py -o before.json
+    python benchmark.py -o after.json --compare before.json
+"""
+import argparse
+import asyncio
+import contextlib
+import glob
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from columnar_cache import CACHE_DIR
+
+# Folders the app modules read from the environment when they are imported,
+# main() points them at the synthetic machines first
+BENCH_ENVIRON = ('CARBYON_MACHINE_CSV_DIR', 'CARBYON_TELEMETRY_DIR')
+
+SIZES = (10 ** 2, 10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6)
+
+# Coordinates per size for the zone lookups and for the searches
+QUERIES = 200
+SEARCHES = 20
+
+# Deepest zoom level the site clusters are timed at
+MAX_BENCHMARK_ZOOM = 10
+
+
+def synthetic_sites(rows, seed=0):
+    """
+    Machine readings in the format of files/csv/alpha1.csv.
+
+    rows (int): Number of readings.
+    seed (int): Random seed, the same seed gives the same readings.
+
+    Returns:
+        DataFrame: The readings with the units written behind the numbers.
+    """
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'Date': pd.Timestamp('2025-01-07') + pd.to_timedelta(rng.integers(0, 365, rows), unit='D'),
+        'ID': pd.Series(rng.integers(1, 500, rows)).map('0x{:04x}'.format),
+        'Lat': rng.uniform(-55, 70, rows).round(6),
+        'Long': rng.uniform(-180, 180, rows).round(6),
+        'CostsToCapture': pd.Series(rng.integers(250, 600, rows)).astype(str) + ' euro/ton',
+        'EnergyRequirements': pd.Series(rng.integers(5000, 13000, rows)).astype(str) + ' kWh/ton',
+        'Production': pd.Series(rng.integers(10, 40, rows)).astype(str) + ' ton/year',
+        'Machine_costs': '20000 euro',
+        'Start_up_time': '5 minutes',
+        'Up_time': pd.Series(rng.integers(80, 100, rows)).astype(str) + '%',
+        'Duty_cycle': '50%',
+    })
+
+
+def measure(func, repeat=3):
+    """
+    Time a function and record the Python memory it allocates. The function
+    runs repeat + 1 times.
+
+    Returns:
+        tuple: {'seconds', 'peak_bytes'} and the result of the last run.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+
+    # tracemalloc slows the code down, so the peak is taken from an extra run
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'seconds': min(times), 'peak_bytes': peak}, result
+
+
+def count_payload(map_pane):
+    # Counts the bytes of the messages sent to the map pane from now on
+    from render_cache import json_size
+    sent = {'bytes': 0, 'messages': 0}
+    send = map_pane.send
+
+    def counting_send(message, key=None, replay=None):
+        sent['bytes'] += json_size(message)
+        sent['messages'] += 1
+        send(message, key=key, replay=replay)
+
+    map_pane.send = counting_send
+    return sent
+
+
+def bench_size(rows, repeat=3, koppen_giger_data_path=None):
+    """
+    Run every benchmark for one synthetic machine, in the folders main() set up.
+
+    Returns:
+        dict: Results per entry point.
+    """
+    from color_map import Color_map
+    from data_store import get_data_store, parse_machine_csv, KOPPEN_GIGER_PATH
+    from filters import Filters
+    from machines import Machine
+    from map import ClimateMap, create_map
+    from performance import PERFORMANCE_COLORS, performance_filter
+    from render_cache import RENDER_CACHE
+    from surface import SURFACE_RESOLUTION, Surface, interpolate
+
+    koppen_giger_data_path = koppen_giger_data_path or KOPPEN_GIGER_PATH
+    name = f'bench{rows}'
+    csv_path = os.path.join(os.environ['CARBYON_MACHINE_CSV_DIR'], f'{name}.csv')
+    synthetic_sites(rows).to_csv(csv_path, index=False)
+
+    store = get_data_store(koppen_giger_data_path)
+    color_map = Color_map()
+    results = {'csv_bytes': os.path.getsize(csv_path)}
+
+    # Loading: parsing the CSV and the per-zone statistics
+    results['parse_csv'], data = measure(lambda: parse_machine_csv(csv_path), repeat)
+    results['zone_statistics'], _ = measure(lambda: Machine(name, data, store.zone_index), repeat)
+    store.registry.get(name)
+
+    # The page of the map, built without and with the render cache
+    results['create_map'], html = measure(
+        lambda: create_map(koppen_giger_data_path, color_map, machine=name).get_root().render(), repeat
+    )
+    results['create_map']['html_bytes'] = len(html)
+
+    def session():
+        return ClimateMap(koppen_giger_data_path, machine=name)
+
+    RENDER_CACHE.clear()
+    start = time.perf_counter()
+    climate_map = session()
+    results['climate_map_cold'] = {'seconds': time.perf_counter() - start}
+    results['climate_map_cached'], _ = measure(session, repeat)
+
+    # Zone lookups of single coordinates
+    rng = np.random.default_rng(1)
+    lats, lons = rng.uniform(-55, 70, QUERIES), rng.uniform(-180, 180, QUERIES)
+
+    def zone_lookups():
+        for lat, lon in zip(lats, lons):
+            climate_map.get_climate_zone_for_coordinates(lat, lon)
+
+    results['zone_lookup'], _ = measure(zone_lookups, repeat)
+    results['zone_lookup']['seconds_per_call'] = results['zone_lookup']['seconds'] / QUERIES
+
+    # Coordinate searches through the same path as the search button
+    filters = Filters(map=climate_map, map_pane=climate_map.map_pane)
+    filters.set_machine(name)
+    sent = count_payload(climate_map.map_pane)
+
+    async def searches():
+        for lat, lon in zip(lats[:SEARCHES], lons[:SEARCHES]):
+            await filters.process_coordinates(f'{lat}, {lon}', climate_map.add_marker, lambda details: None)
+
+    def quiet_searches():
+        # The search path prints every step, which would be timed as well
+        with contextlib.redirect_stdout(io.StringIO()):
+            asyncio.run(searches())
+
+    # The searches look up the machine's surface, it is built beforehand so
+    # they don't time its rebuild in the background
+    store.surface(name, wait=True)
+    start = time.perf_counter()
+    store.site_index(name)
+    results['site_index_build'] = {'seconds': time.perf_counter() - start}
+    results['process_coordinates'], _ = measure(quiet_searches, repeat)
+    results['process_coordinates']['seconds_per_call'] = results['process_coordinates']['seconds'] / SEARCHES
+    results['process_coordinates']['payload_bytes_per_call'] = sent['bytes'] / (SEARCHES * (repeat + 1))
+
+    # Performance filter: the color mapping itself and recoloring a session
+    buckets = list(PERFORMANCE_COLORS)
+    results['performance_filter'], _ = measure(
+        lambda: [performance_filter(color_map, bucket) for bucket in buckets], repeat
+    )
+    results['performance_filter']['seconds_per_call'] = results['performance_filter']['seconds'] / len(buckets)
+    sent.update(bytes=0, messages=0)
+    results['apply_performance_filter'], _ = measure(
+        lambda: [climate_map.apply_performance_filter(bucket) for bucket in buckets], repeat
+    )
+    results['apply_performance_filter']['payload_bytes_per_call'] = sent['bytes'] / (len(buckets) * (repeat + 1))
+
+    # Range slider filter over part of the cost range
+    start = time.perf_counter()
+    store.range_index(name)
+    results['range_index_build'] = {'seconds': time.perf_counter() - start}
+    sent.update(bytes=0, messages=0)
+    results['slider_filter'], _ = measure(
+        lambda: climate_map.apply_slider_filter((300, 500), 'CostsToCapture'), repeat
+    )
+    results['slider_filter']['payload_bytes_per_call'] = sent['bytes'] / (repeat + 1)
+
+    # Interpolated surface: the interpolation itself and single coordinate estimates
+    zone_grid = store.zone_grid(SURFACE_RESOLUTION)
+    results['surface_build'], estimates = measure(
+        lambda: interpolate(zone_grid, SURFACE_RESOLUTION, store.machine(name)), repeat
+    )
+    surface = Surface(SURFACE_RESOLUTION, estimates)
+
+    def surface_lookups():
+        for lat, lon in zip(lats, lons):
+            surface.estimate(lat, lon)
+
+    results['surface_lookup'], _ = measure(surface_lookups, repeat)
+    results['surface_lookup']['seconds_per_call'] = results['surface_lookup']['seconds'] / QUERIES
+
+    # Site clusters: grouping every zoom level, then the world and a close up view
+    start = time.perf_counter()
+    site_clusters = store.site_clusters(name)
+    for zoom in range(MAX_BENCHMARK_ZOOM + 1):
+        site_clusters.level(zoom)
+    results['site_clusters_build'] = {'seconds': time.perf_counter() - start}
+    sent.update(bytes=0, messages=0)
+    views = [
+        {'view': 1, 'zoom': 2, 'south': -85, 'west': -180, 'north': 85, 'east': 180},
+        {'view': 2, 'zoom': MAX_BENCHMARK_ZOOM, 'south': 45, 'west': 5, 'north': 48, 'east': 10},
+    ]
+    results['site_clusters_view'], _ = measure(lambda: [climate_map._show_site_view(view) for view in views], repeat)
+    results['site_clusters_view']['seconds_per_call'] = results['site_clusters_view']['seconds'] / len(views)
+    results['site_clusters_view']['payload_bytes_per_call'] = sent['bytes'] / (len(views) * (repeat + 1))
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    # Prints the time ratio (new / baseline) of every entry point both runs have
+    for size, entries in results['results'].items():
+        for entry, values in entries.items():
+            old = baseline.get('results', {}).get(size, {}).get(entry)
+            if isinstance(values, dict) and isinstance(old, dict) and old.get('seconds'):
+                print(f"{size:>8} {entry:<26} {values['seconds'] / old['seconds']:6.2f}x")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the map build, search and filter hot paths.")
+    parser.add_argument('-o', '--output', default='benchmark.json', help="JSON file for the results")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES), help="Readings per synthetic machine")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--compare', help="Earlier JSON results to compare with")
+    args = parser.parse_args(argv)
+
+    results = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'repeat': args.repeat,
+        'results': {},
+    }
+    # The app modules are imported by the first run, after the folders are set
+    bench_dir = tempfile.mkdtemp(prefix='carbyon-bench-')
+    environ = {key: os.environ.get(key) for key in BENCH_ENVIRON}
+    os.environ['CARBYON_MACHINE_CSV_DIR'] = os.path.join(bench_dir, 'csv')
+    os.environ['CARBYON_TELEMETRY_DIR'] = os.path.join(bench_dir, 'telemetry')
+    os.makedirs(os.environ['CARBYON_MACHINE_CSV_DIR'])
+    try:
+        for rows in args.sizes:
+            print(f"Benchmarking {rows} readings")
+            results['results'][str(rows)] = bench_size(rows, repeat=args.repeat)
+            for entry, values in results['results'][str(rows)].items():
+                if isinstance(values, dict):
+                    print(f"  {entry:<26} {values['seconds'] * 1000:10.2f} ms")
+    finally:
+        # The synthetic machines and their cached copies and surfaces are
+        # removed again, the environment is left as it was
+        for key, value in environ.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        shutil.rmtree(bench_dir, ignore_errors=True)
+        for suffix in ('typed', 'surface'):
+            for path in glob.glob(os.path.join(CACHE_DIR, f'bench*-{suffix}-*')):
+                os.remove(path)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
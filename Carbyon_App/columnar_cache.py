@@ -0,0 +1,122 @@
+"""
+Typed on-disk copies of the source files (GeoParquet for the climate zones,
+Feather for the machine CSVs), so a new server process loads them in
+milliseconds instead of parsing the shapefile and CSV text again.
+
+Cache files are named after a fingerprint of their source (modification time
+and size), so changing a source file makes its cache file stale. Without
+pyarrow installed everything is read from the sources.
+"""
+import glob
+import hashlib
+import os
+import geopandas as gpd
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.feather as feather
+except ImportError:
+    pa = pa_csv = feather = None
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'files', 'cache')
+
+
+def source_fingerprint(path):
+    # Changes whenever the source file (or a shapefile's .dbf) is modified
+    parts = []
+    for source in (path, os.path.splitext(path)[0] + '.dbf'):
+        if os.path.exists(source):
+            stat = os.stat(source)
+            parts.append(f'{source}:{stat.st_mtime_ns}:{stat.st_size}')
+    return hashlib.sha1('|'.join(parts).encode()).hexdigest()[:12]
+
+
+def cache_path(source_path, suffix, extension, cache_dir=CACHE_DIR):
+    # Cache file of a source, e.g. files/cache/alpha1-typed-<fingerprint>.feather
+    name = os.path.splitext(os.path.basename(source_path))[0]
+    return os.path.join(cache_dir, f'{name}-{suffix}-{source_fingerprint(source_path)}.{extension}')
+
+
+def _replace_stale(path):
+    # Removes the cache files of older versions of the same source
+    prefix = path.rsplit('-', 1)[0]
+    extension = os.path.splitext(path)[1]
+    for old in glob.glob(f'{glob.escape(prefix)}-*{extension}'):
+        if old != path:
+            os.remove(old)
+
+
+def write_geo(frame, path):
+    # Writes a GeoDataFrame as GeoParquet, or as a GeoPackage without pyarrow
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if feather is not None:
+        frame.to_parquet(path)
+    else:
+        frame.to_file(path, driver='GPKG')
+
+
+def read_geo(path):
+    if feather is not None:
+        return gpd.read_parquet(path)
+    return gpd.read_file(path)
+
+
+def geo_extension():
+    return 'parquet' if feather is not None else 'gpkg'
+
+
+def read_zones(source_path, crs='EPSG:4326'):
+    """
+    Read the climate zones shapefile reprojected to crs, through the cache.
+
+    source_path (str): Path to the shapefile.
+
+    Returns:
+        GeoDataFrame: The zones as stored in the shapefile, in the given crs.
+    """
+    if feather is None:
+        return gpd.read_file(source_path).to_crs(crs)
+
+    path = cache_path(source_path, crs.replace(':', ''), 'parquet')
+    if os.path.exists(path):
+        return gpd.read_parquet(path)
+
+    zones = gpd.read_file(source_path).to_crs(crs)
+    write_geo(zones, path)
+    _replace_stale(path)
+    return zones
+
+
+def read_csv(path, text_columns=()):
+    # Reads a CSV with the multithreaded pyarrow parser when it is installed.
+    # text_columns are kept as text, pyarrow would read an ID like 0x0001 as 1
+    if pa_csv is None:
+        return pd.read_csv(path, dtype={column: 'str' for column in text_columns})
+    options = pa_csv.ConvertOptions(column_types={column: pa.string() for column in text_columns})
+    return pa_csv.read_csv(path, convert_options=options).to_pandas()
+
+
+def read_table(source_path, parse, suffix='parsed'):
+    """
+    Read a CSV through parse() once, later loads memory-map the typed result.
+
+    source_path (str): Path to the CSV.
+    parse (callable): Turns the CSV path into a typed DataFrame.
+
+    Returns:
+        DataFrame: The parsed table.
+    """
+    if feather is None:
+        return parse(source_path)
+
+    path = cache_path(source_path, suffix, 'feather')
+    if os.path.exists(path):
+        return feather.read_feather(path, memory_map=True)
+
+    data = parse(source_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    feather.write_feather(data.reset_index(drop=True), path)
+    _replace_stale(path)
+    return data
@@ -0,0 +1,376 @@
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from color_map import Color_map
+from zone_index import ZoneIndex
+from machines import MachineRegistry
+from telemetry import TELEMETRY_DIR
+from render_cache import RENDER_CACHE
+from geometry_tiers import GeometryTiers
+from columnar_cache import CACHE_DIR, cache_path, read_csv, read_table, read_zones, source_fingerprint, _replace_stale
+from surface import Surface, SURFACE_RESOLUTION, interpolate, zone_grid
+
+logger = logging.getLogger(__name__)
+
+# Surfaces are rebuilt in one background thread, so a rebuild never blocks the
+# event loop and only one runs at a time
+SURFACE_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix='surface')
+
+# The telemetry files are polled in their own thread, once for the whole
+# process, so polls don't wait behind searches or hold them up
+TELEMETRY_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix='telemetry')
+
+# Default locations of the climate zones and the machine data, relative to the app folder
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+KOPPEN_GIGER_PATH = os.path.join(BASE_DIR, 'files', '2026-2050_A1FI_GIS', '2026-2050-A1FI.shp')
+MACHINE_CSV_DIR = os.environ.get('CARBYON_MACHINE_CSV_DIR', os.path.join(BASE_DIR, 'files', 'csv'))
+
+# Machine shown when the app opens
+DEFAULT_MACHINE = 'alpha1'
+
+# Columns of the machine CSVs which hold a number followed by a unit, loaded as float32
+UNITS = {
+    'CostsToCapture': 'euro/ton',
+    'EnergyRequirements': 'kWh/ton',
+    'Production': 'ton/year',
+    'Machine_costs': 'euro',
+    'Start_up_time': 'minutes',
+    'Up_time': '%',
+    'Duty_cycle': '%',
+}
+
+# Types of the other machine CSV columns, coordinates stay float64 so searched
+# coordinates match them exactly
+DTYPES = {
+    'Date': 'datetime64[ns]',
+    'ID': 'category',
+    'Lat': 'float64',
+    'Long': 'float64',
+}
+
+
+def load_zones(koppen_giger_data_path, color_map=None):
+    """
+    Load the Koppen-Geiger shapefile in EPSG:4326 with color and description columns.
+
+    koppen_giger_data_path (str): Path to the climate zones shapefile.
+    color_map (dict): GRIDCODE to color and description mapping.
+
+    Returns:
+        GeoDataFrame: The climate zones.
+    """
+    color_map = color_map if color_map else Color_map()
+    zones = read_zones(koppen_giger_data_path)
+
+    # Map GRIDCODES to colors and descriptions for the whole column at once
+    zones['color'] = zones['GRIDCODE'].map({code: value[0] for code, value in color_map.items()}).fillna('gray')
+    zones['description'] = zones['GRIDCODE'].map({code: value[1] for code, value in color_map.items()}).fillna('Unknown')
+    return zones
+
+
+def with_unit(value, unit):
+    # A number as written in the machine CSVs, e.g. "350 euro/ton" or "95%"
+    return f"{value:g}{unit}" if unit == '%' else f"{value:g} {unit}"
+
+
+def parse_quantity(values, unit):
+    """
+    Parse a column like "350 euro/ton" to float32 numbers.
+
+    The unit is cut off the whole column at once, values written differently
+    (or plain numbers in live readings) fall back to the first number in them.
+
+    values (Series): The column as read from the CSV.
+    unit (str): Unit behind the numbers.
+
+    Returns:
+        Series: The numbers as float32, NaN where there is none.
+    """
+    if pd.api.types.is_numeric_dtype(values):
+        return values.astype('float32')
+
+    text = values.astype(str).str.strip()
+    numbers = text.str.removesuffix(unit).str.rstrip()
+    try:
+        # A straight cast when every value is written the same way
+        return numbers.astype('float32')
+    except ValueError:
+        pass
+
+    numbers = pd.to_numeric(numbers, errors='coerce')
+    unparsed = numbers.isna() & values.notna()
+    if unparsed.any():
+        numbers[unparsed] = pd.to_numeric(text[unparsed].str.extract(r'(\d+(?:\.\d+)?)')[0], errors='coerce')
+    return numbers.astype('float32')
+
+
+def apply_schema(data):
+    """
+    Give machine readings their compact types: float32 numbers for the UNITS
+    columns, datetimes for Date and categories for ID. The units are kept in
+    data.attrs['units'], so nothing downstream parses the text again.
+
+    data (DataFrame): Machine readings as read from a CSV or telemetry file.
+
+    Returns:
+        DataFrame: The same readings with typed columns.
+    """
+    for column, unit in UNITS.items():
+        if column in data:
+            data[column] = parse_quantity(data[column], unit)
+    for column, dtype in DTYPES.items():
+        if column not in data:
+            continue
+        if dtype.startswith('datetime'):
+            data[column] = pd.to_datetime(data[column], errors='coerce').astype(dtype)
+        else:
+            data[column] = data[column].astype(dtype)
+    data.attrs['units'] = {column: unit for column, unit in UNITS.items() if column in data}
+    return data
+
+
+def parse_machine_csv(csv_path):
+    # Reads a machine CSV into the typed schema
+    return apply_schema(read_csv(csv_path, text_columns=['ID']))
+
+
+def machine_frame(data):
+    # Machine readings with a point geometry in EPSG:4326
+    frame = gpd.GeoDataFrame(
+        data,
+        geometry=gpd.points_from_xy(data['Long'], data['Lat']),
+        crs="EPSG:4326"
+    )
+    frame.attrs = dict(data.attrs)
+    return frame
+
+
+def parse_readings(readings):
+    # Live readings (see telemetry.py) in the same form as load_machine_csv.
+    # Missing columns are added empty, readings without coordinates are dropped
+    readings = readings.reindex(columns=[*DTYPES, *UNITS])
+    for column in ('Lat', 'Long'):
+        readings[column] = pd.to_numeric(readings[column], errors='coerce')
+    located = readings['Lat'].notna() & readings['Long'].notna()
+    if not located.all():
+        logger.warning("Dropped %d live readings without coordinates", int((~located).sum()))
+    return machine_frame(apply_schema(readings[located].reset_index(drop=True)))
+
+
+def load_machine_csv(csv_path):
+    """
+    Load a machine CSV in the typed schema (see apply_schema).
+
+    The parsed table is cached on disk, so the CSV text is only parsed again
+    when the file changes.
+
+    csv_path (str): Path to the machine CSV.
+
+    Returns:
+        GeoDataFrame: One row per reading with a point geometry in EPSG:4326.
+    """
+    # The schema is applied again to the cached copy, which is cheap on typed
+    # columns and brings back the units in attrs
+    return machine_frame(apply_schema(read_table(csv_path, parse_machine_csv, suffix='typed')))
+
+
+def site_details(row):
+    # Turns a machine row into the dictionary shown in the location details,
+    # putting the units back behind the parsed numbers
+    details = {key: value for key, value in row.items() if key != 'geometry'}
+    for column, unit in UNITS.items():
+        if column in details and pd.notna(details[column]):
+            details[column] = with_unit(details[column], unit)
+    if isinstance(details.get('Date'), pd.Timestamp):
+        details['Date'] = details['Date'].strftime('%Y-%m-%d')
+    return details
+
+
+class DataStore:
+    """
+    Read-only climate zones and machine data shared by every session of the server process.
+
+    Sessions must not modify the frames they get from the store, they are the
+    same objects for every user. Live readings replace a machine's frames with
+    extended copies instead (see machines.Machine.append).
+    """
+
+    def __init__(self, koppen_giger_data_path=KOPPEN_GIGER_PATH, csv_dir=MACHINE_CSV_DIR, cache_dir=CACHE_DIR):
+        self.path = os.path.abspath(koppen_giger_data_path)
+        self.csv_dir = os.path.abspath(csv_dir)
+
+        # Folder of the lattices, tiers and surfaces derived from the sources
+        self.cache_dir = cache_dir
+
+        # The climate zones are loaded and reprojected once
+        self.zones = load_zones(self.path)
+        self.zone_index = ZoneIndex(self.zones)
+
+        # Simplified zones for drawing, built and cached on first use
+        self.geometry_tiers = GeometryTiers(self.zones, self.path, self.cache_dir)
+
+        # GRIDCODE lattices of the interpolated surfaces per resolution
+        self._zone_grids = {}
+        self._zone_grids_lock = threading.Lock()
+
+        # Latest surface per machine and resolution and the rebuilds on their way
+        self._surfaces = {}
+        self._surface_builds = {}
+        self._surfaces_lock = threading.Lock()
+
+        # Machines found in the CSV folder, each loaded on first use together
+        # with its live readings. Rendered artifacts of a machine with new
+        # readings are dropped from the render cache
+        self.registry = MachineRegistry(
+            self.csv_dir, self.zone_index, load_machine_csv,
+            parse_readings=parse_readings, telemetry_dir=TELEMETRY_DIR, on_change=RENDER_CACHE.invalidate
+        )
+
+    def machine_names(self):
+        return self.registry.names()
+
+    def machine(self, name=DEFAULT_MACHINE):
+        return self.registry.get(name).data
+
+    def zone_statistics(self, name=DEFAULT_MACHINE):
+        # Per-GRIDCODE statistics of a machine
+        return self.registry.get(name).zone_statistics
+
+    def site_index(self, name=DEFAULT_MACHINE):
+        # Nearest-site index over a machine's readings
+        return self.registry.get(name).site_index
+
+    def range_index(self, name=DEFAULT_MACHINE):
+        # Sorted metric values of a machine's sites and zones for range filters
+        return self.registry.get(name).range_index
+
+    def site_clusters(self, name=DEFAULT_MACHINE):
+        # A machine's sites grouped per zoom level for the map
+        return self.registry.get(name).site_clusters
+
+    def zone_grid(self, resolution=SURFACE_RESOLUTION):
+        # GRIDCODE of every cell of the surface lattice, cached on disk
+        with self._zone_grids_lock:
+            if resolution not in self._zone_grids:
+                path = cache_path(self.path, f'grid{resolution:g}', 'npy', self.cache_dir)
+                if os.path.exists(path):
+                    grid = np.load(path)
+                else:
+                    grid = zone_grid(self.zone_index, resolution)
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    np.save(path, grid)
+                    _replace_stale(path)
+                self._zone_grids[resolution] = grid
+            return self._zone_grids[resolution]
+
+    def surface(self, name=DEFAULT_MACHINE, resolution=SURFACE_RESOLUTION, wait=False):
+        """
+        Costs and energy requirements of a machine interpolated on a global
+        lattice (see surface.py).
+
+        The latest surface is kept in memory and the one of the loaded data
+        also in the cache folder. When the readings change the surface is rebuilt in
+        a background thread, until it is done the previous one is returned.
+
+        wait (bool): Wait for the surface of the current data, e.g. in scripts.
+
+        Returns:
+            Surface: The estimates, looked up per coordinate in O(1). None while
+            the machine's first surface is being built.
+        """
+        machine = self.registry.get(name)
+        key = (name, resolution)
+        with self._surfaces_lock:
+            surface = self._surfaces.get(key)
+            if surface is not None and surface.data_version == machine.data_version:
+                return surface
+            build = self._surface_builds.get(key)
+            if build is None:
+                build = SURFACE_EXECUTOR.submit(self._build_surface, machine, resolution)
+                self._surface_builds[key] = build
+        if wait:
+            build.result()
+            return self.surface(name, resolution, wait=True)
+        return surface
+
+    def surface_build(self, name=DEFAULT_MACHINE, resolution=SURFACE_RESOLUTION):
+        # The rebuild of a machine's surface on its way, None if there is none
+        with self._surfaces_lock:
+            return self._surface_builds.get((name, resolution))
+
+    def _build_surface(self, machine, resolution):
+        # The version is taken before the data, so the data is never older
+        # than the version the surface is marked with
+        key = (machine.name, resolution)
+        try:
+            version, data = machine.data_version, machine.data
+            surface = self._load_surface(machine.name, data, resolution, loaded=version[1] == 0)
+            surface.data_version = version
+            with self._surfaces_lock:
+                self._surfaces[key] = surface
+            return surface
+        except Exception:
+            logger.exception("The surface of %s could not be built", machine.name)
+            raise
+        finally:
+            with self._surfaces_lock:
+                self._surface_builds.pop(key, None)
+
+    def _load_surface(self, name, data, resolution, loaded):
+        # The surface of the loaded data is cached in a file named after
+        # everything it depends on, one file per machine is kept
+        path = None
+        if loaded:
+            key = hashlib.sha1(repr((
+                source_fingerprint(self.registry.path(name)), source_fingerprint(self.path),
+                resolution, len(data)
+            )).encode()).hexdigest()[:12]
+            path = os.path.join(self.cache_dir, f'{name}-surface-{key}.npz')
+            if os.path.exists(path):
+                return Surface.load(path)
+
+        surface = Surface(resolution, interpolate(self.zone_grid(resolution), resolution, data))
+        if path is not None:
+            surface.save(path)
+            _replace_stale(path)
+        return surface
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_data_store(koppen_giger_data_path=KOPPEN_GIGER_PATH, csv_dir=MACHINE_CSV_DIR):
+    """
+    Return the process-wide DataStore for the given files, loading it on first use.
+    """
+    key = (os.path.abspath(koppen_giger_data_path), os.path.abspath(csv_dir))
+
+    # The lock makes sure concurrent sessions wait for a single load
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = DataStore(*key)
+        return _stores[key]
+
+
+def poll_telemetry():
+    """
+    Add the live readings of the loaded machines of every store (see
+    MachineRegistry.poll), once for the whole server process.
+
+    Returns:
+        dict: Path of the climate zones -> names of the machines which got new readings.
+    """
+    with _stores_lock:
+        stores = list(_stores.values())
+    added = {}
+    for store in stores:
+        machines = store.registry.poll()
+        if machines:
+            added.setdefault(store.path, set()).update(machines)
+    return added
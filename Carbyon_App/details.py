@@ -0,0 +1,78 @@
+import panel as pn
+from matplotlib.figure import Figure
+from data_store import get_data_store, KOPPEN_GIGER_PATH, UNITS
+
+# Time series shown for a site, with their titles
+SERIES = {
+    'Up_time': 'Up-time',
+    'Duty_cycle': 'Duty cycle',
+    'CostsToCapture': 'Costs to capture',
+}
+
+
+def site_readings(data, lat, lon):
+    """
+    Readings of one site over time.
+
+    data (DataFrame): The machine readings.
+    lat (float): Latitude of the site.
+    lon (float): Longitude of the site.
+
+    Returns:
+        DataFrame: The readings at the coordinates, oldest first.
+    """
+    readings = data[(data['Lat'] == lat) & (data['Long'] == lon)]
+    return readings.sort_values('Date', kind='stable')
+
+
+def plot_series(axes, readings):
+    # Draws every series of the site on its own axes
+    for ax, (column, label) in zip(axes, SERIES.items()):
+        ax.plot(readings['Date'], readings[column], marker='o')
+        ax.set_ylabel(UNITS.get(column, ''))
+        ax.set_title(label, loc='left', fontsize=10)
+        ax.grid(alpha=0.3)
+
+
+def series_figure(readings):
+    # One chart per series, sharing the time axis. The figure is not
+    # registered with pyplot, so it is freed with the pane showing it
+    figure = Figure(figsize=(8, 2.2 * len(SERIES)))
+    plot_series(figure.subplots(len(SERIES), 1, sharex=True), readings)
+    figure.autofmt_xdate()
+    return figure
+
+
+class SiteDetails(pn.viewable.Viewer):
+    """
+    Time series of the site chosen on the overview. The view is reused for
+    every site, the readings are only looked up when show() is called and
+    again only if the site or the machine's data changed.
+    """
+
+    def __init__(self, **params):
+        super().__init__(**params)
+        self.header = pn.pane.Markdown("**Details:**")
+        self.chart = pn.pane.Matplotlib(tight=True, dpi=96, sizing_mode='stretch_width')
+
+        # Site and data version the chart was drawn for
+        self._shown = None
+
+        self._layout = pn.Column(self.header, self.chart, styles={'padding': '20px'})
+
+    def show(self, machine, lat, lon, koppen_giger_data_path=KOPPEN_GIGER_PATH):
+        # Draws the time series of the site, unless they are already shown.
+        # The readings come from the store of the scenario the map shows,
+        # which is the one this session polls
+        record = get_data_store(koppen_giger_data_path).registry.get(machine)
+        key = (machine, lat, lon, record.data_version)
+        if key == self._shown:
+            return
+        self._shown = key
+
+        readings = site_readings(record.data, lat, lon)
+        self.header.object = f"**Details:** {machine} at {lat}, {lon} ({len(readings)} readings)"
+        self.chart.object = series_figure(readings) if len(readings) else None
+
+    def __panel__(self):
+        return self._layout
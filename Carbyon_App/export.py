@@ -0,0 +1,390 @@
+"""
+Static suitability maps and per-site report sheets, rendered without the app.
+
+Every machine gets a map per metric and performance filter bucket: the climate
+zones in the colors of the dashboard and the measured sites in the bucket's
+zones, colored by their mean value. Every measured site gets a report sheet with
+its climate zone, the zone's ranges, a locator map and its time series.
+
+The renders run across a process pool. A manifest in the output folder keeps a
+fingerprint of the inputs of every file, files whose inputs are unchanged are
+not rendered again:
+
+    python export.py -o files/exports --formats png pdf svg
+"""
+import argparse
+import hashlib
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from matplotlib import colormaps
+from matplotlib.collections import PatchCollection
+from matplotlib.colors import Normalize
+from matplotlib.figure import Figure
+from matplotlib.patches import Patch, PathPatch
+from matplotlib.path import Path
+import shapely
+from color_map import Color_map
+from columnar_cache import source_fingerprint
+from data_store import get_data_store, site_details, BASE_DIR, KOPPEN_GIGER_PATH
+from details import SERIES, plot_series
+from map_elements import MUTED_COLOR, ZONE_STYLE, gridcode_colors
+from performance import performance_class, performance_filter, PERFORMANCE_CLASSES, PERFORMANCE_COLORS
+from surface import SURFACE_COLORMAP, SURFACE_LABELS, cell_of
+from zone_stats import METRICS
+
+EXPORT_DIR = os.path.join(BASE_DIR, 'files', 'exports')
+MANIFEST_NAME = 'manifest.json'
+
+# Formats of the maps and of the report sheets
+FORMATS = ('png', 'pdf', 'svg')
+REPORT_FORMAT = 'pdf'
+DPI = 150
+
+# Part of every fingerprint, change it when the drawing itself changes so
+# every file is rendered again
+EXPORT_VERSION = '1'
+
+# Simplification tolerance in degrees of the zones drawn, invisible at the
+# width of a world map
+EXPORT_TOLERANCE = 0.5
+
+# Sites are drawn as the mean of each cell of this size in degrees, so a map
+# of a million readings is a few thousand points
+SITE_BIN_DEGREES = 1.0
+
+# Performance filter buckets of each metric, as in the overview dropdown
+METRIC_BUCKETS = {
+    'CostsToCapture': 'CO₂ Capture',
+    'EnergyRequirements': 'Energy Efficiency',
+}
+
+# Degrees of latitude shown around a site on its report sheet
+LOCATOR_DEGREES = 15
+
+
+def fingerprint(*parts):
+    # Hash of everything an output is drawn from
+    digest = hashlib.sha1(EXPORT_VERSION.encode())
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else repr(part).encode())
+    return digest.hexdigest()[:16]
+
+
+def metric_buckets(metric):
+    # None (every zone) and the performance filter buckets of a metric
+    return [None] + [bucket for bucket in PERFORMANCE_COLORS if METRIC_BUCKETS[metric] in bucket]
+
+
+def bucket_slug(bucket):
+    return 'all' if bucket is None else PERFORMANCE_CLASSES[PERFORMANCE_COLORS[bucket]].lower()
+
+
+def binned_sites(lats, lons, values):
+    """
+    Mean position and value of the sites in every SITE_BIN_DEGREES cell.
+
+    Returns:
+        tuple: Arrays of latitude, longitude, mean value (NaN without values)
+        and number of sites, one entry per cell with sites.
+    """
+    if not len(lats):
+        return tuple(np.empty(0) for _ in range(4))
+    rows, cols = cell_of(lats, lons, SITE_BIN_DEGREES)
+    cells, cell_of_site = np.unique(rows * round(360 / SITE_BIN_DEGREES) + cols, return_inverse=True)
+    counts = np.bincount(cell_of_site, minlength=len(cells))
+    measured = ~np.isnan(values)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = (np.bincount(cell_of_site, np.where(measured, values, 0), len(cells))
+                 / np.bincount(cell_of_site, measured, len(cells)))
+    return (np.bincount(cell_of_site, lats, len(cells)) / counts,
+            np.bincount(cell_of_site, lons, len(cells)) / counts, means, counts)
+
+
+def map_tasks(machine, data, site_gridcodes, color_map, zones_fingerprint, formats, dpi):
+    # One task per metric and bucket, with everything its map is drawn from
+    lats = data['Lat'].to_numpy(dtype=float)
+    lons = data['Long'].to_numpy(dtype=float)
+    for metric in METRICS:
+        values = data[metric].to_numpy(dtype=float)
+        value_range = (float(np.nanmin(values)), float(np.nanmax(values))) if np.isfinite(values).any() else (0, 1)
+        for bucket in metric_buckets(metric):
+            colors = gridcode_colors(performance_filter(color_map, bucket))
+            selected = [code for code, color in colors.items() if bucket is None or color == PERFORMANCE_COLORS[bucket]]
+            in_bucket = np.isin(site_gridcodes, selected)
+            sites = binned_sites(lats[in_bucket], lons[in_bucket], values[in_bucket])
+            title = f"{machine}: {SURFACE_LABELS[metric].lower()} ({METRICS[metric]}), {bucket or 'all climate zones'}"
+            task_fingerprint = fingerprint(
+                zones_fingerprint, sorted(colors.items()), title, value_range, dpi, *(part.tobytes() for part in sites)
+            )
+            yield _render_map, {
+                'outputs': {
+                    os.path.join('maps', machine, f'{metric}-{bucket_slug(bucket)}.{extension}'):
+                        fingerprint(task_fingerprint, extension)
+                    for extension in formats
+                },
+                'title': title,
+                'colors': colors,
+                'sites': sites,
+                'range': value_range,
+                'unit': METRICS[metric],
+                'dpi': dpi,
+            }
+
+
+def report_tasks(store, machine, data, site_gridcodes, color_map, zones_fingerprint, extension, dpi):
+    # One task per measured site, with its readings and climate zone
+    colors = gridcode_colors(color_map)
+    ranges = store.zone_statistics(machine).ranges()
+    readings = data.drop(columns='geometry').assign(GRIDCODE=site_gridcodes)
+    for (lat, lon), site in readings.groupby(['Lat', 'Long'], sort=False):
+        # Sites closer than the rounded coordinates are told apart by the row
+        # of their first reading, which new readings don't change
+        row = int(site.index.min())
+        site = site.sort_values('Date', kind='stable')
+        gridcode = site['GRIDCODE'].iloc[0]
+        zone = None
+        if gridcode > 0:
+            zone = {
+                'GRIDCODE': int(gridcode),
+                'description': color_map.get(gridcode, (None, 'Unknown'))[1],
+                'performance': performance_class(color_map, gridcode) or 'No class',
+                **(ranges.loc[gridcode].to_dict() if gridcode in ranges.index else {}),
+            }
+        path = os.path.join('reports', machine, f'{lat:.5f}_{lon:.5f}_{row}.{extension}')
+        yield _render_report, {
+            'outputs': {path: fingerprint(
+                zones_fingerprint, sorted(colors.items()), zone, dpi, extension,
+                pd.util.hash_pandas_object(site, index=False).to_numpy().tobytes()
+            )},
+            'title': f"{machine} site at {lat}, {lon}",
+            'lat': lat,
+            'lon': lon,
+            'zone': zone,
+            'readings': site.drop(columns='GRIDCODE'),
+            'colors': colors,
+            'dpi': dpi,
+        }
+
+
+def zone_paths(zones):
+    # One matplotlib path per zone with its holes, the exteriors counter-
+    # clockwise and the holes clockwise so the holes stay empty
+    paths = []
+    for geometry in zones.geometry:
+        rings = []
+        for polygon in shapely.get_parts(geometry):
+            polygon = shapely.geometry.polygon.orient(polygon)
+            rings += [polygon.exterior, *polygon.interiors]
+        paths.append(Path.make_compound_path(*(Path(np.asarray(ring.coords)[:, :2], closed=True) for ring in rings)))
+    return paths
+
+
+# Zones, their paths and the output folder of the worker process, set once by
+# _load_worker
+_gridcodes = None
+_paths = None
+_output_dir = None
+
+
+def _load_worker(zones, output_dir):
+    # Every worker gets the simplified zones and turns them into paths once,
+    # a render only picks the colors
+    global _gridcodes, _paths, _output_dir
+    _gridcodes = zones['GRIDCODE'].to_numpy()
+    _paths = zone_paths(zones)
+    _output_dir = output_dir
+
+
+def _draw_zones(ax, colors):
+    ax.add_collection(PatchCollection(
+        [PathPatch(path) for path in _paths],
+        facecolors=[colors.get(int(code), MUTED_COLOR) for code in _gridcodes],
+        edgecolors=ZONE_STYLE['color'], linewidths=0.1, alpha=ZONE_STYLE['fillOpacity']
+    ))
+    ax.set_aspect('equal')
+
+
+def _save(figure, task):
+    # Writes the figure in the format of every output, returns the outputs
+    for path in task['outputs']:
+        path = os.path.join(_output_dir, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        figure.savefig(path, dpi=task['dpi'])
+    return task['outputs']
+
+
+def _render_map(task):
+    figure = Figure(figsize=(12, 5.2), layout='constrained')
+    ax = figure.add_subplot()
+    _draw_zones(ax, task['colors'])
+
+    lats, lons, values, counts = task['sites']
+    if len(lats):
+        points = ax.scatter(
+            lons, lats, c=values, s=8 + 10 * np.log10(counts), cmap=colormaps[SURFACE_COLORMAP],
+            norm=Normalize(*task['range']), edgecolors='black', linewidths=0.3, zorder=3
+        )
+        figure.colorbar(points, ax=ax, label=task['unit'], shrink=0.6)
+
+    ax.legend(
+        handles=[Patch(color=color, label=name) for color, name in PERFORMANCE_CLASSES.items()]
+        + [Patch(color=MUTED_COLOR, label='Other zones')],
+        loc='lower left', fontsize=8
+    )
+    ax.set_xlim(-180, 180)
+    ax.set_ylim(-60, 85)
+    ax.set_axis_off()
+    ax.set_title(task['title'])
+    return _save(figure, task)
+
+
+def _render_report(task):
+    figure = Figure(figsize=(8.27, 11.69), layout='constrained')
+    grid = figure.add_gridspec(2 + len(SERIES), 1, height_ratios=[1.2, 1.6] + [1] * len(SERIES))
+    figure.suptitle(task['title'])
+
+    # Climate zone, its ranges and the latest reading
+    readings, zone = task['readings'], task['zone']
+    lines = [f"Climate zone: {zone['description']} (GRIDCODE {zone['GRIDCODE']}), {zone['performance']}"
+             if zone else "Climate zone: outside the climate zones"]
+    if zone:
+        lines += [f"  {metric} in the zone: {zone[f'{metric}_range']}"
+                  for metric in METRICS if f'{metric}_range' in zone]
+    lines.append(f"Readings: {len(readings)}, {readings['Date'].min():%Y-%m-%d} to {readings['Date'].max():%Y-%m-%d}")
+    lines += [f"  {key}: {value}" for key, value in site_details(readings.iloc[-1]).items()]
+    text = figure.add_subplot(grid[0])
+    text.set_axis_off()
+    text.text(0, 1, '\n'.join(lines), va='top', fontsize=8, family='monospace')
+
+    # Where the site is
+    locator = figure.add_subplot(grid[1])
+    _draw_zones(locator, task['colors'])
+    locator.plot(task['lon'], task['lat'], marker='*', color='red', markersize=14, markeredgecolor='black', zorder=3)
+    locator.set_xlim(task['lon'] - 2 * LOCATOR_DEGREES, task['lon'] + 2 * LOCATOR_DEGREES)
+    locator.set_ylim(task['lat'] - LOCATOR_DEGREES, task['lat'] + LOCATOR_DEGREES)
+    locator.tick_params(labelsize=7)
+
+    series = [figure.add_subplot(grid[2])]
+    series += [figure.add_subplot(grid[2 + i], sharex=series[0]) for i in range(1, len(SERIES))]
+    plot_series(series, readings)
+    for ax in series[:-1]:
+        ax.tick_params(labelbottom=False)
+    series[-1].tick_params(axis='x', labelrotation=30)
+    return _save(figure, task)
+
+
+def read_manifest(output_dir):
+    # Fingerprint of every file written, by path relative to output_dir
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        return json.load(file)
+
+
+def write_manifest(output_dir, manifest):
+    # Written next to the files and swapped in whole, so it is never half written
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    os.makedirs(output_dir, exist_ok=True)
+    with open(path + '.tmp', 'w') as file:
+        json.dump(manifest, file, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def export(output_dir=EXPORT_DIR, machines=None, formats=FORMATS, report_format=REPORT_FORMAT, reports=True,
+           koppen_giger_data_path=KOPPEN_GIGER_PATH, workers=None, force=False, dpi=DPI):
+    """
+    Render the maps and report sheets of the machines whose inputs changed.
+
+    output_dir (str): Folder of the files and the manifest.
+    machines (list): Machine names, all machines by default.
+    formats (list): Formats of the maps, e.g. ['png', 'pdf'].
+    report_format (str): Format of the report sheets.
+    reports (bool): Whether report sheets are rendered.
+    force (bool): Render every file, even if its inputs are unchanged.
+
+    Returns:
+        dict: Number of files 'rendered' and 'skipped'.
+    """
+    workers = workers or os.cpu_count()
+    store = get_data_store(koppen_giger_data_path)
+    machines = machines or store.machine_names()
+    color_map = Color_map()
+
+    # The simplified zones are loaded (or built and cached) once and handed to
+    # every worker, the workers never read the data themselves
+    zones = store.geometry_tiers.by_gridcode(EXPORT_TOLERANCE)
+    zones_fingerprint = (source_fingerprint(store.path), EXPORT_TOLERANCE)
+
+    manifest = {} if force else read_manifest(output_dir)
+    counts = {'rendered': 0, 'skipped': 0}
+
+    def stale_tasks():
+        # Tasks reduced to the outputs whose fingerprint is not in the manifest
+        for machine in machines:
+            data = store.machine(machine)
+            site_gridcodes = store.zone_index.classify(data['Lat'], data['Long'])['GRIDCODE'].fillna(0).to_numpy(dtype='int64')
+            tasks = map_tasks(machine, data, site_gridcodes, color_map, zones_fingerprint, formats, dpi)
+            if reports:
+                tasks = [*tasks, *report_tasks(
+                    store, machine, data, site_gridcodes, color_map, zones_fingerprint, report_format, dpi
+                )]
+            for render, task in tasks:
+                outputs = {
+                    path: value for path, value in task['outputs'].items()
+                    if manifest.get(path) != value or not os.path.exists(os.path.join(output_dir, path))
+                }
+                counts['skipped'] += len(task['outputs']) - len(outputs)
+                if outputs:
+                    yield render, {**task, 'outputs': outputs}
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_load_worker,
+                             initargs=(zones, output_dir)) as executor:
+        pending = deque()
+
+        def done(future):
+            outputs = future.result()
+            manifest.update(outputs)
+            counts['rendered'] += len(outputs)
+
+        # Only a few tasks per worker are in flight, and the manifest keeps
+        # the files finished before an error or an interruption
+        try:
+            for render, task in stale_tasks():
+                pending.append(executor.submit(render, task))
+                if len(pending) >= 2 * workers:
+                    done(pending.popleft())
+            while pending:
+                done(pending.popleft())
+        finally:
+            write_manifest(output_dir, manifest)
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export static suitability maps and site reports.")
+    parser.add_argument('-o', '--output', default=EXPORT_DIR, help="Folder for the files")
+    parser.add_argument('--machines', nargs='+', default=None, help="Machines to export, all by default")
+    parser.add_argument('--formats', nargs='+', choices=FORMATS, default=list(FORMATS), help="Formats of the maps")
+    parser.add_argument('--report-format', choices=FORMATS, default=REPORT_FORMAT)
+    parser.add_argument('--no-reports', action='store_true', help="Only export the maps")
+    parser.add_argument('--zones', default=KOPPEN_GIGER_PATH, help="Climate zones shapefile")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--dpi', type=int, default=DPI)
+    parser.add_argument('--force', action='store_true', help="Render every file again")
+    args = parser.parse_args(argv)
+
+    counts = export(
+        args.output, machines=args.machines, formats=args.formats, report_format=args.report_format,
+        reports=not args.no_reports, koppen_giger_data_path=args.zones, workers=args.workers,
+        force=args.force, dpi=args.dpi
+    )
+    print(f"Rendered {counts['rendered']} files, {counts['skipped']} unchanged, into {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,20 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import panel as pn
-import pandas as pd
-from geopy.distance import geodesic
+from data_store import get_data_store, site_details, KOPPEN_GIGER_PATH, UNITS
+from scenarios import available_scenarios
+from instrumentation import timed
+
+# Worker threads for the search lookups, shared by all sessions (numpy and
+# shapely release the GIL while they work)
+SEARCH_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix='search')
 
 
 class Filters(pn.viewable.Viewer):
     def __init__(self, map, map_pane, **params):
         super().__init__(**params)
         
-        # Pass the map and map_pane
+        # Pass the map (the ClimateMap, its folium map is only built on demand) and map_pane
         self.map = map
         self.map_pane = map_pane
  
@@ -21,15 +28,38 @@ class Filters(pn.viewable.Viewer):
             }
             )
         
+        # Machines with data in the CSV folder, each is loaded when first
+        # chosen. The map's machine is selected, none without any machines
+        machines = get_data_store(map.path).machine_names()
         self.machine_dropdown=pn.widgets.Select(
             name='Choose machine',
-            options=['alpha1', 'alpha2'],
-            value='alpha1',
+            options=machines,
+            value=map.machine if map.machine in machines else None,
             styles={
                 'width':'18%'
             }
             )
         
+        # Climate scenarios with a shapefile, the map shows one and can draw
+        # where another one differs from it
+        scenarios = available_scenarios()
+        self.scenario_dropdown=pn.widgets.Select(
+            name='Climate scenario',
+            options=scenarios,
+            value=map.path if map.path in scenarios.values() else KOPPEN_GIGER_PATH,
+            styles={
+                'width':'14%'
+            }
+            )
+        self.compare_dropdown=pn.widgets.Select(
+            name='Compare with',
+            options={'No comparison': None, **scenarios},
+            value=None,
+            styles={
+                'width':'14%'
+            }
+            )
+
         # Searchbar
         self.coordinates=pn.widgets.TextInput(
             name='Coordinates',
@@ -51,17 +81,34 @@ class Filters(pn.viewable.Viewer):
         self._layout = pn.FlexBox(
             self.machine_dropdown,
             self.overview_dropdown,
+            self.scenario_dropdown,
+            self.compare_dropdown,
             self.coordinates,
             self.search_btn,
             align_items="flex-end"
 
         )
 
-        # Load the CSV file
-        self.data = pd.read_csv('files/csv/alpha1.csv')
+        # Machine data from the shared store (read-only, shared by all sessions)
+        self.machine_name = self.machine_dropdown.value
+        self.path = self.scenario_dropdown.value
+        self.zone_index = get_data_store(self.path).zone_index
+
+        # Number of the latest search. An older search still running in the
+        # worker pool stops at its next step and its result is discarded
+        self._search_generation = 0
+
+    def set_machine(self, name):
+        # Searches look at the readings of another machine from now on
+        self.machine_name = name
+
+    def set_scenario(self, path):
+        # Climate zones are looked up in another scenario from now on
+        self.path = path
+        self.zone_index = get_data_store(path).zone_index
 
     def Search(self, add_marker_callback, update_display_callback):
-        def handle_click(event):
+        async def handle_click(event):
             # gets coordiannates from the searchbar
             coordinates = self.coordinates.value.strip()
             print(f"Coordinates entered: '{coordinates}'")  
@@ -78,50 +125,91 @@ class Filters(pn.viewable.Viewer):
                 update_display_callback({"message": "Invalid format. Coordinates should be in 'latitude, longitude' format."})
                 return
 
-            
-            pn.state.curdoc.add_next_tick_callback(lambda: self.process_coordinates(coordinates, add_marker_callback, update_display_callback))
+            # The lookups run in a worker thread, so the page stays responsive
+            await self.process_coordinates(coordinates, add_marker_callback, update_display_callback)
 
         # Connect the button click event to the handler function
-        self.search_btn.on_click(handle_click)
+        self.search_btn.on_click(timed(handle_click, name='Filters.Search'))
 
-    def process_coordinates(self, coordinates, add_marker_callback, update_display_callback):
+    @timed
+    async def process_coordinates(self, coordinates, add_marker_callback, update_display_callback):
         try:
             # Parse the coordinates
             lat, lon = map(float, coordinates.split(','))
-            print(f"Searching for: {lat}, {lon}")
-
-            # Check if the coordinates are in the CSV
-            match = self.data[(self.data['Lat'] == lat) & (self.data['Long'] == lon)]
-
-            if not match.empty:
-                location_details = match.iloc[0].to_dict()
-                update_display_callback(location_details)
-                add_marker_callback((lat, lon))
-            else:
-                # Finds the closest coordinates in the dataset
-                searched_coords = (lat, lon)
-                self.data['Distance'] = self.data.apply(
-                    lambda row: geodesic(searched_coords, (row['Lat'], row['Long'])).kilometers, axis=1
-                )
-                closest_match = self.data.nsmallest(1, 'Distance').iloc[0]
-
-                closest_coords = (closest_match['Lat'], closest_match['Long'])
-                distance = closest_match['Distance']
-
-                # Update display with the closest coordinates
-                details = closest_match.to_dict()
-                details['message'] = f"Coordinates not found in the dataset. \n\n Closest coordinates at {closest_coords[0]}, {closest_coords[1]} with distance {distance:.2f} km."
-                
-                update_display_callback(details)
-                add_marker_callback((lat, lon))
-
         except ValueError:
             # Invalid coordinate format
             print("Invalid coordinates format. Ensure the format is 'latitude, longitude'.")
             update_display_callback({"message": "Invalid coordinates format. Ensure the format is 'latitude, longitude'."})
+            return
+        print(f"Searching for: {lat}, {lon}")
 
-
-       
+        # A newer search supersedes the one still running, whose result is discarded
+        self._search_generation += 1
+        generation = self._search_generation
+        self.search_btn.loading = True
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(
+                SEARCH_EXECUTOR, self.locate, lat, lon, generation
+            )
+        finally:
+            if generation == self._search_generation:
+                self.search_btn.loading = False
+        if result is None or generation != self._search_generation:
+            return
+
+        location_details, climate_info = result
+        update_display_callback(location_details)
+        add_marker_callback((lat, lon), climate_info=climate_info)
+
+    def locate(self, lat, lon, generation=None):
+        # Finds the location details and the climate zone of the coordinates,
+        # runs in a worker thread and only reads the shared data. Returns None
+        # when a newer search than generation started in the meantime
+        def superseded():
+            return generation is not None and generation != self._search_generation
+
+        # The index is taken before the data, so new readings arriving during
+        # the search can't give positions outside the data
+        store = get_data_store(self.path)
+        site_index = store.site_index(self.machine_name)
+        data = store.machine(self.machine_name)
+        if superseded():
+            return None
+
+        # Check if the coordinates are in the CSV
+        match = data[(data['Lat'] == lat) & (data['Long'] == lon)]
+
+        if not match.empty:
+            location_details = site_details(match.iloc[0])
+        else:
+            # Finds the closest coordinates in the dataset, the index only
+            # computes exact distances for a shortlist of close sites
+            positions, distances = site_index.nearest(lat, lon, k=1)
+            if superseded():
+                return None
+            closest_match = data.iloc[positions[0]]
+
+            closest_coords = (closest_match['Lat'], closest_match['Long'])
+            distance = distances[0]
+
+            # Update display with the closest coordinates
+            location_details = site_details(closest_match)
+            location_details['Distance'] = distance
+            location_details['message'] = f"Coordinates not found in the dataset. \n\n Closest coordinates at {closest_coords[0]}, {closest_coords[1]} with distance {distance:.2f} km."
+
+            # Estimate at the coordinates from the interpolated surface, a
+            # lookup in a cached array. There is none while the machine's
+            # first surface is being built
+            surface = store.surface(self.machine_name)
+            estimate = surface.estimate(lat, lon) if surface is not None else None
+            if estimate:
+                location_details['message'] += " \n\n Estimated here: " + ", ".join(
+                    f"{value:.4g} {UNITS[metric]}" for metric, value in estimate.items() if value == value
+                ) + "."
+
+        if superseded():
+            return None
+        return location_details, self.zone_index.lookup(lat, lon)
 
     # Expose the layout for rendering
     def __panel__(self):
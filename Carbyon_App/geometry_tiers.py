@@ -0,0 +1,154 @@
+"""
+Simplified versions of the climate zones for drawing at low zoom levels, and
+the zones dissolved per GRIDCODE.
+
+The tiers and dissolves are cached in files/cache (GeoParquet with pyarrow, otherwise GeoPackage) and can be built ahead of serving the app:
+
+    python geometry_tiers.py
+"""
+import os
+import threading
+import geopandas as gpd
+import numpy as np
+import shapely
+from columnar_cache import CACHE_DIR, cache_path, geo_extension, read_geo, write_geo, _replace_stale
+
+# Simplification tolerances in degrees, the exact geometry is tolerance 0
+TOLERANCES = (0.5, 1.0, 2.0)
+
+# A tier is used while its tolerance is at most this many screen pixels
+MAX_PIXELS = 3
+
+
+def degrees_per_pixel(zoom):
+    # Width of a screen pixel in degrees of longitude for a web map zoom level
+    return 360 / (256 * 2 ** zoom)
+
+
+def tolerance_for_zoom(zoom):
+    # Largest tolerance which is still invisible at the zoom level (0 = exact)
+    fitting = [tolerance for tolerance in TOLERANCES if tolerance <= MAX_PIXELS * degrees_per_pixel(zoom)]
+    return max(fitting, default=0)
+
+
+def simplify_zones(zones, tolerance):
+    """
+    Simplify the climate zones without opening gaps between neighbours.
+
+    zones (GeoDataFrame): Climate zones.
+    tolerance (float): Simplification tolerance in degrees.
+
+    Returns:
+        GeoDataFrame: GRIDCODE and the simplified geometry, in the same order.
+    """
+    geometries = zones.geometry.to_numpy()
+    if hasattr(shapely, 'coverage_simplify'):
+        # Shared borders are simplified once, so neighbouring zones still touch
+        simplified = shapely.coverage_simplify(geometries, tolerance)
+    else:
+        simplified = shapely.simplify(geometries, tolerance, preserve_topology=True)
+    return gpd.GeoDataFrame({'GRIDCODE': zones['GRIDCODE'].to_numpy()}, geometry=simplified, crs=zones.crs)
+
+
+def dissolve_zones(zones, by):
+    """
+    Merge the zones of every group into one MultiPolygon, dropping the borders
+    inside the group.
+
+    zones (GeoDataFrame): Climate zones.
+    by (str): Column with the group of each zone, e.g. GRIDCODE.
+
+    Returns:
+        GeoDataFrame: The group and its geometry, one row per group.
+    """
+    return zones[[by, 'geometry']].dissolve(by=by, as_index=False)
+
+
+class GeometryTiers:
+    """
+    Simplified climate zones per tolerance, kept in memory and cached on disk.
+
+    The exact zones stay in the DataStore for point lookups, these are only
+    for drawing the map.
+    """
+
+    def __init__(self, zones, source_path, cache_dir=CACHE_DIR):
+        self.zones = zones
+        self.source_path = source_path
+        self.cache_dir = cache_dir
+        self._tiers = {}
+        self._trees = {}
+        self._lock = threading.Lock()
+
+    def cache_path(self, tolerance):
+        return cache_path(self.source_path, f'tol{tolerance:g}', geo_extension(), self.cache_dir)
+
+    def _cached(self, key, suffix, build):
+        # A derived layer from memory, disk or built now
+        with self._lock:
+            if key not in self._tiers:
+                path = cache_path(self.source_path, suffix, geo_extension(), self.cache_dir)
+                if os.path.exists(path):
+                    layer = read_geo(path)
+                else:
+                    layer = build()
+                    write_geo(layer, path)
+                    _replace_stale(path)
+                self._tiers[key] = layer
+            return self._tiers[key]
+
+    def tier(self, tolerance):
+        # Zones simplified with the tolerance, from memory, disk or built now
+        if not tolerance:
+            return self.zones[['GRIDCODE', 'geometry']]
+        return self._cached(tolerance, f'tol{tolerance:g}', lambda: simplify_zones(self.zones, tolerance))
+
+    def for_zoom(self, zoom):
+        return self.tier(tolerance_for_zoom(zoom))
+
+    def clipped(self, tolerance, west, south, east, north):
+        """
+        Zones of a tier dissolved per GRIDCODE (see by_gridcode) and cut to a
+        box, for drawing part of the world.
+
+        tolerance (float): Tolerance of the tier, 0 for the exact zones.
+        west, south, east, north (float): Bounds of the box in degrees.
+
+        Returns:
+            GeoDataFrame: GRIDCODE and the part inside the box of every
+            GRIDCODE overlapping it.
+        """
+        tier = self.by_gridcode(tolerance)
+        with self._lock:
+            if tolerance not in self._trees:
+                self._trees[tolerance] = shapely.STRtree(tier.geometry.to_numpy())
+            tree = self._trees[tolerance]
+        positions = np.sort(tree.query(shapely.box(west, south, east, north)))
+        geometry = shapely.clip_by_rect(tier.geometry.to_numpy()[positions], west, south, east, north)
+        inside = ~shapely.is_empty(geometry)
+        return gpd.GeoDataFrame(
+            {'GRIDCODE': tier['GRIDCODE'].to_numpy()[positions][inside]}, geometry=geometry[inside], crs=tier.crs
+        )
+
+    def by_gridcode(self, tolerance):
+        # One MultiPolygon per GRIDCODE of the tier, for drawing a few dozen
+        # features instead of every zone
+        tier = self.tier(tolerance)
+        return self._cached(
+            ('GRIDCODE', tolerance), f'byGRIDCODE_tol{tolerance:g}', lambda: dissolve_zones(tier, 'GRIDCODE')
+        )
+
+    def build_all(self):
+        # Preprocessing step: makes sure every tier and dissolve is cached on disk
+        tiers = {tolerance: self.tier(tolerance) for tolerance in TOLERANCES}
+        for tolerance in TOLERANCES:
+            self.by_gridcode(tolerance)
+        return tiers
+
+
+if __name__ == '__main__':
+    from data_store import get_data_store
+    tiers = get_data_store().geometry_tiers
+    for tolerance, tier in tiers.build_all().items():
+        print(f"tolerance {tolerance:g}: {shapely.get_num_coordinates(tier.geometry.to_numpy()).sum()} "
+              f"vertices -> {tiers.cache_path(tolerance)}")
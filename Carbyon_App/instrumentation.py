@@ -0,0 +1,208 @@
+"""
+Timing and payload metrics of the Panel app, shared by every session of the
+server process.
+
+Callbacks decorated with @timed record how long they take and the live map
+records the bytes it sends to the browser. The numbers are shown by the
+metrics page:
+
+    panel serve app.py metrics.py
+
+Callbacks slower than CARBYON_SLOW_CALLBACK_MS (default 500) are logged. With
+profiling switched on (CARBYON_PROFILE=1 or the switch on the metrics page)
+their cProfile output is saved to files/cache/profiles.
+"""
+import cProfile
+import functools
+import inspect
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+import numpy as np
+import panel as pn
+from columnar_cache import CACHE_DIR
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+SLOW_CALLBACK_MS = float(os.environ.get('CARBYON_SLOW_CALLBACK_MS', 500))
+PROFILE_DIR = os.path.join(CACHE_DIR, 'profiles')
+
+# Durations kept per callback for the percentiles
+RECENT_CALLS = 500
+
+
+def process_memory():
+    # Resident memory of the server process in bytes, None where it can't be read
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        if resource is None:
+            return None
+        # Peak instead of current memory where /proc is not available (kB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class Metrics:
+    """
+    Callback timings, payload sizes and open sessions of the server process.
+    """
+
+    def __init__(self):
+        self.profiling = os.environ.get('CARBYON_PROFILE', '') not in ('', '0')
+        self._timings = {}
+        self._payloads = {}
+        self._sessions = {}
+        self._memory_before_sessions = None
+        self._lock = threading.Lock()
+
+    def record_timing(self, name, seconds):
+        with self._lock:
+            stats = self._timings.setdefault(name, {'count': 0, 'total': 0.0, 'max': 0.0,
+                                                    'recent': deque(maxlen=RECENT_CALLS)})
+            stats['count'] += 1
+            stats['total'] += seconds
+            stats['max'] = max(stats['max'], seconds)
+            stats['recent'].append(seconds)
+
+    def record_payload(self, kind, nbytes):
+        with self._lock:
+            stats = self._payloads.setdefault(kind, {'count': 0, 'bytes': 0, 'max': 0})
+            stats['count'] += 1
+            stats['bytes'] += nbytes
+            stats['max'] = max(stats['max'], nbytes)
+
+    def session_started(self, session_id):
+        with self._lock:
+            if self._memory_before_sessions is None:
+                self._memory_before_sessions = process_memory()
+            self._sessions[session_id] = time.time()
+
+    def session_ended(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: Current callback, payload, session and memory metrics.
+        """
+        memory = process_memory()
+        with self._lock:
+            callbacks = {
+                name: {
+                    'count': stats['count'],
+                    'mean_ms': 1000 * stats['total'] / stats['count'],
+                    'p95_ms': 1000 * float(np.percentile(stats['recent'], 95)),
+                    'max_ms': 1000 * stats['max'],
+                }
+                for name, stats in self._timings.items()
+            }
+            payloads = {kind: dict(stats) for kind, stats in self._payloads.items()}
+            sessions = len(self._sessions)
+            baseline = self._memory_before_sessions
+
+        return {
+            'callbacks': callbacks,
+            'payloads': payloads,
+            'sessions': sessions,
+            'memory_bytes': memory,
+            # Growth of the process since the first session, spread over the open ones
+            'memory_per_session_bytes': (memory - baseline) / sessions if sessions and memory and baseline else None,
+        }
+
+    def reset(self):
+        with self._lock:
+            self._timings.clear()
+            self._payloads.clear()
+
+
+METRICS = Metrics()
+
+# Only the outermost timed callback of a thread is profiled
+_profiling = threading.local()
+
+
+def _profile_name(name):
+    return os.path.join(PROFILE_DIR, f"{re.sub(r'[^A-Za-z0-9_.-]', '_', name)}-{time.strftime('%Y%m%d-%H%M%S')}.prof")
+
+
+def _start_profile():
+    if not METRICS.profiling or getattr(_profiling, 'active', False):
+        return None
+    _profiling.active = True
+    profile = cProfile.Profile()
+    profile.enable()
+    return profile
+
+
+def _finish(name, seconds, profile):
+    METRICS.record_timing(name, seconds)
+    if profile is not None:
+        profile.disable()
+        _profiling.active = False
+    if seconds * 1000 >= SLOW_CALLBACK_MS:
+        logger.warning("Slow callback %s: %.0f ms", name, seconds * 1000)
+        if profile is not None:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            path = _profile_name(name)
+            profile.dump_stats(path)
+            logger.warning("Profile of %s saved to %s", name, path)
+
+
+def timed(func=None, *, name=None):
+    """
+    Record the duration of every call of a callback (sync or async).
+
+    func (callable): The callback.
+    name (str): Name in the metrics, the qualified function name by default.
+
+    Returns:
+        callable: The callback with timing around it.
+    """
+    if func is None:
+        return functools.partial(timed, name=name)
+    name = name or func.__qualname__
+
+    if inspect.iscoroutinefunction(func):
+        # The profile of an async callback also covers what ran on the event
+        # loop while it was waiting
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            profile = _start_profile()
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                _finish(name, time.perf_counter() - start, profile)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profile = _start_profile()
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _finish(name, time.perf_counter() - start, profile)
+    return wrapper
+
+
+def track_session():
+    # Counts the current session as open until Panel destroys it
+    doc = pn.state.curdoc
+    if doc is None or doc.session_context is None:
+        return
+    METRICS.session_started(doc.session_context.id)
+    pn.state.on_session_destroyed(lambda session_context: METRICS.session_ended(session_context.id))
@@ -0,0 +1,101 @@
+import param
+from panel.custom import JSComponent
+from instrumentation import METRICS
+from render_cache import json_size
+
+
+class LiveMap(JSComponent):
+    """
+    Shows a rendered folium map and passes small messages into it, so the map
+    in the browser can be changed in place instead of sending its HTML again.
+
+    Messages are dictionaries with a 'type' key, handled inside the map by the
+    elements in map_elements.py. Messages sent with a key are remembered and
+    sent again whenever the map (re)loads in the browser.
+    """
+
+    html = param.String(default='', doc="Full HTML document of the folium map.")
+
+    _esm = """
+    export function render({ model, el }) {
+      // Same aspect ratio as the folium notebook output
+      const wrapper = document.createElement('div')
+      wrapper.style.cssText = 'position: relative; width: 100%; height: 0; padding-bottom: 60%;'
+      const iframe = document.createElement('iframe')
+      iframe.style.cssText = 'position: absolute; width: 100%; height: 100%; left: 0; top: 0; border: none;'
+      wrapper.appendChild(iframe)
+      el.appendChild(wrapper)
+
+      // Messages wait until the map inside the iframe has loaded
+      let loaded = false
+      let queue = []
+      const post = (msg) => {
+        if (loaded) {
+          iframe.contentWindow.postMessage(msg, '*')
+        } else {
+          queue.push(msg)
+        }
+      }
+      iframe.addEventListener('load', () => {
+        loaded = true
+        queue.forEach(post)
+        queue = []
+        model.send_msg({type: 'ready'})
+      })
+      const load = () => {
+        loaded = false
+        queue = []
+        iframe.srcdoc = model.html
+      }
+      load()
+      model.on('html', load)
+      model.on('msg:custom', post)
+
+      // Messages from the map (e.g. clicks on popup buttons) go back to Python
+      const receive = (event) => {
+        if (event.source === iframe.contentWindow && event.data && event.data.type) {
+          model.send_msg(event.data)
+        }
+      }
+      window.addEventListener('message', receive)
+      model.on('remove', () => window.removeEventListener('message', receive))
+    }
+    """
+
+    def __init__(self, **params):
+        super().__init__(**params)
+        self._replay = {}
+        self._handlers = {}
+
+        # The page is counted whenever it is sent, messages in send()
+        self._record_page()
+        self.param.watch(self._record_page, 'html')
+
+    def _record_page(self, *events):
+        METRICS.record_payload('page', len(self.html.encode()))
+
+    def send(self, message, key=None, replay=None):
+        # Sends a message to the map, remembering it (or replay, e.g. the full
+        # state when the message only holds a change) under the key so a
+        # reloaded map gets the latest state again
+        if key is not None:
+            self._replay[key] = message if replay is None else replay
+        METRICS.record_payload(f"message:{message.get('type')}", json_size(message))
+        self._send_msg(message)
+
+    def forget(self, key):
+        self._replay.pop(key, None)
+
+    def on(self, message_type, callback):
+        # Registers a callback for messages of the given type coming from the map
+        self._handlers.setdefault(message_type, []).append(callback)
+
+    def _handle_msg(self, data):
+        if data.get('type') == 'ready':
+            for message in self._replay.values():
+                METRICS.record_payload(f"replay:{message.get('type')}", json_size(message))
+                self._send_msg(message)
+            return
+        for callback in self._handlers.get(data.get('type'), []):
+            callback(data)
+
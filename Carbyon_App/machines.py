@@ -0,0 +1,308 @@
+import itertools
+import logging
+import os
+import threading
+from collections import deque, OrderedDict
+import pandas as pd
+from range_index import RangeIndex
+from site_clusters import SiteClusters
+from site_index import SiteIndex
+from telemetry import TelemetryTail, telemetry_paths
+from zone_stats import ZoneStatistics
+
+logger = logging.getLogger(__name__)
+
+# Machines kept in memory at once, the least recently used one is dropped first
+MAX_LOADED_MACHINES = 4
+
+# Appends a machine remembers the touched zones of, a session further behind
+# refreshes every zone
+MAX_CHANGES = 256
+
+# Numbers every load of a machine, so a machine loaded again after being
+# dropped is never mistaken for the earlier load
+_generations = itertools.count()
+
+
+def _concat_readings(data, readings):
+    # Appends readings, adding their new categories (e.g. machine IDs) to the
+    # categorical columns first so these stay categorical
+    for column in data.select_dtypes('category').columns:
+        if column not in readings:
+            continue
+        categories = data[column].cat.categories
+        new = pd.Index(readings[column].dropna().unique()).difference(categories)
+        dtype = pd.CategoricalDtype(categories.append(new))
+        data = data.assign(**{column: data[column].cat.add_categories(new)})
+        readings = readings.assign(**{column: readings[column].astype(dtype)})
+
+    # Readings may hold fewer columns, the metadata (e.g. units) of the data is kept
+    combined = pd.concat([data, readings])
+    combined.attrs = dict(data.attrs)
+    return combined
+
+
+def _combine_readings(data, pending):
+    # The data with every batch of readings appended since it was combined,
+    # copied once however many batches there are
+    return _concat_readings(data, pending[0] if len(pending) == 1 else pd.concat(pending))
+
+
+class Machine:
+    """
+    The readings of one machine with the structures derived from them. The zone
+    statistics are computed on load, the search indexes on first use.
+
+    New readings are added with append(). The indexes are replaced by extended
+    copies, so readers holding the previous ones are not affected. The readings
+    themselves are kept as batches and only combined into a new data frame
+    when the data is read, so an append costs the size of its readings.
+
+    name (str): Machine name, e.g. alpha1.
+    data (GeoDataFrame): The machine readings.
+    zone_index (ZoneIndex): Spatial index of the climate zones.
+    """
+
+    def __init__(self, name, data, zone_index):
+        self.name = name
+        self._data = data
+        self._pending = []
+        self._rows = len(data)
+        self.zone_index = zone_index
+        self.zone_statistics = ZoneStatistics(zone_index, data)
+        self.generation = next(_generations)
+        self.version = 0
+        self._changes = deque(maxlen=MAX_CHANGES)
+        self._site_index = None
+        self._range_index = None
+        self._site_clusters = None
+        self._lock = threading.Lock()
+
+    @property
+    def data(self):
+        # The readings, combining the batches appended since the last read.
+        # They are combined outside the lock, which appends and searches take
+        with self._lock:
+            data, pending = self._data, list(self._pending)
+        if not pending:
+            return data
+        combined = _combine_readings(data, pending)
+        with self._lock:
+            # Unless another reader combined them first
+            if self._data is data:
+                self._data = combined
+                del self._pending[:len(pending)]
+        return combined
+
+    def _combined(self):
+        # The readings, with the lock held
+        if self._pending:
+            self._data = _combine_readings(self._data, self._pending)
+            self._pending = []
+        return self._data
+
+    @property
+    def site_index(self):
+        with self._lock:
+            if self._site_index is None:
+                self._site_index = SiteIndex(self._combined())
+            return self._site_index
+
+    @property
+    def range_index(self):
+        with self._lock:
+            if self._range_index is None:
+                self._range_index = RangeIndex(self.zone_index, self._combined())
+            return self._range_index
+
+    @property
+    def site_clusters(self):
+        with self._lock:
+            if self._site_clusters is None:
+                self._site_clusters = SiteClusters(self._combined())
+            return self._site_clusters
+
+    def append(self, readings):
+        # Adds new readings, only the zones they fall in are recomputed. The
+        # readings get the columns of the data, missing ones are left empty
+        with self._lock:
+            readings = readings.reindex(columns=self._data.columns)
+            readings = readings.set_axis(pd.RangeIndex(self._rows, self._rows + len(readings)))
+            assigned = self.zone_statistics.update(readings)
+
+            # The readings are added before the indexes are extended, so a
+            # reader taking an index first always finds the index's rows in the data
+            self._pending.append(readings)
+            self._rows += len(readings)
+            if self._site_index is not None:
+                self._site_index = self._site_index.extended(readings)
+            if self._range_index is not None:
+                self._range_index = self._range_index.extended(self.zone_index, readings)
+            if self._site_clusters is not None:
+                self._site_clusters = self._site_clusters.extended(readings)
+
+            self.version += 1
+            self._changes.append((self.version, frozenset(assigned['GRIDCODE'].tolist())))
+
+    @property
+    def data_version(self):
+        # Identifies the data as it is now, e.g. for cache keys
+        return self.generation, self.version
+
+    def changes_since(self, version):
+        """
+        Zones which got new readings after a version of the machine.
+
+        version (int): Version the caller last saw.
+
+        Returns:
+            tuple: The current version and the set of GRIDCODEs, None when the
+            version is too old to tell (everything should be refreshed).
+        """
+        with self._lock:
+            changes = [gridcodes for changed, gridcodes in self._changes if changed > version]
+            if len(changes) < self.version - version:
+                return self.version, None
+            return self.version, set().union(*changes)
+
+
+class MachineRegistry:
+    """
+    Finds the machines in a folder (one <machine>.csv per machine) and loads
+    each one on first use, keeping at most max_loaded of them in memory.
+
+    A loaded machine also gets the readings appended to its telemetry files
+    (see telemetry.py), poll() adds the ones which arrived since the last poll.
+
+    csv_dir (str): Folder with the machine CSVs.
+    zone_index (ZoneIndex): Spatial index of the climate zones.
+    load (callable): Turns a CSV path into the machine's GeoDataFrame.
+    parse_readings (callable): Turns raw telemetry rows into the same form.
+    telemetry_dir (str): Folder with the telemetry files, None to ignore them.
+    on_change (callable): Called with the machine name after new readings were added.
+    """
+
+    def __init__(self, csv_dir, zone_index, load, parse_readings=None, telemetry_dir=None,
+                 on_change=None, max_loaded=MAX_LOADED_MACHINES):
+        self.csv_dir = csv_dir
+        self.zone_index = zone_index
+        self.load = load
+        self.parse_readings = parse_readings
+        self.telemetry_dir = telemetry_dir
+        self.on_change = on_change
+        self.max_loaded = max_loaded
+        self._loaded = OrderedDict()
+        self._tails = {}
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self._poll_lock = threading.Lock()
+
+    def names(self):
+        # Machines with a CSV in the folder, looked up again on every call so
+        # new machines show up without a restart
+        return sorted(
+            os.path.splitext(name)[0] for name in os.listdir(self.csv_dir) if name.endswith('.csv')
+        )
+
+    def path(self, name):
+        return os.path.join(self.csv_dir, f'{name}.csv')
+
+    def get(self, name):
+        # Returns the loaded machine, loading it (and dropping the least
+        # recently used one if needed) on first use. Machines are loaded
+        # outside the registry lock, so loading one doesn't hold up the others
+        with self._lock:
+            if name in self._loaded:
+                self._loaded.move_to_end(name)
+                return self._loaded[name]
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+
+        # Threads asking for the same machine wait for a single load
+        with load_lock:
+            with self._lock:
+                if name in self._loaded:
+                    self._loaded.move_to_end(name)
+                    return self._loaded[name]
+
+            if not os.path.exists(self.path(name)):
+                raise KeyError(f"No data for machine '{name}' in {self.csv_dir}")
+            machine, tails = self._load_machine(name)
+
+            with self._lock:
+                self._loaded[name] = machine
+                self._tails[name] = tails
+                while len(self._loaded) > self.max_loaded:
+                    evicted, _ = self._loaded.popitem(last=False)
+                    self._tails.pop(evicted, None)
+            return machine
+
+    def _load_machine(self, name):
+        # The readings which arrived so far are part of the loaded data,
+        # later ones are added by poll()
+        data = self.load(self.path(name))
+        tails = self._open_tails(name)
+        try:
+            readings = self._read_tails(tails)
+            if readings is not None:
+                readings = readings.reindex(columns=data.columns)
+                data = _concat_readings(
+                    data, readings.set_axis(pd.RangeIndex(len(data), len(data) + len(readings)))
+                )
+            for tail in tails:
+                tail.commit()
+        except Exception:
+            logger.exception("Live readings of %s could not be added, they are read again on the next poll", name)
+        return Machine(name, data, self.zone_index), tails
+
+    def loaded(self):
+        # Names of the machines currently in memory, least recently used first
+        return list(self._loaded)
+
+    def poll(self):
+        """
+        Add the readings appended to the telemetry files of the loaded machines
+        since the last poll. When another thread is already polling this one
+        returns straight away.
+
+        Returns:
+            dict: Number of new readings per machine which got any.
+        """
+        if not self._poll_lock.acquire(blocking=False):
+            return {}
+        try:
+            with self._lock:
+                loaded = [(machine, self._tails[name]) for name, machine in self._loaded.items()]
+
+            added = {}
+            for machine, tails in loaded:
+                # The files only move on once the readings are added, and one
+                # machine's bad readings don't stop the others
+                try:
+                    readings = self._read_tails(tails)
+                    if readings is not None:
+                        machine.append(readings)
+                except Exception:
+                    logger.exception("New readings of %s could not be added, they are read again on the next poll",
+                                     machine.name)
+                    continue
+                for tail in tails:
+                    tail.commit()
+                if readings is not None:
+                    added[machine.name] = len(readings)
+                    if self.on_change is not None:
+                        self.on_change(machine.name)
+            return added
+        finally:
+            self._poll_lock.release()
+
+    def _open_tails(self, name):
+        if self.telemetry_dir is None or self.parse_readings is None:
+            return []
+        return [TelemetryTail(path) for path in telemetry_paths(self.telemetry_dir, name)]
+
+    def _read_tails(self, tails):
+        # New readings of all of a machine's telemetry files, None if there are none
+        frames = [frame for frame in (tail.read() for tail in tails) if frame is not None and len(frame)]
+        if not frames:
+            return None
+        return self.parse_readings(pd.concat(frames, ignore_index=True))
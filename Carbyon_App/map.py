@@ -1,79 +1,93 @@
+import logging
 import os
+import uuid
 import folium
-import geopandas as gpd
-import pandas as pd
 import panel as pn
+from panel.io.state import set_curdoc
 from legend import climate_map_legend
 from color_map import Color_map
 from performance import performance_filter
-import shapely
-from shapely.geometry import Point
-
-def create_map(koppen_giger_data_path: str, color_map):
-    # Load the shapefile with geodata for the climate zones into a GeoDataFrame
-    koppen_giger_data = gpd.read_file(koppen_giger_data_path)
-
-    # Load the CSV which contains the additional data (CostsToCapture and EnergyRequirements)
-    additional_data = pd.read_csv('files/csv/alpha1.csv')
-    additional_data['CostsToCapture'] = additional_data['CostsToCapture'].str.extract(r'(\d+(\.\d+)?)')[0].astype(float)
-    additional_data['EnergyRequirements'] = additional_data['EnergyRequirements'].str.extract(r'(\d+(\.\d+)?)')[0].astype(float)
-
-    # Create a GeoDataFrame for the additional data with Lat, Long columns
-    additional_data['geometry'] = additional_data.apply(
-        lambda row: Point(row['Long'], row['Lat']), axis=1
-    )
-    additional_data_gdf = gpd.GeoDataFrame(additional_data, geometry='geometry', crs="EPSG:4326")
-
-    # Make the shapefile in the same format as the additional one
-    koppen_giger_data = koppen_giger_data.to_crs(epsg=4326)
-
-    # Spatial join to combine the two datasets (additional and koppen)
-    joined_data = gpd.sjoin(koppen_giger_data, additional_data_gdf, how="left", predicate='intersects')
-
-    # Map GRIDCODES to colors
-    joined_data['color'] = joined_data['GRIDCODE'].map(lambda x: color_map.get(x, ('gray', 'Unknown'))[0])
-    joined_data['description'] = joined_data['GRIDCODE'].map(lambda x: color_map.get(x, ('gray', 'Unknown'))[1])
-
-    # range data calculationg the ranges for CostsToCapture and EnergyRequirements
-    range_data = joined_data.groupby('GRIDCODE').agg({
-        'CostsToCapture': lambda x: f"{x.min()} - {x.max()} €/ton",
-        'EnergyRequirements': lambda x: f"{x.min()} - {x.max()} kWh/ton"
-    }).reset_index()
-
-    # Merge the range_data data back into the joined data
-    joined_data = joined_data.merge(range_data, on='GRIDCODE', suffixes=('', '_range'))
-    
+from data_store import get_data_store, DEFAULT_MACHINE, UNITS
+from map_elements import (
+    GridcodeStyle, MarkerLayer, MessageReceiver, SiteClusters, SiteHighlight, SurfaceOverlay,
+    ZONE_STYLE, ZoneChanges, ZoneProperties, ZoneTiers, ZoneTiles, gridcode_colors
+)
+from geometry_tiers import tolerance_for_zoom
+from zone_tiles import ready_tiles, tiles_built, MAX_TILE_ZOOM, ZONE_TILES_URL
+from live_map import LiveMap
+from render_cache import RENDER_CACHE, json_size
+from instrumentation import timed
+from columnar_cache import source_fingerprint
+from scenarios import zone_changes_geojson
+from surface import MAX_MERCATOR_LAT, SURFACE_LABELS, surface_colors
+from zone_stats import METRICS
+
+logger = logging.getLogger(__name__)
+
+# Zoom level the map opens at
+ZOOM_START = 3
+
+# Share of the view's width and height the exact zones are sent for around
+# it, so panning a little needs no new zones
+EXACT_VIEW_MARGIN = 0.5
+
+# Most sites drawn for a range filter, to keep the message small
+MAX_HIGHLIGHTED_SITES = 2000
+
+# Default of add_marker's climate_info, None already means "outside the zones"
+NOT_LOOKED_UP = object()
+
+
+def zone_range_properties(zone_statistics):
+    # GRIDCODE -> {field: value} of the cost and energy ranges in the zone tooltips
+    return {int(code): values.to_dict() for code, values in zone_statistics.ranges().iterrows()}
+
+
+def create_map(koppen_giger_data_path: str, color_map, tiles_url=ZONE_TILES_URL, machine=DEFAULT_MACHINE):
+    # The climate zones (already in EPSG:4326) and the machine data come from the
+    # process-wide store, so nothing is read from disk here
+    store = get_data_store(koppen_giger_data_path)
+
+    # Cost and energy ranges per GRIDCODE from the precomputed zone statistics
+    range_data = store.zone_statistics(machine).ranges()
+
+    # Tooltip values of every GRIDCODE, computed for the whole column at once
+    zone_properties = range_data.copy()
+    zone_properties.insert(0, 'description', zone_properties.index.map(
+        {code: value[1] for code, value in color_map.items()}
+    ).fillna('Unknown'))
+
     # Creates a centered folium map
-    m = folium.Map(location=(30, 10), zoom_start=3, tiles="cartodb positron")
+    m = folium.Map(location=(30, 10), zoom_start=ZOOM_START, tiles="cartodb positron")
 
     # Creates a feature group for the climate zone which makes removing
     # the layer with the colors possible
     climate_zones_fg = folium.FeatureGroup(name="Climate Zones", show=True)
 
-    # Adds features to the climate zones (pop ups, colors)
-    for _, row in joined_data.iterrows():
-        geojson_feature = {
-            'type': 'Feature',
-            'geometry': row['geometry'].__geo_interface__,
-            'properties': {
-                'description': row['description'],
-                'GRIDCODE': row['GRIDCODE'],
-                'CostsToCapture_range': row['CostsToCapture_range'],
-                'EnergyRequirements_range': row['EnergyRequirements_range']
-            }
-        }
-
-        fields = ['description', 'CostsToCapture_range', 'EnergyRequirements_range']
-        aliases = ['Climate Zone:', 'Costs to Capture (Range):', 'Energy Requirements (Range):']
-  
-        folium.GeoJson(
-            geojson_feature,
-            style_function=lambda x, color=row['color']: {
-                'fillColor': color,
-                'color': 'black',
-                'weight': 0.5,
-                'fillOpacity': 0.6,
-            },
+    fields = ['description', 'CostsToCapture_range', 'EnergyRequirements_range']
+    aliases = ['Climate Zone:', 'Costs to Capture (Range):', 'Energy Requirements (Range):']
+
+    # The browser downloads the zones in view from the tile endpoint, the page
+    # itself only holds the tooltip values per GRIDCODE. Until the tiles are
+    # built (in the background) the zones are put in the page
+    tileset = ready_tiles(store.geometry_tiers) if tiles_url else None
+    if tileset:
+        zones_layer = ZoneTiles(
+            url=f"{tiles_url}/{os.path.basename(tileset)}",
+            max_zoom=MAX_TILE_ZOOM,
+            properties={int(code): values.to_dict() for code, values in zone_properties[fields].iterrows()},
+            fields=fields,
+            aliases=aliases
+        )
+        climate_zones_fg.add_child(zones_layer)
+    else:
+        # All the climate zones go in one GeoJson layer with a single tooltip. The
+        # polygons are simplified as far as is invisible at the opening zoom
+        # level and dissolved into one feature per GRIDCODE
+        zones = store.geometry_tiers.by_gridcode(tolerance_for_zoom(ZOOM_START)).join(zone_properties, on='GRIDCODE')
+        zones_layer = folium.GeoJson(
+            zones.to_json(drop_id=True),
+            control=False,
             tooltip=folium.GeoJsonTooltip(
                 fields=fields,
                 aliases=aliases,
@@ -84,9 +98,28 @@ def create_map(koppen_giger_data_path: str, color_map):
             )
         ).add_to(climate_zones_fg)
 
+        # Lets a machine switch update the tooltip values in place, and the
+        # zoom level swap the geometry tier
+        properties = ZoneProperties(zones_layer)
+        zones_layer.add_child(properties)
+        zones_layer.add_child(ZoneTiers(zones_layer, properties, tolerance_for_zoom(ZOOM_START)))
+
+    # The zones are colored in the browser by looking up the GRIDCODE. Tiles
+    # draw the borders separately, so their zones have no stroke
+    zone_style = dict(ZONE_STYLE, stroke=False) if tileset else ZONE_STYLE
+    zones_layer.add_child(GridcodeStyle(zones_layer, color_map, zone_style))
+
     # Adds the feature group with the climate zones colors to the folium map
     climate_zones_fg.add_to(m)
 
+    # Lets the live map pane change the map in place (e.g. recolor it, add markers)
+    m.add_child(MessageReceiver())
+    m.add_child(MarkerLayer())
+    m.add_child(SiteClusters(UNITS['CostsToCapture']))
+    m.add_child(SiteHighlight())
+    m.add_child(ZoneChanges())
+    m.add_child(SurfaceOverlay())
+
     # Adds the layer control on the top right corner
     folium.LayerControl().add_to(m)
 
@@ -98,99 +131,360 @@ def create_map(koppen_giger_data_path: str, color_map):
 
 
 class ClimateMap(pn.viewable.Viewer):
-    def __init__(self, koppen_giger_data_path: str, color_map=None, map=None, map_pane=None, **params):
+    def __init__(self, koppen_giger_data_path: str, color_map=None, map=None, map_pane=None,
+                 machine=DEFAULT_MACHINE, **params):
         super().__init__(**params)
         self.path = os.path.abspath(koppen_giger_data_path)
+        self.machine = machine
         self.original_color_map = color_map if color_map else Color_map()
         self.color_map = self.original_color_map  
 
-        # If the map and map_pane variables are not set, create new ones
+        # Key of the color map in the render cache
+        self._color_key = tuple(sorted(gridcode_colors(self.original_color_map).items()))
+
+        # If the map and map_pane variables are not set, create new ones. The
+        # page is rendered once per version of the data and shared by sessions
+        self._folium_map = map
         if map and map_pane:
-            self.map = map
             self.map_pane = map_pane
         else:
-            self.map = create_map(self.path, self.color_map)
-            self.map_pane = pn.pane.HTML(self.map._repr_html_())
+            self.map_pane = LiveMap(html=RENDER_CACHE.get_or_render(self._render_key(), self._render_html))
 
         self._layout = pn.Column(self.map_pane)
 
-        self.koppen_giger_data = gpd.read_file(self.path)
-
-        # Add color and description columns based on GRIDCODE
-        self.koppen_giger_data['color'] = self.koppen_giger_data['GRIDCODE'].map(
-            lambda x: self.color_map.get(x, ('gray', 'Unknown'))[0]
-        )
-        self.koppen_giger_data['description'] = self.koppen_giger_data['GRIDCODE'].map(
-            lambda x: self.color_map.get(x, ('gray', 'Unknown'))[1]
-        )
+        # Search markers on the map by id, the browser is told about each change
+        self.markers = {}
+        self.map_pane.on('marker_deleted', self._forget_marker)
+
+        # Shared climate zones with color and description columns and their spatial index
+        store = get_data_store(self.path)
+        self.koppen_giger_data = store.zones
+        self.zone_index = store.zone_index
+
+        # Version of the machine data the map in the browser shows
+        self._synced = store.registry.get(self.machine)
+        self._synced_version = self._synced.version
+
+        # Scenario whose zone changes are drawn over the map, if any
+        self.compare_path = None
+
+        # Metric of the interpolated surface over the map, None without one
+        self.surface_metric = None
+        self.map_pane.on('surface_probe', self._probe_surface)
+
+        # Render cache key of the surface image the page shows, and the
+        # rebuild whose surface is sent when it is done
+        self._surface_sent = None
+        self._surface_awaited = None
+
+        # Whether the measured sites are drawn, and the view the browser last
+        # asked clusters for
+        self.sites_shown = True
+        self._site_view = None
+        self.map_pane.on('site_view', self._show_site_view)
+
+        # Zooming the page swaps the geometry tier of its zones
+        self.map_pane.on('zone_view', self._show_zone_view)
+
+    @property
+    def map(self):
+        # The folium map of this session, only built when asked for since the
+        # page itself usually comes from the render cache
+        if self._folium_map is None:
+            self._folium_map = create_map(self.path, self.original_color_map, machine=self.machine)
+        return self._folium_map
+
+    def _render_key(self):
+        # Everything the rendered page depends on
+        machine = get_data_store(self.path).registry.get(self.machine)
+        tiled = bool(ZONE_TILES_URL) and tiles_built(self.path)
+        return ('map', source_fingerprint(self.path), self.machine, machine.data_version, ZONE_TILES_URL, tiled,
+                self._color_key)
+
+    def _render_html(self):
+        return create_map(self.path, self.original_color_map, machine=self.machine).get_root().render()
+
+    @property
+    def range_index(self):
+        # Sorted values of the shown machine, including its latest readings
+        return get_data_store(self.path).range_index(self.machine)
 
     ### DEFINING FUNCTIONS FOR ACTIONS ###
     def get_climate_zone_for_coordinates(self, lat, lon):
-        # When the lat and long are entered it finds the climate zone corresponding to 
-        # these coordinates and adds the name of the zone and GRIDCODE to the koppen dataset
-
-        # Creates a GeoDataFrame for the point
-        point_gdf = gpd.GeoDataFrame(
-            {'geometry': [Point(lon, lat)]}, 
-            crs="EPSG:4326"
-        )
-        self.koppen_giger_data = self.koppen_giger_data.to_crs("EPSG:4326")
-
-        # Performs a spatial join to find the containing polygon
-        result = gpd.sjoin(point_gdf, self.koppen_giger_data, how="left", predicate="within")
-
-        # Checks if a match was found
-        if not result.empty:
-            return {
-                'description': result.iloc[0]['description'],
-                'GRIDCODE': result.iloc[0]['GRIDCODE']
-            }
-        return None
+        # When the lat and long are entered it finds the climate zone corresponding to
+        # these coordinates, using the shared spatial index of the zones
+        return self.zone_index.lookup(lat, lon)
     
-    def add_marker(self, coordinates, update_display_callback=None):
+    @timed
+    def add_marker(self, coordinates, update_display_callback=None, climate_info=NOT_LOOKED_UP):
         try:
-            print(f"Received coordinates: {coordinates}") 
             if isinstance(coordinates, tuple):
                 lat, lon = coordinates
             else:
                 lat, lon = map(float, coordinates.split(','))
 
-            print(f"Parsed coordinates: {lat}, {lon}")  
+            # Finds the climate zone for the coordinates, unless the caller already did
+            if climate_info is NOT_LOOKED_UP:
+                climate_info = self.get_climate_zone_for_coordinates(lat, lon)
 
-            # Finds the climate zone for the coordinates
-            climate_info = self.get_climate_zone_for_coordinates(lat, lon)
+            marker_id = uuid.uuid4().hex
 
             if climate_info:
                 climate_description = climate_info['description']
                 gridcode = climate_info['GRIDCODE']
-                print(f"Climate Zone: {climate_description} (GRIDCODE: {gridcode})")
+                logger.debug("Marker at %s, %s in %s (GRIDCODE: %s)", lat, lon, climate_description, gridcode)
                 
                 # Adds a marker with climate zone information
                 popup_html = f"""
                     <p>Marker at <br> ({lat}, {lon})</p>
                     <p><strong>Climate Zone:</strong> {climate_description} (GRIDCODE: {gridcode})</p>
-                    <button onclick="">Delete Dot</button>
+                    <button onclick="carbyonDeleteMarker('{marker_id}')">Delete Dot</button>
                 """
-                folium.Marker(location=(lat, lon), popup=folium.Popup(popup_html, max_width=300)).add_to(self.map)
             else:
-                print("Coordinates are outside the defined climate zones.")
+                logger.debug("Marker at %s, %s is outside the climate zones", lat, lon)
                 popup_html = f"""
                     <p>Marker at <br> ({lat}, {lon})</p>
                     <p><strong>Climate Zone:</strong> Not Found</p>
+                    <button onclick="carbyonDeleteMarker('{marker_id}')">Delete Dot</button>
                 """
-                folium.Marker(location=(lat, lon), popup=folium.Popup(popup_html, max_width=300)).add_to(self.map)
-            
-            # Refresh map HTML
-            self.map_pane.object = self.map._repr_html_()
-            self._layout[0] = self.map_pane 
 
-            print("Map HTML updated")  
+            # Sends only the new marker to the map in the browser
+            self.markers[marker_id] = (lat, lon)
+            self.map_pane.send(
+                {'type': 'add_marker', 'id': marker_id, 'lat': float(lat), 'lon': float(lon), 'popup': popup_html},
+                key=('marker', marker_id)
+            )
             if update_display_callback:
                 update_display_callback(f"{lat}, {lon}")
+            return marker_id
         except ValueError:
-            print("Invalid coordinates. Ensure the format is 'latitude, longitude'")
+            logger.warning("Invalid coordinates %r, the format is 'latitude, longitude'", coordinates)
     
 
+    def _forget_marker(self, message):
+        # The marker is gone (e.g. its "Delete Dot" button was clicked), so it
+        # isn't restored when the map reloads
+        self.markers.pop(message['id'], None)
+        self.map_pane.forget(('marker', message['id']))
+
+    @timed
+    def set_machine(self, machine):
+        # Shows another machine's data on the map already loaded in the browser.
+        # Only the tooltip ranges are sent, the climate zones stay as they are
+        if machine == self.machine:
+            return
+        self.machine = machine
+        self.sync_machine_data(refresh_all=True)
+        self.clear_slider_filter()
+        self.send_surface()
+
+    @timed
+    def set_scenario(self, koppen_giger_data_path):
+        # Shows the climate zones of another scenario. Every scenario's page is
+        # rendered once and shared, so switching back and forth is a cache hit
+        path = os.path.abspath(koppen_giger_data_path)
+        if path == self.path:
+            return
+        self.path = path
+        store = get_data_store(self.path)
+        self.koppen_giger_data = store.zones
+        self.zone_index = store.zone_index
+        self._folium_map = None
+        self._synced = store.registry.get(self.machine)
+        self._synced_version = self._synced.version
+
+        # The new page has its own tooltip values, filters apply to its zones
+        self.map_pane.forget('zone_properties')
+        self.clear_slider_filter()
+        self.send_zone_changes()
+        self.send_surface()
+        self.map_pane.html = RENDER_CACHE.get_or_render(self._render_key(), self._render_html)
+
+    @timed
+    def compare_scenario(self, koppen_giger_data_path):
+        # Draws where the zones of another scenario differ from the shown ones,
+        # None removes the comparison
+        self.compare_path = os.path.abspath(koppen_giger_data_path) if koppen_giger_data_path else None
+        self.send_zone_changes()
+
+    def send_zone_changes(self):
+        # The change areas of a pair of scenarios are computed once (see
+        # scenarios.py) and their GeoJSON is shared by every session
+        if self.compare_path is None or self.compare_path == self.path:
+            self.map_pane.send({'type': 'scenario_changes', 'features': None}, key='scenario_changes')
+            return
+        before, after = self.path, self.compare_path
+        message = RENDER_CACHE.get_or_render(
+            ('scenario_changes', source_fingerprint(before), source_fingerprint(after)),
+            lambda: {'type': 'scenario_changes', 'features': zone_changes_geojson(before, after)},
+            size=json_size
+        )
+        self.map_pane.send(message, key='scenario_changes')
+
+    @timed
+    def show_surface(self, metric):
+        # Shows the interpolated surface of a metric (e.g. CostsToCapture)
+        # over the map, None removes it
+        self.surface_metric = metric
+        self.send_surface()
+
+    def send_surface(self):
+        # The image of a surface is made once per version of the data and
+        # shared by every session. While the surface of new readings is being
+        # built the page keeps the previous one and gets the new one when done
+        if self.surface_metric is None:
+            if self._surface_sent is not None:
+                self.map_pane.send({'type': 'surface', 'url': None}, key='surface')
+            self._surface_sent = None
+            return
+        store = get_data_store(self.path)
+        surface = store.surface(self.machine)
+        if surface is None or surface.data_version != store.registry.get(self.machine).data_version:
+            self._send_surface_when_built(store.surface_build(self.machine))
+
+        key = None if surface is None else (
+            'surface_image', self.path, self.machine, surface.data_version, self.surface_metric)
+        if key == self._surface_sent:
+            return
+        if surface is None:
+            # The surface of another machine or scenario is no longer shown
+            message = {'type': 'surface', 'url': None}
+        else:
+            metric = self.surface_metric
+            message = RENDER_CACHE.get_or_render(key, lambda: self._surface_message(surface, metric), size=json_size)
+        self._surface_sent = key
+        self.map_pane.send(message, key='surface')
+
+    def _send_surface_when_built(self, build):
+        # Sends the surface again once its rebuild in the background is done.
+        # Outside a served session (e.g. in scripts) there is no page to update
+        doc = pn.state.curdoc
+        if build is None or doc is None or build is self._surface_awaited:
+            return
+        self._surface_awaited = build
+
+        def refresh():
+            with set_curdoc(doc):
+                self.send_surface()
+
+        # Bokeh's next tick callbacks may be added from any thread
+        build.add_done_callback(lambda _: doc.add_next_tick_callback(refresh))
+
+    def _surface_message(self, surface, metric):
+        low, high = surface.bounds(metric) or (0, 0)
+        return {
+            'type': 'surface',
+            'url': surface.image(metric),
+            'bounds': [[-MAX_MERCATOR_LAT, -180], [MAX_MERCATOR_LAT, 180]],
+            'label': f"Estimated {SURFACE_LABELS[metric].lower()} ({METRICS[metric]})",
+            'low': f'{low:.4g}',
+            'high': f'{high:.4g}',
+            'colors': surface_colors(),
+        }
+
+    def _probe_surface(self, message):
+        # Estimate under the mouse, a lookup in the cached surface
+        if self.surface_metric is None:
+            return
+        surface = get_data_store(self.path).surface(self.machine)
+        if surface is None:
+            text = 'estimating...'
+        else:
+            estimate = surface.estimate(message['lat'], message['lon'])
+            value = estimate[self.surface_metric] if estimate else float('nan')
+            text = 'no estimate' if value != value else f"{value:.4g} {METRICS[self.surface_metric]}"
+        self.map_pane.send({
+            'type': 'surface_value',
+            'text': f"{message['lat']:.2f}, {message['lon']:.2f}: {text}"
+        })
+
+    @timed
+    def show_sites(self, shown):
+        # Shows or hides the clustered measured sites
+        self.sites_shown = shown
+        self.map_pane.send({'type': 'site_layer', 'enabled': shown}, key='site_layer')
+
+    @timed
+    def _show_zone_view(self, message):
+        # The page moved, it gets the geometry tier of its zoom level. A finer
+        # tier of the whole world is kept when zooming out, the exact zones
+        # are only sent for the view and a margin around it
+        tolerance = tolerance_for_zoom(message['zoom'])
+        shown, extent = message['tolerance'], message['extent']
+        west, east = max(-180, message['west']), min(180, message['east'])
+        south, north = max(-90, message['south']), min(90, message['north'])
+        if extent is None and 0 < shown <= tolerance:
+            return
+        if not tolerance and extent is not None and not shown and (
+                extent[0] <= south and extent[1] <= west and extent[2] >= north and extent[3] >= east):
+            return
+
+        tiers = get_data_store(self.path).geometry_tiers
+        if tolerance:
+            features = RENDER_CACHE.get_or_render(
+                ('zone_tier', source_fingerprint(self.path), tolerance),
+                lambda: tiers.by_gridcode(tolerance).to_geo_dict(drop_id=True)['features'],
+                size=json_size
+            )
+            extent = None
+        else:
+            width, height = (east - west) * EXACT_VIEW_MARGIN, (north - south) * EXACT_VIEW_MARGIN
+            extent = [max(-90, south - height), max(-180, west - width), min(90, north + height), min(180, east + width)]
+            zones = tiers.clipped(0, extent[1], extent[0], extent[3], extent[2])
+            features = zones.to_geo_dict(drop_id=True)['features']
+        self.map_pane.send({
+            'type': 'zone_tier', 'view': message['view'], 'tolerance': tolerance, 'extent': extent,
+            'features': features,
+        })
+
+    def _show_site_view(self, message):
+        # The map in the browser moved, it gets the clusters of the new view
+        self._site_view = message
+        self.send_site_clusters()
+
+    @timed
+    def send_site_clusters(self):
+        # Clusters of the shown machine's sites in the last view of the
+        # browser, each zoom level is grouped once per version of the data
+        if not self.sites_shown or self._site_view is None:
+            return
+        view = self._site_view
+        clusters = get_data_store(self.path).site_clusters(self.machine).view(
+            view['zoom'], view['south'], view['west'], view['north'], view['east']
+        )
+        self.map_pane.send({'type': 'site_clusters', 'view': view.get('view'), 'clusters': clusters})
+
+    def sync_machine_data(self, refresh_all=False):
+        # Sends the tooltip ranges of the zones which got new readings since
+        # the map was last updated, returns whether anything was sent
+        machine = get_data_store(self.path).registry.get(self.machine)
+        if machine is self._synced and not refresh_all:
+            version, gridcodes = machine.changes_since(self._synced_version)
+        else:
+            version, gridcodes = machine.version, None
+        if machine is not self._synced or version != self._synced_version:
+            self.send_site_clusters()
+            self.send_surface()
+        self._synced, self._synced_version = machine, version
+        if gridcodes is not None and not gridcodes:
+            return False
+
+        properties = RENDER_CACHE.get_or_render(
+            ('zone_properties', self.machine, machine.data_version),
+            lambda: zone_range_properties(machine.zone_statistics),
+            size=json_size
+        )
+        changed = properties if gridcodes is None else {
+            code: values for code, values in properties.items() if code in gridcodes
+        }
+        self.map_pane.send(
+            {'type': 'zone_properties', 'properties': changed},
+            key='zone_properties',
+            replay={'type': 'zone_properties', 'properties': properties}
+        )
+        return True
+
+    @timed
     def apply_performance_filter(self, selected_performance):
         # Apply the performance filter based on the selected machine performance (best to worst)
         # from the dropdown menu
@@ -199,15 +493,40 @@ class ClimateMap(pn.viewable.Viewer):
             # default = full coloring
             self.reset_to_full_color_map()
         else:
-            filtered_color_map = performance_filter(self.color_map, selected_performance)
-            self.update_map_colors(filtered_color_map)
-
+            # The color table of every option is built once for all sessions
+            self.color_map = performance_filter(self.original_color_map, selected_performance)
+            message = RENDER_CACHE.get_or_render(
+                ('colors', self._color_key, selected_performance),
+                lambda: {'type': 'colors', 'colors': gridcode_colors(self.color_map)},
+                size=json_size
+            )
+            self.map_pane.send(message, key='colors')
+
+    @timed
+    def apply_slider_filter(self, selected_range, filter_column):
+        # Highlights the zones and sites whose values are within the selected
+        # range, answered by binary searches on the sorted values
+        low, high = selected_range
+        gridcodes = self.range_index.zones(filter_column, low, high)
+        positions = self.range_index.sites(filter_column, low, high)[:MAX_HIGHLIGHTED_SITES]
+
+        self.map_pane.send({'type': 'highlight_zones', 'gridcodes': gridcodes.tolist()}, key='highlight_zones')
+        self.map_pane.send({
+            'type': 'highlight_sites',
+            'sites': [[float(self.range_index.lats[i]), float(self.range_index.lons[i])] for i in positions]
+        }, key='highlight_sites')
+
+    def clear_slider_filter(self):
+        # Shows every zone again and removes the site highlights
+        self.map_pane.send({'type': 'highlight_zones', 'gridcodes': None}, key='highlight_zones')
+        self.map_pane.send({'type': 'highlight_sites', 'sites': []}, key='highlight_sites')
+
+    @timed
     def update_map_colors(self, color_map):
-       # Updates the map with the new coloring
+        # Recolors the map already loaded in the browser, only the
+        # GRIDCODE -> color table is sent
         self.color_map = color_map
-        self.map = create_map(self.path, self.color_map)  
-        self.map_pane.object = self.map._repr_html_()
-        self._layout[0] = self.map_pane 
+        self.map_pane.send({'type': 'colors', 'colors': gridcode_colors(self.color_map)}, key='colors')
 
     def reset_to_full_color_map(self):
        # Resets the map with the fyll coloring
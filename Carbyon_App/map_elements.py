@@ -0,0 +1,581 @@
+from branca.element import MacroElement
+from folium import Map
+from folium.utilities import get_obj_in_upper_tree
+from jinja2 import Template
+
+# Border and opacity shared by every climate zone, only the fill color changes
+ZONE_STYLE = {
+    'color': 'black',
+    'weight': 0.5,
+    'fillOpacity': 0.6,
+}
+
+
+# Fill color of zones left out by a filter, the same grey as performance_filter
+MUTED_COLOR = '#e0e0e0'
+
+
+def gridcode_colors(color_map):
+    # Reduces a GRIDCODE -> (color, description) mapping to GRIDCODE -> color,
+    # which is all the browser needs to style the zones
+    return {int(gridcode): value[0] for gridcode, value in color_map.items()}
+
+
+class MessageReceiver(MacroElement):
+    """
+    Listens inside the map document for messages posted by live_map.LiveMap and
+    hands them to the handler registered for the message type.
+    """
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+        window.carbyonHandlers = window.carbyonHandlers || {};
+        window.addEventListener('message', function(event) {
+            var handler = event.data && window.carbyonHandlers[event.data.type];
+            if (handler) {
+                handler(event.data);
+            }
+        });
+        {% endmacro %}
+        """
+    )
+
+    def __init__(self):
+        super().__init__()
+        self._name = 'MessageReceiver'
+
+
+class GridcodeStyle(MacroElement):
+    """
+    Styles a GeoJson layer in the browser by looking up each feature's GRIDCODE
+    in a single color table, instead of one style per feature.
+
+    A 'colors' message replaces the table and restyles the layer in place. A
+    'highlight_zones' message with a list of GRIDCODEs mutes every other zone,
+    with null it shows all zones again.
+
+    layer (folium.GeoJson): Layer whose features have a GRIDCODE property.
+    color_map (dict): GRIDCODE to color and description mapping.
+    zone_style (dict): Border and opacity of the zones.
+    """
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }} = {{ this.colors|tojson }};
+        var {{ this.get_name() }}_highlight = null;
+        {{ this.layer.get_name() }}.options.style = function(feature) {
+            var gridcode = feature.properties.GRIDCODE;
+            var color = {{ this.get_name() }}[gridcode] || 'gray';
+            if ({{ this.get_name() }}_highlight && !{{ this.get_name() }}_highlight[gridcode]) {
+                color = {{ this.muted|tojson }};
+            }
+            return Object.assign({fillColor: color}, {{ this.zone_style|tojson }});
+        };
+        {{ this.layer.get_name() }}.setStyle({{ this.layer.get_name() }}.options.style);
+
+        window.carbyonHandlers = window.carbyonHandlers || {};
+        window.carbyonHandlers['colors'] = function(message) {
+            {{ this.get_name() }} = message.colors;
+            {{ this.layer.get_name() }}.setStyle({{ this.layer.get_name() }}.options.style);
+        };
+        window.carbyonHandlers['highlight_zones'] = function(message) {
+            {{ this.get_name() }}_highlight = null;
+            if (message.gridcodes) {
+                {{ this.get_name() }}_highlight = {};
+                message.gridcodes.forEach(function(gridcode) { {{ this.get_name() }}_highlight[gridcode] = true; });
+            }
+            {{ this.layer.get_name() }}.setStyle({{ this.layer.get_name() }}.options.style);
+        };
+        {% endmacro %}
+        """
+    )
+
+    def __init__(self, layer, color_map, zone_style=ZONE_STYLE):
+        super().__init__()
+        self._name = 'GridcodeStyle'
+        self.layer = layer
+        self.colors = gridcode_colors(color_map)
+        self.zone_style = zone_style
+        self.muted = MUTED_COLOR
+
+
+class ZoneProperties(MacroElement):
+    """
+    Updates the properties of the features of a GeoJson layer in place, so its
+    tooltip shows new values without sending the polygons again. A
+    'zone_properties' message holds GRIDCODE to {field: value}.
+
+    The values of every GRIDCODE are also kept in a table, which features
+    added to the layer later (see ZoneTiers) take their values from.
+
+    layer (folium.GeoJson): Layer whose features have a GRIDCODE property.
+    """
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }}_table = {};
+        {{ this.layer.get_name() }}.eachLayer(function(layer) {
+            {{ this.get_name() }}_table[layer.feature.properties.GRIDCODE] = Object.assign({}, layer.feature.properties);
+        });
+
+        window.carbyonHandlers = window.carbyonHandlers || {};
+        window.carbyonHandlers['zone_properties'] = function(message) {
+            Object.keys(message.properties).forEach(function(gridcode) {
+                {{ this.get_name() }}_table[gridcode] = Object.assign(
+                    {{ this.get_name() }}_table[gridcode] || {}, message.properties[gridcode]
+                );
+            });
+            {{ this.layer.get_name() }}.eachLayer(function(layer) {
+                var values = message.properties[layer.feature.properties.GRIDCODE];
+                if (values) {
+                    Object.assign(layer.feature.properties, values);
+                }
+            });
+        };
+        {% endmacro %}
+        """
+    )
+
+    def __init__(self, layer):
+        super().__init__()
+        self._name = 'ZoneProperties'
+        self.layer = layer
+
+
+class ZoneTiers(MacroElement):
+    """
+    Swaps the zones of a GeoJson layer for the geometry tier of the zoom level
+    (see geometry_tiers.py). When the map stops moving its view and the tier
+    it shows are posted to the app as a 'zone_view' message. A 'zone_tier'
+    message ({view, tolerance, extent, features}) replaces the zones, extent
+    is the box the features were cut to or null for the whole world.
+
+    layer (folium.GeoJson): Layer whose features have a GRIDCODE property.
+    properties (ZoneProperties): Keeps the tooltip values of every GRIDCODE.
+    tolerance (float): Tier of the zones the page opens with.
+    """
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+        (function() {
+            var map = {{ this.map_name }};
+            var layer = {{ this.layer.get_name() }};
+            var shown = {tolerance: {{ this.tolerance|tojson }}, extent: null}, view = 0;
+
+            window.carbyonHandlers = window.carbyonHandlers || {};
+            window.carbyonHandlers['zone_tier'] = function(message) {
+                // Replies to an older view are dropped when they arrive
+                if (message.view !== view) {
+                    return;
+                }
+                message.features.forEach(function(feature) {
+                    Object.assign(feature.properties, {{ this.properties.get_name() }}_table[feature.properties.GRIDCODE]);
+                });
+                layer.clearLayers();
+                layer.addData({type: 'FeatureCollection', features: message.features});
+                shown = {tolerance: message.tolerance, extent: message.extent};
+            };
+
+            map.on('moveend', function() {
+                var bounds = map.getBounds();
+                view += 1;
+                window.parent.postMessage({
+                    type: 'zone_view', view: view, zoom: map.getZoom(),
+                    tolerance: shown.tolerance, extent: shown.extent,
+                    south: bounds.getSouth(), west: bounds.getWest(), north: bounds.getNorth(), east: bounds.getEast()
+                }, '*');
+            });
+        })();
+        {% endmacro %}
+        """
+    )
+
+    def __init__(self, layer, properties, tolerance):
+        super().__init__()
+        self._name = 'ZoneTiers'
+        self.layer = layer
+        self.properties = properties
+        self.tolerance = tolerance
+
+    def render(self, **kwargs):
+        # Added to the layer, so its script comes after the layer's
+        self.map_name = get_obj_in_upper_tree(self, Map).get_name()
+        super().render(**kwargs)
+
+
+class ZoneTiles(MacroElement):
+    """
+    Climate zone layer which downloads tiled GeoJSON for the part of the world
+    in view (see zone_tiles.py), instead of having every polygon in the page.
+
+    The tooltip values live in one table per GRIDCODE, which a 'zone_properties'
+    message updates in place.
+
+    The tiles hold the zones cut at the tile edges and a MultiLineString of
+    their borders, which is drawn in its own pane above the zones. The zones
+    themselves are styled without a stroke (see GridcodeStyle).
+
+    url (str): URL of the tile pyramid, tiles are at <url>/<z>/<x>/<y>.geojson.
+    max_zoom (int): Deepest zoom level with its own tiles.
+    properties (dict): GRIDCODE to {field: value} shown in the tooltip.
+    fields, aliases (list): Tooltip fields and their labels.
+    """
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }}_properties = {{ this.properties|tojson }};
+        var {{ this.get_name() }} = L.geoJson(null, {
+            onEachFeature: function(feature, layer) {
+                layer.bindTooltip(function() {
+                    var values = {{ this.get_name() }}_properties[feature.properties.GRIDCODE] || {};
+                    var rows = {{ this.fields|tojson }}.map(function(field, i) {
+                        return '<tr><th>' + {{ this.aliases|tojson }}[i] + '</th><td>'
+                            + (values[field] === undefined ? '' : values[field]) + '</td></tr>';
+                    });
+                    return '<table style="font-size: 12px; color: black;">' + rows.join('') + '</table>';
+                }, {sticky: true});
+            }
+        }).addTo({{ this._parent.get_name() }});
+
+        (function() {
+            var map = {{ this.map_name }};
+            var layer = {{ this.get_name() }};
+            var tileZoom = null, loadedTiles = {};
+            map.createPane('zoneBorders');
+            map.getPane('zoneBorders').style.zIndex = 450;
+            map.getPane('zoneBorders').style.pointerEvents = 'none';
+            var borders = L.geoJson(null, {
+                pane: 'zoneBorders', interactive: false, style: {{ this.border_style|tojson }}
+            }).addTo({{ this._parent.get_name() }});
+
+            function tileX(lon, n) {
+                return Math.min(n - 1, Math.max(0, Math.floor((lon + 180) / 360 * n)));
+            }
+            function tileY(lat, n) {
+                var rad = Math.max(-85.0511, Math.min(85.0511, lat)) * Math.PI / 180;
+                var y = (1 - Math.log(Math.tan(rad) + 1 / Math.cos(rad)) / Math.PI) / 2 * n;
+                return Math.min(n - 1, Math.max(0, Math.floor(y)));
+            }
+
+            function update() {
+                var z = Math.max(0, Math.min(Math.floor(map.getZoom()), {{ this.max_zoom }}));
+                if (z !== tileZoom) {
+                    // Another zoom level uses another geometry tier
+                    layer.clearLayers();
+                    borders.clearLayers();
+                    tileZoom = z;
+                    loadedTiles = {};
+                }
+                var n = Math.pow(2, z), bounds = map.getBounds();
+                var west = tileX(Math.max(-180, bounds.getWest()), n), east = tileX(Math.min(180, bounds.getEast()), n);
+                var north = tileY(bounds.getNorth(), n), south = tileY(bounds.getSouth(), n);
+                for (var x = west; x <= east; x++) {
+                    for (var y = north; y <= south; y++) {
+                        var key = x + '/' + y;
+                        if (loadedTiles[key]) {
+                            continue;
+                        }
+                        loadedTiles[key] = true;
+                        fetch({{ this.url|tojson }} + '/' + z + '/' + key + '.geojson')
+                            .then(function(response) { return response.ok ? response.json() : null; })
+                            .then(function(requestZoom, data) {
+                                if (!data || requestZoom !== tileZoom) {
+                                    return;
+                                }
+                                data.features.forEach(function(feature) {
+                                    (feature.geometry.type === 'MultiLineString' ? borders : layer).addData(feature);
+                                });
+                            }.bind(null, z));
+                    }
+                }
+            }
+            map.on('moveend', update);
+            update();
+        })();
+
+        window.carbyonHandlers = window.carbyonHandlers || {};
+        window.carbyonHandlers['zone_properties'] = function(message) {
+            Object.assign({{ this.get_name() }}_properties, message.properties);
+        };
+        {% endmacro %}
+        """
+    )
+
+    def __init__(self, url, max_zoom, properties, fields, aliases):
+        super().__init__()
+        self._name = 'ZoneTiles'
+        self.url = url
+        self.max_zoom = max_zoom
+        self.properties = properties
+        self.fields = fields
+        self.aliases = aliases
+        self.border_style = {'color': ZONE_STYLE['color'], 'weight': ZONE_STYLE['weight']}
+
+    def render(self, **kwargs):
+        self.map_name = get_obj_in_upper_tree(self, Map).get_name()
+        super().render(**kwargs)
+
+
+class MarkerLayer(MacroElement):
+    """
+    Layer for the search markers, filled by messages so adding or deleting a
+    marker never resends the map.
+
+    'add_marker' messages ({id, lat, lon, popup}) add a marker, 'remove_marker'
+    messages ({id}) remove it. The "Delete Dot" button of a popup calls
+    carbyonDeleteMarker(id), which removes the marker and tells the app with a
+    'marker_deleted' message.
+    """
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }} = L.featureGroup().addTo({{ this._parent.get_name() }});
+        var {{ this.get_name() }}_markers = {};
+
+        window.carbyonHandlers = window.carbyonHandlers || {};
+        window.carbyonHandlers['add_marker'] = function(message) {
+            if ({{ this.get_name() }}_markers[message.id]) {
+                return;
+            }
+            {{ this.get_name() }}_markers[message.id] = L.marker([message.lat, message.lon])
+                .bindPopup(message.popup, {maxWidth: 300})
+                .addTo({{ this.get_name() }});
+        };
+        window.carbyonHandlers['remove_marker'] = function(message) {
+            var marker = {{ this.get_name() }}_markers[message.id];
+            if (marker) {
+                {{ this.get_name() }}.removeLayer(marker);
+                delete {{ this.get_name() }}_markers[message.id];
+            }
+        };
+        window.carbyonDeleteMarker = function(id) {
+            window.carbyonHandlers['remove_marker']({id: id});
+            window.parent.postMessage({type: 'marker_deleted', id: id}, '*');
+        };
+        {% endmacro %}
+        """
+    )
+
+    def __init__(self):
+        super().__init__()
+        self._name = 'MarkerLayer'
+
+
+class SiteHighlight(MacroElement):
+    """
+    Small circles for the measured sites picked by a filter. A 'highlight_sites'
+    message ({sites: [[lat, lon], ...]}) replaces the circles.
+    """
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }} = L.featureGroup().addTo({{ this._parent.get_name() }});
+
+        window.carbyonHandlers = window.carbyonHandlers || {};
+        window.carbyonHandlers['highlight_sites'] = function(message) {
+            {{ this.get_name() }}.clearLayers();
+            message.sites.forEach(function(site) {
+                L.circleMarker(site, {{ this.site_style|tojson }}).addTo({{ this.get_name() }});
+            });
+        };
+        {% endmacro %}
+        """
+    )
+
+    def __init__(self):
+        super().__init__()
+        self._name = 'SiteHighlight'
+        self.site_style = {'radius': 4, 'color': '#264653', 'weight': 1, 'fillColor': '#41abff', 'fillOpacity': 0.9}
+
+
+class ZoneChanges(MacroElement):
+    """
+    Areas whose climate zone differs in a compared scenario (see scenarios.py).
+    A 'scenario_changes' message ({features: GeoJSON}) replaces the areas, with
+    null it removes them. Areas which also change performance class are drawn
+    stronger than areas which only change zone.
+    """
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }} = L.geoJson(null, {
+            style: function(feature) {
+                return feature.properties.class_changed ? {{ this.class_style|tojson }} : {{ this.zone_style|tojson }};
+            },
+            onEachFeature: function(feature, layer) {
+                var p = feature.properties;
+                layer.bindTooltip(
+                    '<b>' + p.description_before + '</b> (' + p.GRIDCODE_before + ') &rarr; <b>'
+                    + p.description_after + '</b> (' + p.GRIDCODE_after + ')',
+                    {sticky: true}
+                );
+            }
+        }).addTo({{ this._parent.get_name() }});
+
+        window.carbyonHandlers = window.carbyonHandlers || {};
+        window.carbyonHandlers['scenario_changes'] = function(message) {
+            {{ this.get_name() }}.clearLayers();
+            if (message.features) {
+                {{ this.get_name() }}.addData(message.features);
+                {{ this.get_name() }}.bringToFront();
+            }
+        };
+        {% endmacro %}
+        """
+    )
+
+    def __init__(self):
+        super().__init__()
+        self._name = 'ZoneChanges'
+        self.class_style = {'color': '#9d0208', 'weight': 1, 'fillColor': '#9d0208', 'fillOpacity': 0.45}
+        self.zone_style = {'color': '#495057', 'weight': 0.5, 'dashArray': '3', 'fillOpacity': 0.1}
+
+
+class SurfaceOverlay(MacroElement):
+    """
+    Image of an interpolated surface (see surface.py) over the map, with a
+    legend. A 'surface' message ({url, bounds, label, low, high, colors})
+    replaces the image, with a null url it removes it.
+
+    While a surface is shown the position under the mouse is posted to the app
+    as a 'surface_probe' message, the estimate comes back as 'surface_value'.
+    """
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+        (function() {
+            var map = {{ this._parent.get_name() }};
+            var overlay = null, probing = false, waiting = false;
+            var legend = L.control({position: 'bottomleft'});
+            legend.onAdd = function() {
+                this._div = L.DomUtil.create('div');
+                this._div.style.cssText = 'background: white; padding: 6px 8px; font-size: 12px; border-radius: 4px;';
+                return this._div;
+            };
+
+            window.carbyonHandlers = window.carbyonHandlers || {};
+            window.carbyonHandlers['surface'] = function(message) {
+                if (overlay) {
+                    map.removeLayer(overlay);
+                    overlay = null;
+                }
+                probing = Boolean(message.url);
+                if (!message.url) {
+                    legend.remove();
+                    return;
+                }
+                overlay = L.imageOverlay(message.url, message.bounds, {{ this.overlay_options|tojson }}).addTo(map);
+                legend.addTo(map);
+                legend._div.innerHTML = '<b>' + message.label + '</b><br>'
+                    + '<div style="height: 8px; background: linear-gradient(to right, ' + message.colors.join(', ') + ');"></div>'
+                    + message.low + ' &ndash; ' + message.high + '<br><span class="carbyon-surface-value"></span>';
+            };
+            window.carbyonHandlers['surface_value'] = function(message) {
+                waiting = false;
+                var value = legend._div && legend._div.querySelector('.carbyon-surface-value');
+                if (value) {
+                    value.textContent = message.text;
+                }
+            };
+
+            // At most one probe is on its way, so moving the mouse never queues up requests
+            map.on('mousemove', function(event) {
+                if (probing && !waiting) {
+                    waiting = true;
+                    window.parent.postMessage({type: 'surface_probe', lat: event.latlng.lat, lon: event.latlng.lng}, '*');
+                    setTimeout(function() { waiting = false; }, {{ this.probe_timeout_ms }});
+                }
+            });
+        })();
+        {% endmacro %}
+        """
+    )
+
+    def __init__(self):
+        super().__init__()
+        self._name = 'SurfaceOverlay'
+        self.overlay_options = {'opacity': 0.65, 'interactive': False}
+        self.probe_timeout_ms = 1000
+
+
+class SiteClusters(MacroElement):
+    """
+    Measured sites of the machine, grouped into clusters by the app (see
+    site_clusters.py). The view is posted to the app as a 'site_view' message
+    when the map stops moving, the clusters in it come back as 'site_clusters'
+    ({view, clusters: [[lat, lon, count, mean cost], ...]}). A 'site_layer'
+    message ({enabled}) shows or hides the layer.
+    """
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+        (function() {
+            var map = {{ this._parent.get_name() }};
+            var layer = L.featureGroup();
+            var enabled = {{ this.enabled|tojson }}, view = 0;
+
+            function postView() {
+                // Replies to an older view are dropped when they arrive
+                var bounds = map.getBounds();
+                view += 1;
+                window.parent.postMessage({
+                    type: 'site_view', view: view, zoom: map.getZoom(),
+                    south: bounds.getSouth(), west: bounds.getWest(), north: bounds.getNorth(), east: bounds.getEast()
+                }, '*');
+            }
+
+            window.carbyonHandlers = window.carbyonHandlers || {};
+            window.carbyonHandlers['site_layer'] = function(message) {
+                enabled = message.enabled;
+                if (enabled) {
+                    layer.addTo(map);
+                    postView();
+                } else {
+                    layer.clearLayers();
+                    map.removeLayer(layer);
+                }
+            };
+            window.carbyonHandlers['site_clusters'] = function(message) {
+                if (!enabled || (message.view && message.view !== view)) {
+                    return;
+                }
+                layer.clearLayers();
+                message.clusters.forEach(function(cluster) {
+                    var count = cluster[2], cost = cluster[3];
+                    var style = Object.assign({}, {{ this.cluster_style|tojson }}, {
+                        radius: {{ this.min_radius }} + {{ this.radius_step }} * Math.log10(count)
+                    });
+                    L.circleMarker([cluster[0], cluster[1]], style)
+                        .bindTooltip((count === 1 ? '1 site' : count.toLocaleString() + ' sites')
+                            + (cost === null ? '' : '<br>Mean cost: ' + cost + ' {{ this.cost_unit }}'))
+                        .on('click', function(event) {
+                            if (count > 1) {
+                                map.setView(event.latlng, map.getZoom() + 2);
+                            }
+                        })
+                        .addTo(layer);
+                });
+            };
+
+            map.on('moveend', function() {
+                if (enabled) {
+                    postView();
+                }
+            });
+            if (enabled) {
+                layer.addTo(map);
+                map.whenReady(postView);
+            }
+        })();
+        {% endmacro %}
+        """
+    )
+
+    def __init__(self, cost_unit, enabled=True):
+        super().__init__()
+        self._name = 'SiteClusters'
+        self.cost_unit = cost_unit
+        self.enabled = enabled
+        self.cluster_style = {'color': '#264653', 'weight': 1, 'fillColor': '#2a9d8f', 'fillOpacity': 0.7}
+        self.min_radius = 5
+        self.radius_step = 4
@@ -0,0 +1,71 @@
+import pandas as pd
+import panel as pn
+from instrumentation import METRICS, SLOW_CALLBACK_MS, PROFILE_DIR
+from render_cache import RENDER_CACHE
+
+pn.extension(sizing_mode="stretch_width")
+
+# How often the page refreshes its numbers, in milliseconds
+REFRESH_PERIOD_MS = 2000
+
+
+class MetricsPage(pn.viewable.Viewer):
+    """
+    Page with the callback timings, payload sizes, sessions and memory of the
+    server process, served next to the app (panel serve app.py metrics.py).
+    """
+
+    def __init__(self, **params):
+        super().__init__(**params)
+        self.summary = pn.pane.Markdown()
+        self.callbacks = pn.pane.DataFrame(sizing_mode='stretch_width')
+        self.payloads = pn.pane.DataFrame(sizing_mode='stretch_width')
+
+        # Profiling switch shared by every session of the process
+        self.profiling = pn.widgets.Toggle(name='Profile slow callbacks', value=METRICS.profiling, width=200)
+        self.profiling.param.watch(self.toggle_profiling, 'value')
+        self.reset_btn = pn.widgets.Button(name='Reset counters', width=200)
+        self.reset_btn.on_click(self.reset)
+
+        self._layout = pn.Column(
+            pn.pane.Markdown("# Carbyon metrics"),
+            self.summary,
+            pn.Row(self.profiling, self.reset_btn),
+            pn.pane.Markdown("### Callbacks"),
+            self.callbacks,
+            pn.pane.Markdown("### Payloads sent to the browser"),
+            self.payloads,
+            styles={'padding': '20px'}
+        )
+
+        self.refresh()
+        if pn.state.curdoc:
+            pn.state.add_periodic_callback(self.refresh, period=REFRESH_PERIOD_MS)
+
+    def refresh(self):
+        snapshot = METRICS.snapshot()
+        cache = RENDER_CACHE.stats()
+        memory, per_session = snapshot['memory_bytes'], snapshot['memory_per_session_bytes']
+        self.summary.object = (
+            f"**Sessions:** {snapshot['sessions']}  \n"
+            f"**Process memory:** " + (f"{memory / 2 ** 20:.0f} MB" if memory else "unknown")
+            + (f" (about {per_session / 2 ** 20:.1f} MB per session)" if per_session else "") + "  \n"
+            f"**Render cache:** {cache['entries']} entries, {cache['bytes'] / 2 ** 20:.1f} MB, "
+            f"{cache['hits']} hits, {cache['misses']} misses  \n"
+            f"Callbacks over {SLOW_CALLBACK_MS:.0f} ms are logged, profiles are saved to {PROFILE_DIR}"
+        )
+        self.callbacks.object = pd.DataFrame.from_dict(snapshot['callbacks'], orient='index').round(2)
+        self.payloads.object = pd.DataFrame.from_dict(snapshot['payloads'], orient='index')
+
+    def toggle_profiling(self, event):
+        METRICS.profiling = event.new
+
+    def reset(self, event):
+        METRICS.reset()
+        self.refresh()
+
+    def __panel__(self):
+        return self._layout
+
+
+MetricsPage().servable(title="Carbyon metrics")
@@ -2,25 +2,83 @@ import panel as pn
 
 
 class NavTabs(pn.viewable.Viewer):
-    def __init__(self, overview_content):
+    """
+    Tabs on the left of the page. Tabs added with a build function show a
+    loading placeholder and are only built when they are first shown.
+
+    overview_content (Viewable): Content of the first tab, None to add it with add_tab().
+    """
+
+    def __init__(self, overview_content=None):
         super().__init__()
 
         # Create a Tabs layout, passing the Overview content as one of the tabs
         self.tabs = pn.Tabs(
-            ("Location Sensitivity", overview_content),
             tabs_location="left",
             styles={
-                'font-size': '12px',                 
-                'font-weight': 'bold', 
-                'height':'85vh',        
+                'font-size': '12px',
+                'font-weight': 'bold',
+                'height':'85vh',
             }
         )
+        # Content per tab name and the build functions of the tabs not built yet
+        self._contents = {}
+        self._builders = {}
+        if overview_content is not None:
+            self.add_tab("Location Sensitivity", overview_content)
+
+        # Lazy tabs are built when they become the active tab
+        self.tabs.param.watch(self._build_active, 'active')
+
+    def add_tab(self, name, content=None, build=None):
+        """
+        Add a tab, or build its content on first show.
+
+        name (str): Title of the tab, unique among the tabs.
+        content (Viewable): Content of the tab.
+        build (callable): Returns the content, called when the tab is first shown.
+
+        Returns:
+            int: Position of the tab.
+        """
+        if build is not None:
+            # The placeholder stays in the tab and gets the content once built
+            content = pn.Column(
+                pn.indicators.LoadingSpinner(value=True, size=40, name='Loading...'),
+                sizing_mode='stretch_width'
+            )
+            self._builders[name] = build
+        self._contents[name] = content
+        self.tabs.append((name, content))
+        index = len(self.tabs) - 1
+
+        if build is not None and self.tabs.active == index:
+            # The first tab is built once the page is shown in the browser
+            pn.state.onload(lambda: self._build(name))
+        return index
+
+    def open_tab(self, name, build):
+        # Shows the tab with the name, adding it first (built on show) if it
+        # doesn't exist yet, so repeated opens reuse the same tab
+        if name not in self._contents:
+            self.add_tab(name, build=build)
+        self.tabs.active = list(self._contents).index(name)
+
     def append_new_tab(self, new_tab):
         # Method to append new tab to the existing ones
-        self.tabs.append(new_tab)
-    
-    
+        self.add_tab(*new_tab)
+
+    def _build_active(self, event):
+        name = list(self._contents)[event.new]
+        if name in self._builders:
+            # Scheduled on the next tick, so the placeholder is shown while it builds
+            pn.state.execute(lambda: self._build(name), schedule=True)
+
+    def _build(self, name):
+        build = self._builders.pop(name, None)
+        if build is not None:
+            self._contents[name].objects = [build()]
 
     # Expose the layout for rendering
     def __panel__(self):
-        return self.tabs
\ No newline at end of file
+        return self.tabs
@@ -1,10 +1,18 @@
+import asyncio
+import datetime
 import panel as pn
-import pandas as pd
+import param
 from map import ClimateMap
 from filters import Filters
-from performance import performance_filter
 from color_map import Color_map
 from nav_tabs import NavTabs
+from details import SiteDetails
+from panel.io.state import set_curdoc
+from data_store import get_data_store, poll_telemetry, site_details, DEFAULT_MACHINE, KOPPEN_GIGER_PATH, \
+    TELEMETRY_EXECUTOR
+from telemetry import POLL_PERIOD_MS
+from surface import SURFACE_LABELS
+from instrumentation import timed
 
 ### STYLING ###
 
@@ -38,28 +46,55 @@ location_details={
 }
 
 
+# Overviews of the open sessions, told about the readings the shared poller added
+_open_overviews = set()
+
+
+async def poll_open_overviews():
+    # Polls the telemetry files once for the whole server process (in a
+    # worker thread), then every open page sends the zones that changed
+    added = await asyncio.get_running_loop().run_in_executor(TELEMETRY_EXECUTOR, poll_telemetry)
+    for overview in list(_open_overviews):
+        if overview._map.path in added:
+            overview.notify_readings()
+
+
 class Overview(pn.viewable.Viewer):
     def __init__(self,nav_tabs):
         super().__init__()
 
         # Initiate elements and variables
         self.nav_tabs=nav_tabs
-        self._map=ClimateMap('files/2026-2050_A1FI_GIS/2026-2050-A1FI.shp')
-        self._filters = Filters(map=self._map.map, map_pane=self._map.map_pane)
+
+        # The default machine is shown first, or the first one with data in
+        # the CSV folder. Without any there is nothing to draw the map for
+        store = get_data_store()
+        machines = store.machine_names()
+        if not machines:
+            self._layout = pn.pane.Alert(
+                f"No machine data found. Add a `<machine>.csv` file to {store.csv_dir} and reload the page.",
+                alert_type='warning'
+            )
+            return
+
+        self._map=ClimateMap(KOPPEN_GIGER_PATH, machine=DEFAULT_MACHINE if DEFAULT_MACHINE in machines else machines[0])
+        self._filters = Filters(map=self._map, map_pane=self._map.map_pane)
         self.color_map=Color_map()
         self._searchBtn = self._filters.Search(self._map.add_marker, self.update_display_input)
         self.displayInput=pn.pane.Markdown() 
         self.slider=pn.widgets.RangeSlider(name='Costs (€/ton)', format='0.0a', start=270, end=600)
         self.slider.styles = margin
+        self.set_slider_range('CostsToCapture', 'Costs (€/ton)', 270, 600)
         self.details_button = None 
-        self.latest_coordinates = None
+        self.latest_site = None
 
-        # Read the CSV
-        df = pd.read_csv('files/csv/alpha1.csv')
+        # Details tab, built when it is first opened and reused for every site
+        self.site_details = None
 
-        # Adds values for date and id from the csv
-        date = df['Date'][1]
-        id_value = df['ID'][1]
+        # ID and date of the chosen machine, from its data in the shared store
+        self.id_pane = pn.pane.Markdown(styles=id_style)
+        self.date_pane = pn.pane.Markdown(styles=id_style)
+        self.update_machine_header(self._filters.machine_dropdown.value)
 
         # performance dropdown options
         self.performance_dropdown=pn.widgets.Select(
@@ -78,11 +113,48 @@ class Overview(pn.viewable.Viewer):
         
         # Look for changes in overview_dropdown
         self._filters.overview_dropdown.param.watch(self.switch_dropdown_options, 'value')
+        self._filters.overview_dropdown.param.watch(self.update_slider, 'value')
+
+        # Show another machine's data without rebuilding the map
+        self._filters.machine_dropdown.param.watch(self.switch_machine, 'value')
+
+        # Show another climate scenario, or where one differs from the shown one
+        self._filters.scenario_dropdown.param.watch(self.switch_scenario, 'value')
+        self._filters.compare_dropdown.param.watch(self.compare_scenario, 'value')
+
+        # Live readings are picked up while the page is open. There is one
+        # poller per server process, scheduling it again does nothing
+        self._doc = pn.state.curdoc
+        if self._doc is not None and self._doc.session_context is not None:
+            pn.state.schedule_task(
+                'carbyon_telemetry', poll_open_overviews, period=datetime.timedelta(milliseconds=POLL_PERIOD_MS)
+            )
+            _open_overviews.add(self)
+            pn.state.on_session_destroyed(lambda session_context: _open_overviews.discard(self))
+
+        # Highlight zones and sites while the slider is dragged
+        self.slider.param.watch(self.update_map_with_slider, 'value')
+
+        # Surface of estimated values between the measured sites
+        self.surface_dropdown = pn.widgets.Select(
+            name='Estimated surface',
+            options={'None': None, **{label: metric for metric, label in SURFACE_LABELS.items()}},
+            value=None
+        )
+        self.surface_dropdown.styles = margin
+        self.surface_dropdown.param.watch(self.show_surface, 'value')
+
+        # Measured sites of the machine, clustered per zoom level
+        self.sites_checkbox = pn.widgets.Checkbox(name='Show measured sites', value=True)
+        self.sites_checkbox.styles = margin
+        self.sites_checkbox.param.watch(self.show_sites, 'value')
         
         # Layout for the area right from the map
         self.details=pn.Column(
                     self.performance_dropdown,
                     self.slider,
+                    self.surface_dropdown,
+                    self.sites_checkbox,
                     pn.pane.Markdown("**Location Details:** ", styles=location_details),
                     self.displayInput
                     )
@@ -102,8 +174,8 @@ class Overview(pn.viewable.Viewer):
 
             # ID and DATE
             pn.Column(
-                pn.pane.Markdown(f"**ID:** {id_value}", styles=id_style),
-                pn.pane.Markdown(f"**Date:** {date}", styles=id_style),
+                self.id_pane,
+                self.date_pane,
                 styles={'width': 'fit-content', 'height': '1vh', 'margin-bottom':'50px',}
             ),
 
@@ -122,21 +194,18 @@ class Overview(pn.viewable.Viewer):
         )
 
     ### CALLBACK FUNCTIONS FOR ACTIONS ###    
+    @timed
     def update_map(self, event):
     
         # Callback function to update the map based on the selected performance filter.
         
         selected_performance = event.new  # Get the selected performance from dropdown
-        if selected_performance == 'Choose performance':
-            # If the default option is selected color map = original color
-            self._map.reset_to_full_color_map()
-        else:
-            # Filter the color map based on performance
-            updated_color_map = performance_filter(self.color_map, selected_performance)
-            
-            # Update the map colors dynamically
-            self._map.update_map_colors(updated_color_map)  # Call existing method in ClimateMap
+
+        # Filters the color map (or restores it for the default option), the
+        # color tables come from the shared render cache
+        self._map.apply_performance_filter(selected_performance)
     
+    @timed
     def update_display_input(self, location_details):
         
         # Update function the display with location details or a not found message.
@@ -148,7 +217,7 @@ class Overview(pn.viewable.Viewer):
             # print the location data of coordinates from the csv
             details = "\n".join(f"**{key}:** {value}" for key, value in location_details.items())
             self.displayInput.object = f"\n\n{details}"
-            self.latest_coordinates = location_details.get('coordinates') 
+            self.latest_site = (location_details['Lat'], location_details['Long'])
             self.add_details_button()
 
 
@@ -166,13 +235,21 @@ class Overview(pn.viewable.Viewer):
             self.details.remove(self.details_button)
             self.details_button = None  # Set to None after removing
 
+    @timed
     def handle_details_button_click(self, event):
-        # Creates a new tab for more detailed overview
-        content = pn.pane.Markdown("**Details:**")
-        new_tab = ("Details", content)
-        self.nav_tabs.append_new_tab(new_tab)  # Add the new tab
-        print("Appended new 'Details' tab")
+        # Opens the Details tab with the time series of the latest site, the
+        # tab is only added the first time and reused afterwards
+        if self.site_details is not None:
+            self.site_details.show(self._filters.machine_name, *self.latest_site, self._map.path)
+        self.nav_tabs.open_tab("Details", self.build_site_details)
+
+    def build_site_details(self):
+        # Builds the Details view when its tab is first shown
+        self.site_details = SiteDetails()
+        self.site_details.show(self._filters.machine_name, *self.latest_site, self._map.path)
+        return self.site_details
     
+    @timed
     def switch_dropdown_options(self, event):
         # Switch dropdown options based on overview dropdown selection
         if event.new == '€ / ton CO₂':
@@ -192,26 +269,89 @@ class Overview(pn.viewable.Viewer):
                 'Worst Energy Efficiency: 1100-1300 kWh/ton'
             ]
 
+    @timed
     def update_slider(self, event):
         # Update slider range and label based on overview dropdown selection
-        if event.new == '€ / ton CO₂':
-            self.slider.name = 'Costs (€/ton)'
-            self.slider.start = 270
-            self.slider.end = 600
-            self.slider.value = (270, 600)
+        self.reset_slider(event.new)
+
+    def reset_slider(self, overview):
+        # Default range and label of the slider for an overview
+        if overview == '€ / ton CO₂':
+            self.set_slider_range('CostsToCapture', 'Costs (€/ton)', 270, 600)
             self.slider.format = '0.0a'
-        elif event.new == 'kWh / ton':
-            self.slider.name = 'Energy (kWh/ton)'
-            self.slider.start = 500
-            self.slider.end = 1300
-            self.slider.value = (500, 1300)
+        elif overview == 'kWh / ton':
+            self.set_slider_range('EnergyRequirements', 'Energy (kWh/ton)', 500, 1300)
             self.slider.format = '0[.]0'
 
+    @timed
+    def switch_machine(self, event):
+        # Switches every view to the chosen machine, the map only gets the new
+        # tooltip ranges and the slider is reset to the machine's values
+        self._map.set_machine(event.new)
+        self._filters.set_machine(event.new)
+        self.update_machine_header(event.new)
+        self.reset_slider(self._filters.overview_dropdown.value)
+
+    @timed
+    def switch_scenario(self, event):
+        # Switches the map and the searches to another scenario's climate
+        # zones, the slider is reset to the ranges under the new zones
+        self._map.set_scenario(event.new)
+        self._filters.set_scenario(event.new)
+        self.reset_slider(self._filters.overview_dropdown.value)
+
+    @timed
+    def show_surface(self, event):
+        self._map.show_surface(event.new)
+
+    @timed
+    def show_sites(self, event):
+        self._map.show_sites(event.new)
+
+    @timed
+    def compare_scenario(self, event):
+        self._map.compare_scenario(event.new)
+
+    def update_machine_header(self, machine):
+        # Adds values for date and id of the latest reading
+        latest = site_details(get_data_store(self._map.path).machine(machine).iloc[-1])
+        self.id_pane.object = f"**ID:** {latest['ID']}"
+        self.date_pane.object = f"**Date:** {latest['Date']}"
+
+    def notify_readings(self):
+        # New readings were added by the shared poller, this page is updated
+        # on its own event loop tick. Bokeh's next tick callbacks may be added
+        # from any thread
+        def sync():
+            with set_curdoc(self._doc):
+                self.sync_telemetry()
+        self._doc.add_next_tick_callback(sync)
+
+    @timed
+    def sync_telemetry(self):
+        # Sends this page only the zones the new readings changed
+        if self._map.sync_machine_data():
+            self.update_machine_header(self._map.machine)
+
+    def set_slider_range(self, column, label, start, end):
+        # Widens the default range so every measured value can be selected
+        bounds = self._map.range_index.bounds(column)
+        if bounds:
+            start, end = min(start, bounds[0]), max(end, bounds[1])
+        self.slider_column = column
+        with param.edit_constant(self.slider):
+            self.slider.name = label
+        self.slider.param.update(start=start, end=end, value=(start, end))
+
+    @timed
     def update_map_with_slider(self, event):
         # Callback to update the map based on slider selection.
         selected_range = event.new  # Get the selected range from slider
-        filter_column = 'CostsToCapture' if self.slider.name == 'Costs (€/ton)' else 'EnergyRequirements'
-        self._map.apply_slider_filter(selected_range, filter_column)
+        if selected_range == (self.slider.start, self.slider.end):
+            # The whole range selected = no filter
+            self._map.clear_slider_filter()
+            return
+        self._map.apply_slider_filter(selected_range, self.slider_column)
 
     # Expose the layout for rendering
     def __panel__(self):
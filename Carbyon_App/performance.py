@@ -1,3 +1,40 @@
+# Color of each performance filter option, these are the same color buckets
+# as the climate zones in the color map
+PERFORMANCE_COLORS = {
+    "Best CO₂ Capture: Cost €277-€453/ton": '#90be6d',  # Green
+    "Good CO₂ Capture: Cost €281-€496/ton": '#e9c46a',  # Yellow 
+    "Moderate CO₂ Capture: Cost €327-€501/ton": '#f4a261',  # Orange
+    "Worst CO₂ Capture: Cost €357-€568/ton": '#e76f51',  # Red
+    "Best Energy Efficiency: 500-700 kWh/ton": '#90be6d',
+    "Good Energy Efficiency: 700-900 kWh/ton": '#e9c46a',
+    "Moderate Energy Efficiency: 900-1100 kWh/ton": '#f4a261',
+    "Worst Energy Efficiency: 1100-1300 kWh/ton": '#e76f51'
+}
+
+
+# Performance class of every color bucket
+PERFORMANCE_CLASSES = {
+    '#90be6d': 'Best',
+    '#e9c46a': 'Good',
+    '#f4a261': 'Moderate',
+    '#e76f51': 'Worst',
+}
+
+
+def performance_class(gridcode_color_map, gridcode):
+    """
+    Performance class (Best, Good, Moderate or Worst) of a climate zone.
+
+    gridcode_color_map (dict): Original GRIDCODE to color and description mapping.
+    gridcode (int): GRIDCODE of the climate zone.
+
+    Returns:
+        str: The class, or None for zones outside the color buckets.
+    """
+    color = gridcode_color_map.get(gridcode, (None, None))[0]
+    return PERFORMANCE_CLASSES.get(color)
+
+
 def performance_filter(gridcode_color_map, performance):
     """
     Change the color map based on the selected performance filter.
@@ -8,18 +45,7 @@ def performance_filter(gridcode_color_map, performance):
     Returns:
         dict: Updated GRIDCODE to color and description mapping.
     """
-    performance_colors = {
-        "Best CO₂ Capture: Cost €277-€453/ton": '#90be6d',  # Green
-        "Good CO₂ Capture: Cost €281-€496/ton": '#e9c46a',  # Yellow 
-        "Moderate CO₂ Capture: Cost €327-€501/ton": '#f4a261',  # Orange
-        "Worst CO₂ Capture: Cost €357-€568/ton": '#e76f51',  # Red
-        "Best Energy Efficiency: 500-700 kWh/ton": '#90be6d',
-        "Good Energy Efficiency: 700-900 kWh/ton": '#e9c46a',
-        "Moderate Energy Efficiency: 900-1100 kWh/ton": '#f4a261',
-        "Worst Energy Efficiency: 1100-1300 kWh/ton": '#e76f51'
-    }
-
-    selected_color = performance_colors.get(performance, None)
+    selected_color = PERFORMANCE_COLORS.get(performance, None)
 
     if selected_color is None:
         return gridcode_color_map
@@ -0,0 +1,78 @@
+import copy
+import numpy as np
+from zone_stats import METRICS
+
+
+def _merge(sorted_values, payload, values, new_payload):
+    # Inserts values and their payload into sorted arrays, keeping them sorted
+    order = np.argsort(values, kind='stable')
+    at = np.searchsorted(sorted_values, values[order], 'right')
+    return np.insert(sorted_values, at, values[order]), np.insert(payload, at, new_payload[order])
+
+
+class RangeIndex:
+    """
+    Sorted values of every metric, per site and per climate zone, so a value
+    range query is two binary searches instead of a scan of the data.
+
+    zone_index (ZoneIndex): Spatial index of the climate zones.
+    sites (DataFrame): Machine readings with Lat, Long and the metric columns.
+    """
+
+    def __init__(self, zone_index, sites):
+        self.lats = np.empty(0)
+        self.lons = np.empty(0)
+        self._sites = {metric: (np.empty(0), np.empty(0, dtype=int)) for metric in METRICS}
+        self._zones = {metric: (np.empty(0), zone_index.gridcodes[:0]) for metric in METRICS}
+        self._add(zone_index, sites)
+
+    def extended(self, zone_index, new_sites):
+        # A copy of the index with new sites after the existing ones, which
+        # keep their positions
+        index = copy.copy(self)
+        index._add(zone_index, new_sites)
+        return index
+
+    def _add(self, zone_index, sites):
+        # Merges sites into the sorted values, replacing the arrays instead of
+        # changing them so copies of the index stay as they were
+        offset = len(self.lats)
+        lats = sites['Lat'].to_numpy(dtype=float)
+        lons = sites['Long'].to_numpy(dtype=float)
+        self.lats = np.concatenate((self.lats, lats))
+        self.lons = np.concatenate((self.lons, lons))
+
+        # Sites in zones, readings on a border count for both zones
+        site_idx, zone_idx = zone_index.pairs(lats, lons, boundary=True)
+        zone_gridcodes = zone_index.gridcodes[zone_idx]
+
+        self._sites = dict(self._sites)
+        self._zones = dict(self._zones)
+        for metric in METRICS:
+            values = sites[metric].to_numpy(dtype=float)
+            known = np.flatnonzero(~np.isnan(values))
+
+            # Site positions ordered by value
+            self._sites[metric] = _merge(*self._sites[metric], values[known], known + offset)
+
+            # GRIDCODEs ordered by the value of their sites
+            pair_values = values[site_idx]
+            known = ~np.isnan(pair_values)
+            self._zones[metric] = _merge(*self._zones[metric], pair_values[known], zone_gridcodes[known])
+
+    def bounds(self, metric):
+        # Smallest and largest value of the metric, None without data
+        values = self._sites[metric][0]
+        if len(values) == 0:
+            return None
+        return float(values[0]), float(values[-1])
+
+    def sites(self, metric, low, high):
+        # Positions of the sites with low <= value <= high
+        values, positions = self._sites[metric]
+        return positions[np.searchsorted(values, low, 'left'):np.searchsorted(values, high, 'right')]
+
+    def zones(self, metric, low, high):
+        # GRIDCODEs of the zones with at least one site with low <= value <= high
+        values, gridcodes = self._zones[metric]
+        return np.unique(gridcodes[np.searchsorted(values, low, 'left'):np.searchsorted(values, high, 'right')])
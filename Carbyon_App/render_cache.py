@@ -0,0 +1,110 @@
+import json
+import threading
+from collections import OrderedDict
+
+# Memory the rendered artifacts may take together, in bytes
+MAX_CACHE_BYTES = 64 * 2 ** 20
+
+
+def json_size(value):
+    # Size of a message once it is sent to the browser
+    return len(json.dumps(value))
+
+
+class RenderCache:
+    """
+    Process-wide least recently used cache for rendered map artifacts (page
+    HTML and message payloads), shared by every session.
+
+    Keys are tuples which hold the version of the data the artifact was made
+    from, so changed data is never served from the cache. invalidate() frees
+    the outdated entries early.
+
+    max_bytes (int): Size of the cached artifacts above which the least
+    recently used ones are dropped.
+    """
+
+    def __init__(self, max_bytes=MAX_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def get_or_render(self, key, render, size=len):
+        """
+        Return the artifact cached under the key, rendering it on a miss.
+
+        Concurrent sessions asking for the same missing key wait for one render.
+
+        key (tuple): Cache key, including the versions of the data it depends on.
+        render (callable): Makes the artifact.
+        size (callable): Size of the artifact in bytes.
+
+        Returns:
+            The cached or newly rendered artifact.
+        """
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key][0]
+            pending = self._pending.setdefault(key, threading.Lock())
+
+        with pending:
+            with self._lock:
+                if key in self._entries:
+                    self.hits += 1
+                    self._entries.move_to_end(key)
+                    return self._entries[key][0]
+                self.misses += 1
+
+            try:
+                value = render()
+                self._store(key, value, size(value))
+            finally:
+                with self._lock:
+                    self._pending.pop(key, None)
+            return value
+
+    def _store(self, key, value, nbytes):
+        with self._lock:
+            if nbytes > self.max_bytes:
+                return
+            self._entries[key] = (value, nbytes)
+            self.size += nbytes
+            while self.size > self.max_bytes:
+                _, (_, dropped) = self._entries.popitem(last=False)
+                self.size -= dropped
+                self.evictions += 1
+
+    def invalidate(self, part):
+        # Drops every entry whose key contains part, e.g. a machine name. They
+        # count as evictions, like entries dropped for space
+        with self._lock:
+            for key in [key for key in self._entries if part in key]:
+                self.size -= self._entries.pop(key)[1]
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        # Counters for monitoring the cache
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+RENDER_CACHE = RenderCache()
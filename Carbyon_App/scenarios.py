@@ -0,0 +1,171 @@
+"""
+Catalogue of the Koppen-Geiger scenarios the app can show and the areas whose
+climate zone changes between two of them.
+
+Each scenario is a shapefile in the layout of the Rubel & Kottek downloads, e.g.
+files/2026-2050_A1FI_GIS/2026-2050-A1FI.shp. Scenarios whose shapefile is not
+there are left out of the selector. The change overlays are cached in
+files/cache and can be built ahead of serving the app:
+
+    python scenarios.py
+"""
+import hashlib
+import os
+import threading
+import geopandas as gpd
+import numpy as np
+import shapely
+from color_map import Color_map
+from columnar_cache import CACHE_DIR, geo_extension, read_geo, source_fingerprint, write_geo, _replace_stale
+from data_store import get_data_store, BASE_DIR, KOPPEN_GIGER_PATH
+from performance import performance_class
+
+# Folder with one <period>[_<scenario>]_GIS folder per scenario
+SCENARIO_DIR = os.environ.get('CARBYON_SCENARIO_DIR', os.path.join(BASE_DIR, 'files'))
+
+# Observed climate and the emission scenarios of the projected periods
+BASELINE_PERIOD = '1976-2000'
+PROJECTED_PERIODS = ('2001-2025', '2026-2050', '2051-2075', '2076-2100')
+EMISSION_SCENARIOS = ('A1FI', 'A2', 'B1', 'B2')
+
+# Tolerance in degrees the change areas are simplified with before they are drawn
+CHANGES_TOLERANCE = 0.05
+
+
+def scenario_catalogue(scenario_dir=SCENARIO_DIR):
+    """
+    Every known scenario with the path its shapefile would have.
+
+    Returns:
+        dict: Scenario name (e.g. '2026-2050 A1FI') to shapefile path, the
+        observed baseline first.
+    """
+    catalogue = {
+        f'{BASELINE_PERIOD} observed': os.path.join(scenario_dir, f'{BASELINE_PERIOD}_GIS', f'{BASELINE_PERIOD}.shp')
+    }
+    for period in PROJECTED_PERIODS:
+        for scenario in EMISSION_SCENARIOS:
+            catalogue[f'{period} {scenario}'] = os.path.join(
+                scenario_dir, f'{period}_{scenario}_GIS', f'{period}-{scenario}.shp'
+            )
+    return catalogue
+
+
+def available_scenarios(scenario_dir=SCENARIO_DIR):
+    # Scenarios with a shapefile, the bundled one is always there
+    scenarios = {
+        name: os.path.abspath(path) for name, path in scenario_catalogue(scenario_dir).items() if os.path.exists(path)
+    }
+    if os.path.abspath(KOPPEN_GIGER_PATH) not in scenarios.values():
+        scenarios['2026-2050 A1FI'] = os.path.abspath(KOPPEN_GIGER_PATH)
+    return scenarios
+
+
+def _polygons(geometries):
+    # Polygonal part of every geometry, the lines and points where zones only
+    # touch are dropped. Returns the positions kept and their MultiPolygons
+    parts, index = shapely.get_parts(geometries, return_index=True)
+    parts, part_index = shapely.get_parts(parts, return_index=True)
+    index = index[part_index]
+    keep = (shapely.get_type_id(parts) == shapely.GeometryType.POLYGON) & ~shapely.is_empty(parts)
+    parts, index = parts[keep], index[keep]
+    positions = np.unique(index)
+    return positions, shapely.multipolygons(parts, indices=np.searchsorted(positions, index))
+
+
+def zone_changes(before, after, color_map=None):
+    """
+    Areas whose climate zone differs between two scenarios.
+
+    The zones of one scenario are put in an STRtree, so only the overlapping
+    pairs of zones are intersected.
+
+    before, after (GeoDataFrame): Climate zones of the two scenarios in the same crs.
+    color_map (dict): GRIDCODE to color and description mapping.
+
+    Returns:
+        GeoDataFrame: One row per changed area with the GRIDCODE, description
+        and performance class before and after, and whether the class changed.
+    """
+    color_map = color_map if color_map else Color_map()
+    before_geometries = before.geometry.to_numpy()
+    after_geometries = after.geometry.to_numpy()
+    before_codes = before['GRIDCODE'].to_numpy()
+    after_codes = after['GRIDCODE'].to_numpy()
+
+    after_idx, before_idx = shapely.STRtree(before_geometries).query(after_geometries, predicate='intersects')
+    differs = before_codes[before_idx] != after_codes[after_idx]
+    before_idx, after_idx = before_idx[differs], after_idx[differs]
+
+    positions, geometries = _polygons(
+        shapely.intersection(before_geometries[before_idx], after_geometries[after_idx])
+    )
+    changes = gpd.GeoDataFrame({
+        'GRIDCODE_before': before_codes[before_idx[positions]].astype(int),
+        'GRIDCODE_after': after_codes[after_idx[positions]].astype(int),
+    }, geometry=geometries, crs=before.crs)
+
+    for when in ('before', 'after'):
+        codes = changes[f'GRIDCODE_{when}']
+        changes[f'description_{when}'] = codes.map({code: value[1] for code, value in color_map.items()}).fillna('Unknown')
+        changes[f'class_{when}'] = codes.map(lambda code: performance_class(color_map, code))
+    changes['class_changed'] = changes['class_before'].fillna('') != changes['class_after'].fillna('')
+    return changes
+
+
+def changes_cache_path(before_path, after_path, cache_dir=CACHE_DIR):
+    # Cache file of a pair of scenarios, stale as soon as either shapefile changes
+    names = [os.path.splitext(os.path.basename(path))[0] for path in (before_path, after_path)]
+    fingerprint = hashlib.sha1(
+        (source_fingerprint(before_path) + source_fingerprint(after_path)).encode()
+    ).hexdigest()[:12]
+    return os.path.join(cache_dir, f'{names[0]}-vs-{names[1]}-changes-{fingerprint}.{geo_extension()}')
+
+
+_changes = {}
+_changes_lock = threading.Lock()
+
+
+def load_zone_changes(before_path, after_path):
+    """
+    Return the areas whose climate zone changes between two scenarios, from
+    memory, from the disk cache or computed now.
+
+    before_path, after_path (str): Shapefiles of the two scenarios.
+
+    Returns:
+        GeoDataFrame: See zone_changes().
+    """
+    path = changes_cache_path(before_path, after_path)
+
+    # The lock makes sure concurrent sessions wait for a single overlay
+    with _changes_lock:
+        if path not in _changes:
+            if os.path.exists(path):
+                changes = read_geo(path)
+            else:
+                changes = zone_changes(get_data_store(before_path).zones, get_data_store(after_path).zones)
+                write_geo(changes, path)
+                _replace_stale(path)
+            _changes[path] = changes
+        return _changes[path]
+
+
+def zone_changes_geojson(before_path, after_path):
+    # The change areas as a GeoJSON dictionary, simplified for drawing
+    changes = load_zone_changes(before_path, after_path)
+    drawn = changes.drop(columns=['class_before', 'class_after']).assign(
+        geometry=shapely.simplify(changes.geometry.to_numpy(), CHANGES_TOLERANCE, preserve_topology=True)
+    )
+    return drawn[~drawn.geometry.is_empty].__geo_interface__
+
+
+if __name__ == '__main__':
+    scenarios = available_scenarios()
+    for before_name, before_path in scenarios.items():
+        for after_name, after_path in scenarios.items():
+            if before_name != after_name:
+                changes = load_zone_changes(before_path, after_path)
+                print(f"{before_name} -> {after_name}: {len(changes)} changed areas, "
+                      f"{int(changes['class_changed'].sum())} with another performance class "
+                      f"-> {changes_cache_path(before_path, after_path)}")
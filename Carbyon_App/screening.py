@@ -0,0 +1,157 @@
+"""
+Headless screening of candidate DAC sites.
+
+Every site gets the same climate zone, performance class and zone ranges as the
+dashboard shows, plus the nearest measured site of the machine:
+
+    python screening.py candidates.csv -o screened.csv --machine alpha1
+"""
+import argparse
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from color_map import Color_map
+import numpy as np
+from data_store import get_data_store, DEFAULT_MACHINE, KOPPEN_GIGER_PATH
+from performance import performance_class
+from zone_stats import METRICS
+
+CHUNK_SIZE = 50_000
+
+
+def screen_sites(sites, machine=DEFAULT_MACHINE, koppen_giger_data_path=KOPPEN_GIGER_PATH,
+                 lat_column='Lat', lon_column='Long'):
+    """
+    Screen a batch of candidate sites.
+
+    sites (DataFrame): Candidate sites with latitude and longitude columns.
+    machine (str): Machine whose measurements are used.
+    koppen_giger_data_path (str): Climate zones shapefile.
+
+    Returns:
+        DataFrame: The candidate sites with climate zone, performance class,
+        nearest measured site and the zone's cost and energy ranges. The
+        nearest site columns are empty when the machine has no sites.
+    """
+    store = get_data_store(koppen_giger_data_path)
+    machine_data = store.machine(machine)
+    lats = sites[lat_column].to_numpy(dtype=float)
+    lons = sites[lon_column].to_numpy(dtype=float)
+
+    # Climate zone and performance class, the same lookups as the dashboard
+    zones = store.zone_index.classify(lats, lons)
+    color_map = Color_map()
+    classes = {gridcode: performance_class(color_map, gridcode) for gridcode in color_map}
+
+    # Nearest measured site (great-circle distance), none for a machine
+    # without sites
+    if len(machine_data) and len(sites):
+        positions, distances = store.site_index(machine).nearest_many(lats, lons)
+        nearest = machine_data.iloc[positions]
+    else:
+        nearest = machine_data.iloc[:0].reindex(range(len(sites)))
+        distances = np.full(len(sites), np.nan)
+
+    result = sites.reset_index(drop=True).copy()
+    result['GRIDCODE'] = zones['GRIDCODE']
+    result['description'] = zones['description']
+    result['performance'] = zones['GRIDCODE'].map(classes)
+    result['nearest_ID'] = nearest['ID'].to_numpy()
+    result['nearest_Lat'] = nearest['Lat'].to_numpy()
+    result['nearest_Long'] = nearest['Long'].to_numpy()
+    result['nearest_distance_km'] = distances
+
+    # Cost and energy ranges of the zone, empty for zones without readings
+    statistics = store.zone_statistics(machine)
+    ranges = statistics.ranges()
+    for metric in METRICS:
+        measured = ranges[f'{metric}_range'].where(statistics.table[f'{metric}_count'] > 0)
+        result[f'{metric}_range'] = zones['GRIDCODE'].map(measured)
+    return result
+
+
+def read_chunks(path, chunksize=CHUNK_SIZE):
+    # Streams a CSV or Parquet file as DataFrames of at most chunksize rows
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunksize)
+
+
+def _load_worker(koppen_giger_data_path):
+    # Every worker process loads the shared data once, not once per chunk
+    get_data_store(koppen_giger_data_path)
+
+
+def screen_file(input_path, output_path, machine=DEFAULT_MACHINE, koppen_giger_data_path=KOPPEN_GIGER_PATH,
+                chunksize=CHUNK_SIZE, workers=None, lat_column='Lat', lon_column='Long'):
+    """
+    Screen every site of a CSV or Parquet file across a process pool.
+
+    The file is read in chunks which are screened in parallel and written to
+    output_path (CSV or Parquet) in the input order.
+
+    Returns:
+        int: Number of screened sites.
+    """
+    workers = workers or os.cpu_count()
+    count = 0
+    writer = None
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_load_worker,
+                             initargs=(koppen_giger_data_path,)) as executor:
+        pending = deque()
+
+        def write(result):
+            nonlocal writer, count
+            if output_path.endswith('.parquet'):
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+                table = pa.Table.from_pandas(result, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(output_path, table.schema)
+                writer.write_table(table)
+            else:
+                result.to_csv(output_path, mode='w' if count == 0 else 'a', header=count == 0, index=False)
+            count += len(result)
+
+        # Only a few chunks per worker are in flight, so memory stays bounded
+        for chunk in read_chunks(input_path, chunksize):
+            pending.append(executor.submit(
+                screen_sites, chunk, machine, koppen_giger_data_path, lat_column, lon_column
+            ))
+            if len(pending) >= 2 * workers:
+                write(pending.popleft().result())
+        while pending:
+            write(pending.popleft().result())
+
+    if writer is not None:
+        writer.close()
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Screen candidate DAC sites.")
+    parser.add_argument('input', help="CSV or Parquet file with candidate coordinates")
+    parser.add_argument('-o', '--output', required=True, help="CSV or Parquet file for the results")
+    parser.add_argument('--machine', default=DEFAULT_MACHINE)
+    parser.add_argument('--zones', default=KOPPEN_GIGER_PATH, help="Climate zones shapefile")
+    parser.add_argument('--chunksize', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--lat-column', default='Lat')
+    parser.add_argument('--lon-column', default='Long')
+    args = parser.parse_args(argv)
+
+    count = screen_file(
+        args.input, args.output, machine=args.machine, koppen_giger_data_path=args.zones,
+        chunksize=args.chunksize, workers=args.workers,
+        lat_column=args.lat_column, lon_column=args.lon_column
+    )
+    print(f"Screened {count} sites into {args.output}")
+
+
+if __name__ == '__main__':
+    main()
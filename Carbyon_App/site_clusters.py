@@ -0,0 +1,139 @@
+import copy
+import threading
+import numpy as np
+
+# Size in screen pixels of the grid cells sites are clustered in
+CLUSTER_PIXELS = 60
+
+# Most clusters sent for one view, the largest ones are kept
+MAX_CLUSTERS = 2000
+
+# Levels with more clusters than this share of the sites are not kept, the
+# sites in view are returned one by one instead
+MAX_CLUSTER_SHARE = 0.25
+
+
+def mercator(lats, lons):
+    # Web mercator position of coordinates, 0 to 1 from west to east and north to south
+    lat = np.radians(np.clip(np.asarray(lats, dtype=float), -85.0511, 85.0511))
+    x = (np.asarray(lons, dtype=float) + 180) / 360
+    y = (1 - np.log(np.tan(lat) + 1 / np.cos(lat)) / np.pi) / 2
+    return x, y
+
+
+def in_bounds(lats, lons, south, west, north, east):
+    # Whether coordinates lie in a map view, which may cross the antimeridian
+    inside = (lats >= south) & (lats <= north)
+    if east - west >= 360:
+        return inside
+    return inside & ((lons - west) % 360 <= east - west)
+
+
+class SiteClusters:
+    """
+    Measured sites grouped per zoom level into the cells of a grid of
+    CLUSTER_PIXELS screen pixels, with their count, mean position and mean
+    cost. A level is built on first use with a few vectorized passes over the
+    sites, a view only filters the clusters of its level.
+
+    sites (DataFrame): Machine readings with Lat, Long and CostsToCapture columns.
+    """
+
+    def __init__(self, sites):
+        # The sites are kept sorted by latitude, a close up view only looks
+        # at the sites in its band of latitudes
+        lats = sites['Lat'].to_numpy(dtype=float)
+        order = np.argsort(lats, kind='stable')
+        self.lats = lats[order]
+        self.lons = sites['Long'].to_numpy(dtype=float)[order]
+        self.costs = sites['CostsToCapture'].to_numpy(dtype='float32')[order]
+        self.x, self.y = mercator(self.lats, self.lons)
+        self._levels = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.lats)
+
+    def extended(self, new_sites):
+        # A copy with the new sites inserted in latitude order, its levels
+        # are built again on use
+        index = copy.copy(self)
+        added = SiteClusters(new_sites)
+        positions = np.searchsorted(self.lats, added.lats, side='right')
+        for name in ('lats', 'lons', 'costs', 'x', 'y'):
+            setattr(index, name, np.insert(getattr(self, name), positions, getattr(added, name)))
+        index._levels = {}
+        index._lock = threading.Lock()
+        return index
+
+    def level(self, zoom):
+        """
+        The clusters of a zoom level.
+
+        Returns:
+            dict: Arrays lat, lon, count and cost (mean, NaN without costs),
+            None when the level has about as many clusters as sites.
+        """
+        with self._lock:
+            if zoom not in self._levels:
+                self._levels[zoom] = self._build_level(zoom)
+            return self._levels[zoom]
+
+    def _build_level(self, zoom):
+        cells_per_side = 256 * 2 ** zoom / CLUSTER_PIXELS
+        columns = int(np.ceil(cells_per_side))
+        cell_x = np.minimum((self.x * cells_per_side).astype('int64'), columns - 1)
+        cell_y = np.clip((self.y * cells_per_side).astype('int64'), 0, columns - 1)
+        cells, cluster_of_site = np.unique(cell_y * columns + cell_x, return_inverse=True)
+        if len(cells) > MAX_CLUSTER_SHARE * len(self) and len(cells) > MAX_CLUSTERS:
+            return None
+
+        count = np.bincount(cluster_of_site, minlength=len(cells))
+        measured = ~np.isnan(self.costs)
+        costs = np.bincount(cluster_of_site, np.where(measured, self.costs, 0), len(cells))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return {
+                'lat': np.bincount(cluster_of_site, self.lats, len(cells)) / count,
+                'lon': np.bincount(cluster_of_site, self.lons, len(cells)) / count,
+                'count': count,
+                'cost': costs / np.bincount(cluster_of_site, measured, len(cells)),
+            }
+
+    def view(self, zoom, south, west, north, east):
+        """
+        Clusters in a map view.
+
+        zoom (int): Zoom level of the map.
+        south, west, north, east (float): Bounds of the view in degrees.
+
+        Returns:
+            list: [lat, lon, count, mean cost or None] per cluster, at most
+            MAX_CLUSTERS of the largest ones.
+        """
+        level = self.level(max(0, int(zoom)))
+        if level is None:
+            return self._sites_in_view(south, west, north, east)
+
+        inside = np.flatnonzero(in_bounds(level['lat'], level['lon'], south, west, north, east))
+        if len(inside) > MAX_CLUSTERS:
+            inside = inside[np.argpartition(-level['count'][inside], MAX_CLUSTERS - 1)[:MAX_CLUSTERS]]
+        return _clusters(level['lat'][inside], level['lon'][inside], level['count'][inside], level['cost'][inside])
+
+    def _sites_in_view(self, south, west, north, east):
+        # Close in, every site in view is its own cluster. Beyond MAX_CLUSTERS
+        # sites an even spread of them is sent
+        start, stop = np.searchsorted(self.lats, south, side='left'), np.searchsorted(self.lats, north, side='right')
+        inside = start + np.flatnonzero(
+            in_bounds(self.lats[start:stop], self.lons[start:stop], south, west, north, east)
+        )
+        if len(inside) > MAX_CLUSTERS:
+            inside = inside[np.linspace(0, len(inside) - 1, MAX_CLUSTERS).astype(int)]
+        return _clusters(self.lats[inside], self.lons[inside], np.ones(len(inside), dtype=int), self.costs[inside])
+
+
+def _clusters(lats, lons, counts, costs):
+    # [lat, lon, count, mean cost or None] per cluster, rounded for the message
+    return [
+        [round(float(lat), 5), round(float(lon), 5), int(count), None if cost != cost else round(float(cost), 1)]
+        for lat, lon, count, cost in zip(lats, lons, counts, costs)
+    ]
@@ -0,0 +1,103 @@
+import copy
+import numpy as np
+from geopy.distance import geodesic
+
+# Mean earth radius used for the great-circle shortlist
+EARTH_RADIUS_KM = 6371.0088
+
+# Upper bound on query x site pairs held in memory at once by nearest_many
+PAIRS_PER_CHUNK = 20_000_000
+
+
+def unit_vectors(lats, lons):
+    # Coordinates in degrees as points on the unit sphere, so the closest site
+    # is the one with the largest dot product
+    lat = np.radians(np.asarray(lats, dtype=float))
+    lon = np.radians(np.asarray(lons, dtype=float))
+    cos_lat = np.cos(lat)
+    return np.column_stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)))
+
+
+def great_circle_km(dots):
+    # Great-circle distance for the dot products of unit vectors
+    return EARTH_RADIUS_KM * np.arccos(np.clip(dots, -1.0, 1.0))
+
+
+class SiteIndex:
+    """
+    Nearest measured site search over the machine readings.
+
+    A vectorized great-circle kernel shortlists the closest sites, exact
+    geodesic distances are only computed for that shortlist. The index keeps its
+    own arrays and never writes to the data it was built from.
+
+    sites (DataFrame): Machine readings with Lat and Long columns.
+    """
+
+    def __init__(self, sites):
+        self.lats = sites['Lat'].to_numpy(dtype=float)
+        self.lons = sites['Long'].to_numpy(dtype=float)
+        self.vectors = unit_vectors(self.lats, self.lons)
+
+    def __len__(self):
+        return len(self.lats)
+
+    def extended(self, new_sites):
+        # A copy of the index with new sites after the existing ones, which
+        # keep their positions
+        index = copy.copy(self)
+        lats = new_sites['Lat'].to_numpy(dtype=float)
+        lons = new_sites['Long'].to_numpy(dtype=float)
+        index.lats = np.concatenate((self.lats, lats))
+        index.lons = np.concatenate((self.lons, lons))
+        index.vectors = np.concatenate((self.vectors, unit_vectors(lats, lons)))
+        return index
+
+    def nearest(self, lat, lon, k=1):
+        """
+        Find the k nearest sites to a coordinate.
+
+        lat, lon (float): Searched coordinate.
+        k (int): Number of sites to return.
+
+        Returns:
+            tuple: Row positions of the sites and their geodesic distances in
+            km, closest first.
+        """
+        if len(self) == 0:
+            return np.array([], dtype=int), np.array([])
+        k = min(k, len(self))
+
+        # The sphere and the ellipsoid can order almost equally far sites
+        # differently, so a few more candidates are checked exactly
+        shortlist = min(len(self), max(4 * k, k + 8))
+        dots = self.vectors @ unit_vectors([lat], [lon])[0]
+        candidates = np.argpartition(-dots, shortlist - 1)[:shortlist]
+
+        distances = np.array([
+            geodesic((lat, lon), (self.lats[i], self.lons[i])).kilometers for i in candidates
+        ])
+        order = np.argsort(distances, kind='stable')[:k]
+        return candidates[order], distances[order]
+
+    def nearest_many(self, lats, lons):
+        """
+        Find the nearest site to every coordinate of a batch.
+
+        Returns:
+            tuple: Row position of the nearest site per coordinate and the
+            great-circle distance to it in km.
+        """
+        queries = unit_vectors(lats, lons)
+        positions = np.zeros(len(queries), dtype=int)
+        distances = np.full(len(queries), np.nan)
+        if len(self) == 0:
+            return positions, distances
+
+        chunk = max(1, PAIRS_PER_CHUNK // len(self))
+        for start in range(0, len(queries), chunk):
+            dots = queries[start:start + chunk] @ self.vectors.T
+            best = dots.argmax(axis=1)
+            positions[start:start + chunk] = best
+            distances[start:start + chunk] = great_circle_km(dots[np.arange(len(best)), best])
+        return positions, distances
@@ -0,0 +1,241 @@
+"""
+Estimated costs and energy requirements on a global lattice, interpolated
+from a machine's measured sites.
+
+Every land cell gets an inverse distance weighted mean of the sites, sites in
+the same climate zone weigh SAME_ZONE_WEIGHT times more. The sites are first
+binned per source cell and GRIDCODE, so the work depends on the area the sites
+cover rather than on the number of readings. The estimates are float32 arrays,
+looking up a coordinate is an index into them.
+"""
+import base64
+import io
+import os
+import numpy as np
+from matplotlib import colormaps
+from matplotlib.image import imsave
+from site_index import unit_vectors, EARTH_RADIUS_KM
+from zone_stats import METRICS
+
+# Cell size of the lattice in degrees
+SURFACE_RESOLUTION = float(os.environ.get('CARBYON_SURFACE_RESOLUTION', 0.5))
+
+# Cell size in degrees the sites are binned in before interpolating
+SOURCE_RESOLUTION = 3.0
+
+# Inverse distance power, extra weight of sites in the same climate zone and
+# the distance below which sites count as on top of the cell
+IDW_POWER = 2
+SAME_ZONE_WEIGHT = 10
+MIN_DISTANCE_KM = 25
+
+# Upper bound on cell x source pairs held in memory at once
+PAIRS_PER_CHUNK = 20_000_000
+
+# Names of the METRICS in the app
+SURFACE_LABELS = {
+    'CostsToCapture': 'Costs to capture',
+    'EnergyRequirements': 'Energy requirements',
+}
+
+# Colors of the overlay image and the latitudes a web map can show
+SURFACE_COLORMAP = 'viridis'
+MAX_MERCATOR_LAT = 85.0511
+
+
+def cell_centers(resolution):
+    # Latitudes (north to south) and longitudes (west to east) of the cell centers
+    lats = 90 - resolution * (np.arange(round(180 / resolution)) + 0.5)
+    lons = -180 + resolution * (np.arange(round(360 / resolution)) + 0.5)
+    return lats, lons
+
+
+def cell_of(lats, lons, resolution):
+    # Row and column of the cells holding the coordinates
+    rows = np.clip(((90 - np.asarray(lats, dtype=float)) // resolution).astype(int), 0, round(180 / resolution) - 1)
+    cols = np.clip(((np.asarray(lons, dtype=float) + 180) // resolution).astype(int), 0, round(360 / resolution) - 1)
+    return rows, cols
+
+
+def zone_grid(zone_index, resolution):
+    """
+    GRIDCODE of every cell center, 0 for cells outside the climate zones.
+
+    Returns:
+        ndarray: int16 array of shape (rows, columns), north at the top.
+    """
+    lats, lons = cell_centers(resolution)
+    grid_lats, grid_lons = np.meshgrid(lats, lons, indexing='ij')
+    gridcodes = zone_index.classify(grid_lats.ravel(), grid_lons.ravel())['GRIDCODE']
+    return gridcodes.fillna(0).to_numpy(dtype='int16').reshape(grid_lats.shape)
+
+
+def interpolate(gridcodes, resolution, sites):
+    """
+    Estimate the METRICS on every land cell of the lattice.
+
+    gridcodes (ndarray): GRIDCODE per cell, see zone_grid().
+    resolution (float): Cell size of the lattice in degrees.
+    sites (DataFrame): Machine readings with Lat, Long and the METRICS columns.
+
+    Returns:
+        dict: float32 array per metric in the shape of gridcodes, NaN outside
+        the zones and where no site has a value.
+    """
+    metrics = list(METRICS)
+    estimates = {metric: np.full(gridcodes.shape, np.nan, dtype='float32') for metric in metrics}
+    if not len(sites):
+        return estimates
+
+    # Sources: the sites binned per coarse cell and climate zone, with the sum
+    # and the number of values of every metric
+    lats = sites['Lat'].to_numpy(dtype=float)
+    lons = sites['Long'].to_numpy(dtype=float)
+    rows, cols = cell_of(lats, lons, resolution)
+    source_rows, source_cols = cell_of(lats, lons, SOURCE_RESOLUTION)
+    site_codes = gridcodes[rows, cols].astype('int64')
+    keys = (source_rows.astype('int64') * round(360 / SOURCE_RESOLUTION) + source_cols) * 2 ** 16 + site_codes
+    keys, source_of_site = np.unique(keys, return_inverse=True)
+    source_codes = keys % 2 ** 16
+
+    values = sites[metrics].to_numpy(dtype=float)
+    measured = ~np.isnan(values)
+    sums = np.zeros((len(keys), len(metrics)))
+    counts = np.zeros((len(keys), len(metrics)))
+    for i in range(len(metrics)):
+        sums[:, i] = np.bincount(source_of_site, np.where(measured[:, i], values[:, i], 0), len(keys))
+        counts[:, i] = np.bincount(source_of_site, measured[:, i], len(keys))
+
+    # Every source sits at the mean position of its sites
+    vectors = unit_vectors(lats, lons)
+    positions = np.column_stack([np.bincount(source_of_site, vectors[:, i], len(keys)) for i in range(3)])
+    positions /= np.linalg.norm(positions, axis=1, keepdims=True)
+
+    # Only the land cells are estimated
+    land_rows, land_cols = np.nonzero(gridcodes)
+    cell_lats, cell_lons = cell_centers(resolution)
+    cells = unit_vectors(cell_lats[land_rows], cell_lons[land_cols])
+    cell_codes = gridcodes[land_rows, land_cols]
+
+    def weighted(cells, positions, sums, counts):
+        # Inverse distance weighted sums and counts, in chunks of cells. The
+        # squared chord length stands in for the squared distance, which
+        # avoids an arccos per pair and only differs for far away sites
+        cells, positions = cells.astype('float32'), positions.astype('float32')
+        values = np.hstack([sums, counts]).astype('float32')
+        min_chord2 = np.float32((MIN_DISTANCE_KM / EARTH_RADIUS_KM) ** 2)
+        result = np.empty((len(cells), values.shape[1]))
+        chunk = max(1, PAIRS_PER_CHUNK // max(1, len(positions)))
+        buffer = np.empty((min(chunk, len(cells)), len(positions)), dtype='float32')
+        for start in range(0, len(cells), chunk):
+            # In place on one buffer, the pair matrix is the bulk of the work
+            weights = buffer[:len(cells[start:start + chunk])]
+            np.matmul(cells[start:start + chunk], positions.T, out=weights)
+            weights *= -2
+            weights += 2
+            np.maximum(weights, min_chord2, out=weights)
+            if IDW_POWER == 2:
+                np.reciprocal(weights, out=weights)
+            else:
+                np.power(weights, np.float32(-IDW_POWER / 2), out=weights)
+            result[start:start + chunk] = weights @ values
+        return result
+
+    totals = weighted(cells, positions, sums, counts)
+
+    # Sites in the cell's own climate zone count SAME_ZONE_WEIGHT times, the
+    # extra weight only needs the pairs within each zone
+    for code in np.intersect1d(np.unique(cell_codes), source_codes):
+        in_zone, from_zone = cell_codes == code, source_codes == code
+        totals[in_zone] += (SAME_ZONE_WEIGHT - 1) * weighted(
+            cells[in_zone], positions[from_zone], sums[from_zone], counts[from_zone]
+        )
+    weighted_sums, weighted_counts = totals[:, :len(metrics)], totals[:, len(metrics):]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = weighted_sums / weighted_counts
+    for i, metric in enumerate(metrics):
+        estimates[metric][land_rows, land_cols] = means[:, i]
+    return estimates
+
+
+class Surface:
+    """
+    Interpolated METRICS on a global lattice with O(1) lookups of a coordinate.
+
+    resolution (float): Cell size of the lattice in degrees.
+    estimates (dict): float32 array per metric, see interpolate().
+    """
+
+    def __init__(self, resolution, estimates):
+        self.resolution = resolution
+        self.estimates = estimates
+
+        # Version of the machine data it was built from, set by the DataStore
+        self.data_version = None
+
+    @property
+    def nbytes(self):
+        return sum(values.nbytes for values in self.estimates.values())
+
+    def estimate(self, lat, lon):
+        # Estimated metrics at a coordinate, None outside the zones
+        row, col = cell_of(lat, lon, self.resolution)
+        values = {metric: float(grid[row, col]) for metric, grid in self.estimates.items()}
+        if all(np.isnan(value) for value in values.values()):
+            return None
+        return values
+
+    def bounds(self, metric):
+        # Lowest and highest estimate of a metric, None without estimates
+        values = self.estimates[metric]
+        if np.isnan(values).all():
+            return None
+        return float(np.nanmin(values)), float(np.nanmax(values))
+
+    def image(self, metric):
+        """
+        The estimates of a metric as a PNG for a web map overlay.
+
+        The rows are resampled to equal steps in web mercator, which is how the
+        map stretches an image between its bounds. Cells without an estimate
+        are transparent.
+
+        Returns:
+            str: PNG data URL.
+        """
+        values = self.estimates[metric]
+        bounds = self.bounds(metric)
+        rows = values.shape[0]
+
+        # Latitude of every image row in mercator steps, and the lattice row there
+        y = np.linspace(np.log(np.tan(np.pi / 4 + np.radians(MAX_MERCATOR_LAT) / 2)),
+                        -np.log(np.tan(np.pi / 4 + np.radians(MAX_MERCATOR_LAT) / 2)), rows)
+        lats = np.degrees(2 * np.arctan(np.exp(y)) - np.pi / 2)
+        resampled = values[cell_of(lats, np.zeros(rows), self.resolution)[0]]
+
+        low, high = bounds if bounds else (0, 1)
+        scaled = (resampled - low) / ((high - low) or 1)
+        rgba = colormaps[SURFACE_COLORMAP](np.nan_to_num(scaled), bytes=True)
+        rgba[np.isnan(resampled), 3] = 0
+
+        buffer = io.BytesIO()
+        imsave(buffer, rgba, format='png')
+        return 'data:image/png;base64,' + base64.b64encode(buffer.getvalue()).decode()
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez(path, resolution=self.resolution, **self.estimates)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as saved:
+            return cls(float(saved['resolution']), {metric: saved[metric] for metric in METRICS})
+
+
+def surface_colors(count=5):
+    # Colors along the overlay colormap, e.g. for a legend
+    return [
+        '#{:02x}{:02x}{:02x}'.format(*color[:3])
+        for color in colormaps[SURFACE_COLORMAP](np.linspace(0, 1, count), bytes=True)
+    ]
@@ -0,0 +1,138 @@
+"""
+Append-only ingestion of live machine readings.
+
+Readings are appended to files/telemetry/<machine>.csv (with a header line) or
+<machine>.jsonl (one JSON object per line), with the same columns as the
+machine CSVs, e.g. by a collector receiving them from the machines. Every poll
+only reads the complete lines written since the previous one. Another folder
+can be set with:
+
+    CARBYON_TELEMETRY_DIR=/data/telemetry panel serve app.py
+"""
+import io
+import json
+import logging
+import os
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+TELEMETRY_DIR = os.environ.get(
+    'CARBYON_TELEMETRY_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'files', 'telemetry')
+)
+
+# How often the server looks for new readings, in milliseconds
+POLL_PERIOD_MS = 5000
+
+TELEMETRY_EXTENSIONS = ('.csv', '.jsonl')
+
+
+def telemetry_paths(telemetry_dir, machine):
+    # Files the readings of a machine can be appended to
+    return [os.path.join(telemetry_dir, f'{machine}{extension}') for extension in TELEMETRY_EXTENSIONS]
+
+
+class TelemetryTail:
+    """
+    Reads the lines appended to a CSV or JSON lines file since the last read.
+
+    A read only moves on once commit() is called, so lines whose readings could
+    not be added are read again. Malformed lines are logged and skipped. A file
+    which is replaced or truncated (e.g. rotated by the collector) is read
+    again from the start.
+
+    path (str): Path to the .csv or .jsonl file, it does not have to exist yet.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.header = None
+        self._inode = None
+
+        # Position, header and file of the last read, until it is committed
+        self._pending = None
+
+    def read(self):
+        """
+        Returns:
+            DataFrame: The readings appended since the last committed read,
+            None if there are none.
+        """
+        self._pending = None
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+
+        offset, header = self.offset, self.header
+        if stat.st_ino != self._inode or stat.st_size < offset:
+            offset, header = 0, None
+        self._pending = (stat.st_ino, offset, header)
+        if stat.st_size == offset:
+            return None
+
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            chunk = f.read(stat.st_size - offset)
+
+        # A line which is still being written is left for the next read
+        end = chunk.rfind(b'\n') + 1
+        if end == 0:
+            return None
+        lines = chunk[:end]
+
+        if self.path.endswith('.jsonl'):
+            readings = self._parse_jsonl(lines)
+        else:
+            if header is None:
+                header_end = lines.find(b'\n') + 1
+                header, lines = lines[:header_end], lines[header_end:]
+            readings = self._parse_csv(header, lines)
+        self._pending = (stat.st_ino, offset + end, header)
+        return readings
+
+    def commit(self):
+        # Moves past the lines of the last read, once their readings were added
+        if self._pending is not None:
+            self._inode, self.offset, self.header = self._pending
+            self._pending = None
+
+    def _parse_jsonl(self, lines):
+        records = []
+        for line in lines.splitlines():
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            if not isinstance(record, dict):
+                logger.warning("Skipped a malformed line of %s: %r", self.path, line[:200])
+                continue
+            records.append(record)
+        return pd.DataFrame.from_records(records) if records else None
+
+    def _parse_csv(self, header, lines):
+        if not lines.strip():
+            return None
+
+        def skip(fields):
+            logger.warning("Skipped a malformed line of %s: %r", self.path, fields)
+            return None
+
+        try:
+            return pd.read_csv(io.BytesIO(header + lines), engine='python', on_bad_lines=skip)
+        except (ValueError, pd.errors.ParserError) as error:
+            logger.warning("Reading %s line by line: %s", self.path, error)
+
+        # Only the lines which can't be read on their own are skipped
+        frames = []
+        for line in lines.splitlines(keepends=True):
+            if not line.strip():
+                continue
+            try:
+                frames.append(pd.read_csv(io.BytesIO(header + line), engine='python', on_bad_lines=skip))
+            except (ValueError, pd.errors.ParserError):
+                logger.warning("Skipped a malformed line of %s: %r", self.path, line[:200])
+        return pd.concat(frames, ignore_index=True) if frames else None
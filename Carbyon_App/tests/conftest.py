@@ -0,0 +1,58 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+# The app modules are imported by name, as the app itself does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_store import get_data_store, apply_schema, machine_frame, parse_readings, UNITS
+from machines import MachineRegistry
+
+
+@pytest.fixture(scope='session')
+def zone_index():
+    return get_data_store().zone_index
+
+
+@pytest.fixture
+def make_readings():
+    def make(count, seed=0, start='2025-01-01'):
+        # Raw machine readings as written to a CSV or telemetry file, some
+        # with a missing metric
+        rng = np.random.default_rng(seed)
+        readings = pd.DataFrame({
+            'Date': pd.date_range(start, periods=count, freq='h').strftime('%Y-%m-%d %H:%M'),
+            'ID': [f'0x{i % 7:04x}' for i in range(count)],
+            'Lat': rng.uniform(-50, 65, count).round(4),
+            'Long': rng.uniform(-170, 170, count).round(4),
+        })
+        for column in UNITS:
+            readings[column] = rng.uniform(10, 1000, count).round(1)
+        readings.loc[::5, 'CostsToCapture'] = np.nan
+        return readings
+    return make
+
+
+def _typed(readings):
+    # Readings in the form the registry loads them
+    return machine_frame(apply_schema(readings.copy()))
+
+
+@pytest.fixture
+def typed():
+    return _typed
+
+
+@pytest.fixture
+def registry(tmp_path, zone_index, make_readings):
+    csv_dir, telemetry_dir = tmp_path / 'csv', tmp_path / 'telemetry'
+    csv_dir.mkdir()
+    telemetry_dir.mkdir()
+    for seed, name in enumerate(('m1', 'm2')):
+        make_readings(20, seed=seed).to_csv(csv_dir / f'{name}.csv', index=False)
+    return MachineRegistry(
+        str(csv_dir), zone_index, lambda path: _typed(pd.read_csv(path)), parse_readings=parse_readings,
+        telemetry_dir=str(telemetry_dir)
+    )
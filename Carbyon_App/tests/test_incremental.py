@@ -0,0 +1,125 @@
+import numpy as np
+import pandas as pd
+import pytest
+import machines
+from machines import Machine
+from range_index import RangeIndex
+from site_clusters import SiteClusters
+from site_index import SiteIndex
+from zone_stats import METRICS, ZoneStatistics
+
+
+@pytest.fixture
+def appended(make_readings, typed):
+    def make(batches=3):
+        # Readings loaded at once and the same readings in batches
+        frames = [typed(make_readings(200, seed=seed, start=f'2025-0{seed + 1}-01')) for seed in range(batches)]
+        return frames, pd.concat(frames, ignore_index=True)
+    return make
+
+
+def test_zone_statistics_update_matches_a_rebuild(zone_index, appended):
+    frames, everything = appended()
+    statistics = ZoneStatistics(zone_index, frames[0])
+    for frame in frames[1:]:
+        statistics.update(frame)
+
+    pd.testing.assert_frame_equal(statistics.table, ZoneStatistics(zone_index, everything).table)
+    assert statistics.version == len(frames)
+
+
+def test_site_index_extended_matches_a_rebuild(appended):
+    frames, everything = appended()
+    index = SiteIndex(frames[0])
+    for frame in frames[1:]:
+        extended = index.extended(frame)
+        assert len(index) < len(extended)
+        index = extended
+    rebuilt = SiteIndex(everything)
+
+    np.testing.assert_array_equal(index.vectors, rebuilt.vectors)
+    lats, lons = np.linspace(-40, 60, 25), np.linspace(-150, 150, 25)
+    np.testing.assert_array_equal(index.nearest_many(lats, lons)[0], rebuilt.nearest_many(lats, lons)[0])
+    assert index.nearest(48.1, 11.6, k=3)[0].tolist() == rebuilt.nearest(48.1, 11.6, k=3)[0].tolist()
+
+
+def test_range_index_merge_matches_a_rebuild(zone_index, appended):
+    frames, everything = appended()
+    first = RangeIndex(zone_index, frames[0])
+    index = first
+    for frame in frames[1:]:
+        index = index.extended(zone_index, frame)
+    rebuilt = RangeIndex(zone_index, everything)
+
+    # The index extended from stays as it was
+    assert len(first.lats) == len(frames[0])
+    for metric in METRICS:
+        for merged, expected in zip(index._sites[metric] + index._zones[metric],
+                                    rebuilt._sites[metric] + rebuilt._zones[metric]):
+            np.testing.assert_array_equal(merged, expected)
+        assert index.bounds(metric) == rebuilt.bounds(metric)
+        low, high = np.nanpercentile(everything[metric], [30, 60])
+        np.testing.assert_array_equal(index.sites(metric, low, high), rebuilt.sites(metric, low, high))
+        np.testing.assert_array_equal(index.zones(metric, low, high), rebuilt.zones(metric, low, high))
+
+
+def test_site_clusters_extended_match_a_rebuild(appended):
+    frames, everything = appended()
+    first = SiteClusters(frames[0])
+    first.view(2, -85, -180, 85, 180)
+    clusters = first
+    for frame in frames[1:]:
+        clusters = clusters.extended(frame)
+    rebuilt = SiteClusters(everything)
+
+    for name in ('lats', 'lons', 'costs', 'x', 'y'):
+        np.testing.assert_array_equal(getattr(clusters, name), getattr(rebuilt, name))
+    for zoom, view in ((2, (-85, -180, 85, 180)), (5, (30, -20, 60, 40)), (12, (40, 0, 41, 1))):
+        assert clusters.view(zoom, *view) == rebuilt.view(zoom, *view)
+    assert sum(cluster[2] for cluster in clusters.view(0, -85, -180, 85, 180)) == len(everything)
+
+    # The copy doesn't share the levels built before the extension
+    assert sum(cluster[2] for cluster in first.view(2, -85, -180, 85, 180)) == len(frames[0])
+    assert sum(cluster[2] for cluster in clusters.view(2, -85, -180, 85, 180)) == len(everything)
+
+
+def test_machine_append_matches_a_fresh_load(zone_index, appended):
+    frames, everything = appended()
+    machine = Machine('m', frames[0], zone_index)
+
+    # Indexes built before the appends are extended, the others built on use
+    machine.site_index, machine.range_index
+    for frame in frames[1:]:
+        machine.append(frame)
+    fresh = Machine('m', everything, zone_index)
+
+    assert machine.version == len(frames) - 1
+    pd.testing.assert_frame_equal(
+        machine.data.drop(columns='geometry').reset_index(drop=True),
+        fresh.data.drop(columns='geometry').reset_index(drop=True)
+    )
+    pd.testing.assert_frame_equal(machine.zone_statistics.table, fresh.zone_statistics.table)
+    np.testing.assert_array_equal(machine.site_index.vectors, fresh.site_index.vectors)
+    np.testing.assert_array_equal(
+        np.sort(machine.range_index.sites('CostsToCapture', 200, 600)),
+        np.sort(fresh.range_index.sites('CostsToCapture', 200, 600))
+    )
+
+
+def test_appends_combine_the_readings_once(zone_index, appended, monkeypatch):
+    frames, everything = appended(batches=4)
+    machine = Machine('m', frames[0], zone_index)
+    combined = []
+    concat_readings = machines._concat_readings
+    monkeypatch.setattr(machines, '_concat_readings', lambda *args: combined.append(1) or concat_readings(*args))
+
+    # The data isn't copied on every append, only when it is read
+    for frame in frames[1:]:
+        machine.append(frame)
+    assert not combined
+    data = machine.data
+    assert machine.data is data
+    assert len(combined) == 1
+    pd.testing.assert_frame_equal(
+        data.drop(columns='geometry').reset_index(drop=True), everything.drop(columns='geometry')
+    )
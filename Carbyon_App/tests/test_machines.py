@@ -0,0 +1,33 @@
+import threading
+import pandas as pd
+from machines import MachineRegistry
+
+
+def test_loading_a_machine_does_not_hold_up_the_others(tmp_path, zone_index, make_readings, typed):
+    for seed, name in enumerate(('m1', 'm2')):
+        make_readings(20, seed=seed).to_csv(tmp_path / f'{name}.csv', index=False)
+    loading, release, loads = threading.Event(), threading.Event(), []
+
+    def load(path):
+        loads.append(path)
+        if path.endswith('m1.csv'):
+            loading.set()
+            release.wait(10)
+        return typed(pd.read_csv(path))
+
+    registry = MachineRegistry(str(tmp_path), zone_index, load)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(registry.get('m1'))) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    assert loading.wait(10)
+
+    # m2 loads while m1 is still being parsed
+    assert len(registry.get('m2').data) == 20
+    assert not results
+    release.set()
+    for thread in threads:
+        thread.join(10)
+
+    assert results[0] is results[1]
+    assert sorted(path.rsplit('/', 1)[1] for path in loads) == ['m1.csv', 'm2.csv']
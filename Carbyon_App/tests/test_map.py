@@ -0,0 +1,15 @@
+import re
+from color_map import Color_map
+from data_store import KOPPEN_GIGER_PATH
+from map import create_map
+
+
+def test_zone_layer_is_defined_before_its_elements():
+    # Every element which reads the zones layer has to come after the layer
+    # in the page, else its script sees the variable still undefined
+    page = create_map(KOPPEN_GIGER_PATH, Color_map(), tiles_url=None).get_root().render()
+    layer = re.search(r'var (geo_json_\w+) = L\.geoJson\(', page)
+    assert layer is not None
+    uses = [match.start() for match in re.finditer(rf'\b{layer.group(1)}\b', page)]
+    assert uses[0] == layer.start() + len('var ')
+    assert re.search(rf'var layer = {layer.group(1)};', page).start() > layer.start()
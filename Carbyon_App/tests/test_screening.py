@@ -0,0 +1,16 @@
+import pandas as pd
+from data_store import get_data_store
+from screening import screen_sites
+
+
+def test_machine_without_sites_gives_empty_results(registry, make_readings, monkeypatch):
+    make_readings(0).to_csv(f'{registry.csv_dir}/empty.csv', index=False)
+    monkeypatch.setattr(get_data_store(), 'registry', registry)
+    sites = pd.DataFrame({'Lat': [52.1, 10.0], 'Long': [5.1, 20.0]})
+
+    screened = screen_sites(sites, machine='empty')
+    assert len(screened) == 2
+    assert screened['GRIDCODE'].notna().all()
+    nearest = ['nearest_ID', 'nearest_Lat', 'nearest_Long', 'nearest_distance_km']
+    assert screened[nearest + ['CostsToCapture_range', 'EnergyRequirements_range']].isna().all().all()
+    assert list(screened.columns) == list(screen_sites(sites, machine='m1').columns)
@@ -0,0 +1,41 @@
+import threading
+import numpy as np
+from data_store import get_data_store, parse_readings, SURFACE_EXECUTOR
+from surface import Surface, interpolate
+
+# Coarse lattice, so the surfaces of the tests are built quickly
+RESOLUTION = 2.0
+
+
+def test_previous_surface_is_served_while_rebuilding(registry, make_readings, monkeypatch, tmp_path):
+    store = get_data_store()
+    monkeypatch.setattr(store, 'registry', registry)
+    monkeypatch.setattr(store, '_surfaces', {})
+    monkeypatch.setattr(store, '_surface_builds', {})
+    monkeypatch.setattr(store, 'cache_dir', str(tmp_path))
+    monkeypatch.setattr(store, '_zone_grids', {})
+
+    first = store.surface('m1', RESOLUTION, wait=True)
+    machine = registry.get('m1')
+    machine.append(parse_readings(make_readings(5, seed=3)))
+
+    # The rebuild waits behind a blocked task, until then the previous surface
+    # is returned and no second rebuild is started
+    gate = threading.Event()
+    SURFACE_EXECUTOR.submit(gate.wait)
+    try:
+        assert store.surface('m1', RESOLUTION) is first
+        build = store.surface_build('m1', RESOLUTION)
+        assert build is not None
+        assert store.surface('m1', RESOLUTION) is first
+        assert store.surface_build('m1', RESOLUTION) is build
+    finally:
+        gate.set()
+
+    rebuilt = build.result()
+    assert store.surface('m1', RESOLUTION) is rebuilt
+    assert rebuilt.data_version == machine.data_version
+    assert store.surface_build('m1', RESOLUTION) is None
+    expected = Surface(RESOLUTION, interpolate(store.zone_grid(RESOLUTION), RESOLUTION, machine.data))
+    for metric, estimates in expected.estimates.items():
+        np.testing.assert_array_equal(rebuilt.estimates[metric], estimates)
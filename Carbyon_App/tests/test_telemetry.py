@@ -0,0 +1,121 @@
+import json
+import logging
+import pandas as pd
+from data_store import parse_readings
+from machines import Machine
+from telemetry import TelemetryTail
+from zone_stats import ZoneStatistics
+
+
+def write(path, text, mode='a'):
+    with open(path, mode) as f:
+        f.write(text)
+
+
+def jsonl(readings):
+    return ''.join(json.dumps(record) + '\n' for record in readings.to_dict('records'))
+
+
+def test_partial_line_is_left_for_the_next_read(tmp_path, make_readings):
+    path = tmp_path / 'm.jsonl'
+    lines = jsonl(make_readings(3))
+    write(path, lines[:-10])
+    tail = TelemetryTail(str(path))
+
+    assert len(tail.read()) == 2
+    tail.commit()
+    write(path, lines[-10:])
+    assert len(tail.read()) == 1
+
+
+def test_lines_are_read_again_until_committed(tmp_path, make_readings):
+    path = tmp_path / 'm.csv'
+    make_readings(4).to_csv(path, index=False)
+    tail = TelemetryTail(str(path))
+
+    assert len(tail.read()) == 4
+    assert len(tail.read()) == 4
+    tail.commit()
+    assert tail.read() is None
+
+    make_readings(2, seed=1).to_csv(path, mode='a', header=False, index=False)
+    assert len(tail.read()) == 2
+
+
+def test_malformed_jsonl_lines_are_skipped(tmp_path, make_readings, caplog):
+    path = tmp_path / 'm.jsonl'
+    lines = jsonl(make_readings(3)).splitlines(keepends=True)
+    write(path, lines[0] + '{"Lat": 1, "Long":\n' + '[1, 2]\n' + ''.join(lines[1:]))
+    tail = TelemetryTail(str(path))
+
+    with caplog.at_level(logging.WARNING):
+        readings = tail.read()
+    assert len(readings) == 3
+    assert caplog.text.count('malformed line') == 2
+
+
+def test_malformed_csv_lines_are_skipped(tmp_path, make_readings, caplog):
+    path = tmp_path / 'm.csv'
+    text = make_readings(3).to_csv(index=False).splitlines(keepends=True)
+    write(path, ''.join(text[:2]) + 'a,b,c,d,e,f,g,h,i,j,k,l,m,n\n' + ''.join(text[2:]))
+    tail = TelemetryTail(str(path))
+
+    with caplog.at_level(logging.WARNING):
+        readings = tail.read()
+    assert len(readings) == 3
+    assert 'malformed line' in caplog.text
+
+
+def test_unreadable_csv_chunk_keeps_its_good_lines(tmp_path, make_readings, caplog):
+    # Bytes which aren't UTF-8 fail the whole chunk, it is read again line by line
+    path = tmp_path / 'm.csv'
+    text = make_readings(3).to_csv(index=False).encode().splitlines(keepends=True)
+    path.write_bytes(b''.join(text[:2]) + b'\xff\xfe,1\n' + b''.join(text[2:]))
+    tail = TelemetryTail(str(path))
+
+    with caplog.at_level(logging.WARNING):
+        readings = tail.read()
+    assert len(readings) == 3
+    assert 'malformed line' in caplog.text
+
+
+def test_missing_columns_are_added_empty(make_readings):
+    readings = parse_readings(make_readings(3).drop(columns=['EnergyRequirements', 'ID']))
+    assert readings['EnergyRequirements'].isna().all()
+    assert readings['EnergyRequirements'].dtype == 'float32'
+
+    no_coordinates = make_readings(3)
+    no_coordinates.loc[1, 'Lat'] = None
+    assert len(parse_readings(no_coordinates)) == 2
+
+
+def test_poll_adds_readings_without_a_metric(registry, make_readings, zone_index):
+    machine = registry.get('m1')
+    new = make_readings(10, seed=5, start='2025-06-01').drop(columns=['EnergyRequirements'])
+    write(f'{registry.telemetry_dir}/m1.jsonl', jsonl(new))
+
+    assert registry.poll() == {'m1': 10}
+    assert len(machine.data) == 30
+    assert machine.data['EnergyRequirements'].iloc[-10:].isna().all()
+    rebuilt = ZoneStatistics(zone_index, machine.data)
+    pd.testing.assert_frame_equal(machine.zone_statistics.table, rebuilt.table)
+    assert registry.poll() == {}
+
+
+def test_failed_append_is_read_again(registry, make_readings, monkeypatch):
+    m1, m2 = registry.get('m1'), registry.get('m2')
+    write(f'{registry.telemetry_dir}/m1.jsonl', jsonl(make_readings(4, seed=6)))
+    write(f'{registry.telemetry_dir}/m2.jsonl', jsonl(make_readings(3, seed=7)))
+
+    append = Machine.append
+
+    def failing_append(self, readings):
+        if self.name == 'm1':
+            raise RuntimeError('append failed')
+        return append(self, readings)
+
+    monkeypatch.setattr(Machine, 'append', failing_append)
+    assert registry.poll() == {'m2': 3}
+    monkeypatch.setattr(Machine, 'append', append)
+    assert registry.poll() == {'m1': 4}
+    assert (len(m1.data), len(m2.data)) == (24, 23)
@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+import shapely
+
+# Points are classified in chunks so huge batches don't build huge candidate arrays
+CHUNK_SIZE = 100_000
+
+
+class ZoneIndex:
+    """
+    STRtree over the climate zones (EPSG:4326) for fast point-in-zone lookups.
+
+    The tree only narrows each point down to the zones whose bounding box holds
+    it, the exact test runs on prepared polygons. Built once and shared, so
+    lookups never reproject or copy the zones.
+
+    zones (GeoDataFrame): Climate zones with GRIDCODE and description columns.
+    """
+
+    def __init__(self, zones):
+        self.geometries = zones.geometry.to_numpy()
+        shapely.prepare(self.geometries)
+        self.tree = shapely.STRtree(self.geometries)
+        self.gridcodes = zones['GRIDCODE'].to_numpy()
+        self.descriptions = zones['description'].to_numpy()
+
+    def pairs(self, lats, lons, boundary=False):
+        """
+        Find every zone containing each point.
+
+        lats, lons (array-like): Coordinates of the points.
+        boundary (bool): Whether points on a zone border count as inside it.
+
+        Returns:
+            tuple: Arrays of point positions and zone positions, one entry per match.
+        """
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        test = shapely.intersects_xy if boundary else shapely.contains_xy
+
+        point_parts, zone_parts = [], []
+        for start in range(0, len(lats), CHUNK_SIZE):
+            chunk_lats = lats[start:start + CHUNK_SIZE]
+            chunk_lons = lons[start:start + CHUNK_SIZE]
+
+            # Candidates by bounding box, then the exact test on prepared polygons
+            point_idx, zone_idx = self.tree.query(shapely.points(chunk_lons, chunk_lats))
+            inside = test(self.geometries[zone_idx], chunk_lons[point_idx], chunk_lats[point_idx])
+            point_parts.append(point_idx[inside] + start)
+            zone_parts.append(zone_idx[inside])
+
+        if not point_parts:
+            return np.array([], dtype=int), np.array([], dtype=int)
+        return np.concatenate(point_parts), np.concatenate(zone_parts)
+
+    def classify(self, lats, lons):
+        """
+        Find the climate zone of a batch of coordinates.
+
+        Returns:
+            DataFrame: GRIDCODE (missing outside the zones) and description,
+            one row per input point in the same order.
+        """
+        lats = np.asarray(lats, dtype=float)
+        point_idx, zone_idx = self.pairs(lats, lons)
+
+        # Keep the first zone found for every point
+        found, first = np.unique(point_idx, return_index=True)
+        zone_of_point = np.full(len(lats), -1)
+        zone_of_point[found] = zone_idx[first]
+
+        matched = zone_of_point >= 0
+        gridcodes = pd.array(np.where(matched, self.gridcodes[zone_of_point], 0), dtype='Int64')
+        gridcodes[~matched] = pd.NA
+        descriptions = np.where(matched, self.descriptions[zone_of_point], None)
+        return pd.DataFrame({'GRIDCODE': gridcodes, 'description': descriptions})
+
+    def lookup(self, lat, lon):
+        # Climate zone of a single coordinate, or None outside the zones
+        result = self.classify([lat], [lon]).iloc[0]
+        if pd.isna(result['GRIDCODE']):
+            return None
+        return {
+            'description': result['description'],
+            'GRIDCODE': int(result['GRIDCODE'])
+        }
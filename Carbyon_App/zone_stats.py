@@ -0,0 +1,105 @@
+import threading
+import numpy as np
+import pandas as pd
+
+# Machine columns summarised per climate zone and the unit shown in the ranges
+METRICS = {
+    'CostsToCapture': '€/ton',
+    'EnergyRequirements': 'kWh/ton',
+}
+PERCENTILES = (25, 50, 75)
+STATISTICS = ['min', 'max', 'mean', 'count'] + [f'p{q}' for q in PERCENTILES]
+
+
+def assign_gridcodes(zone_index, sites):
+    """
+    Find the climate zone of every machine reading.
+
+    zone_index (ZoneIndex): Spatial index of the climate zones.
+    sites (DataFrame): Machine readings with Lat and Long columns.
+
+    Returns:
+        DataFrame: GRIDCODE and the metric columns, one row per reading and zone
+        it lies in (readings on a border between two zones count for both).
+    """
+    point_idx, zone_idx = zone_index.pairs(sites['Lat'], sites['Long'], boundary=True)
+    pairs = pd.DataFrame({'site': point_idx, 'GRIDCODE': zone_index.gridcodes[zone_idx]}).drop_duplicates()
+
+    assigned = sites[list(METRICS)].iloc[pairs['site'].to_numpy()]
+    assigned.insert(0, 'GRIDCODE', pairs['GRIDCODE'].to_numpy())
+    return assigned
+
+
+def _summarise(values):
+    # Statistics of one metric in one zone
+    if len(values) == 0:
+        return [np.nan, np.nan, np.nan, 0] + [np.nan] * len(PERCENTILES)
+    return [values.min(), values.max(), values.mean(), len(values)] + list(np.percentile(values, PERCENTILES))
+
+
+class ZoneStatistics:
+    """
+    Per-GRIDCODE statistics (min, max, mean, count and percentiles) of the
+    machine metrics, so rendering the map is a lookup instead of a spatial join.
+
+    New readings are added with update(), which only recomputes the zones they
+    fall in and increases the version.
+    """
+
+    def __init__(self, zone_index, sites):
+        self.zone_index = zone_index
+        self.version = 0
+        self._lock = threading.Lock()
+
+        # Metric values per GRIDCODE, kept as a list of arrays per metric
+        self._values = {}
+
+        gridcodes = np.unique(zone_index.gridcodes)
+        columns = [f'{metric}_{stat}' for metric in METRICS for stat in STATISTICS]
+        self.table = pd.DataFrame(np.nan, index=pd.Index(gridcodes, name='GRIDCODE'), columns=columns)
+        for metric in METRICS:
+            self.table[f'{metric}_count'] = 0
+
+        self.update(sites)
+
+    def update(self, new_sites):
+        # Adds new readings and recomputes the statistics of the zones they touch
+        assigned = assign_gridcodes(self.zone_index, new_sites)
+
+        with self._lock:
+            for gridcode, group in assigned.groupby('GRIDCODE'):
+                values = self._values.setdefault(gridcode, {metric: [] for metric in METRICS})
+                for metric in METRICS:
+                    values[metric].append(group[metric].dropna().to_numpy(dtype=float))
+
+            table = self.table.copy()
+            for gridcode in assigned['GRIDCODE'].unique():
+                for metric in METRICS:
+                    values = np.concatenate(self._values[gridcode][metric])
+                    self._values[gridcode][metric] = [values]
+                    table.loc[gridcode, [f'{metric}_{stat}' for stat in STATISTICS]] = _summarise(values)
+
+            # The table is replaced at once so readers never see a half update
+            self.table = table
+            self.version += 1
+        return assigned
+
+    def ranges(self):
+        """
+        Returns:
+            DataFrame: '<metric>_range' strings ("min - max unit") per GRIDCODE.
+        """
+        # The values are float32 readings, so they are shown with at most six
+        # significant digits (277.3 instead of 277.29998779296875)
+        table = self.table
+        return pd.DataFrame({
+            f'{metric}_range': table[f'{metric}_min'].map('{:g}'.format) + ' - '
+                + table[f'{metric}_max'].map('{:g}'.format) + f' {unit}'
+            for metric, unit in METRICS.items()
+        })
+
+    def lookup(self, gridcode):
+        # Statistics of one climate zone as a dictionary (None for unknown zones)
+        if gridcode not in self.table.index:
+            return None
+        return self.table.loc[gridcode].to_dict()
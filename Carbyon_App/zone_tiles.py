@@ -0,0 +1,169 @@
+"""
+Tiled GeoJSON pyramid of the climate zones, served next to the Panel app so the
+map only downloads the zones in view.
+
+Build the tiles once, then serve them as a static directory:
+
+    python zone_tiles.py
+    CARBYON_ZONE_TILES_URL=/zone-tiles panel serve app.py --static-dirs zone-tiles=files/cache/tiles
+
+Without built tiles the app builds them in a background thread and shows the
+zones in the page until they are done.
+"""
+import json
+import logging
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import shapely
+from columnar_cache import CACHE_DIR, source_fingerprint
+from geometry_tiers import TOLERANCES, tolerance_for_zoom
+
+logger = logging.getLogger(__name__)
+
+TILES_DIR = os.path.join(CACHE_DIR, 'tiles')
+
+# Tile pyramids missing when the app asks for them are built in one background thread
+TILES_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix='tiles')
+_builds = {}
+_builds_lock = threading.Lock()
+
+# Deepest zoom level with its own tiles, the map reuses these when zoomed in further
+MAX_TILE_ZOOM = 6
+
+# Version of the tile format, part of the tileset name so browsers don't keep
+# tiles of an older format
+TILES_FORMAT = 2
+
+# Margin in tile pixels the borders are cut with, so they run on across tile edges
+TILE_BUFFER_PIXELS = 4
+
+# URL the static tiles directory is served under, tiled mode is off when unset
+ZONE_TILES_URL = os.environ.get('CARBYON_ZONE_TILES_URL')
+
+
+def tile_bounds(z, x, y):
+    # Longitude/latitude bounds (west, south, east, north) of a web map tile
+    n = 2 ** z
+
+    def lat(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return x / n * 360 - 180, lat(y + 1), (x + 1) / n * 360 - 180, lat(y)
+
+
+def tileset_name(source_path):
+    # Folder of a tile pyramid, changes whenever the shapefile changes
+    name = os.path.splitext(os.path.basename(source_path))[0]
+    return f'{name}-{source_fingerprint(source_path)}-v{TILES_FORMAT}'
+
+
+def tileset_path(source_path, tiles_dir=TILES_DIR):
+    return os.path.join(tiles_dir, tileset_name(source_path))
+
+
+def tiles_built(source_path, tiles_dir=TILES_DIR):
+    # The done marker is written last, once every tile is there
+    return os.path.exists(os.path.join(tileset_path(source_path, tiles_dir), 'done'))
+
+
+def tile_tolerance(z, max_zoom=MAX_TILE_ZOOM):
+    # Geometry tier of a zoom level's tiles. Down to the deepest level they use
+    # at least the finest simplified tier, the deepest level is also drawn at
+    # every zoom beyond it and keeps the exact zones
+    if z >= max_zoom:
+        return 0
+    return max(tolerance_for_zoom(z), min(TOLERANCES))
+
+
+def zone_borders(geometries):
+    # Borders between the zones as lines, each shared border only once
+    return shapely.get_parts(shapely.line_merge(shapely.union_all(shapely.boundary(geometries))))
+
+
+def build_tiles(geometry_tiers, tiles_dir=TILES_DIR, max_zoom=MAX_TILE_ZOOM):
+    """
+    Write the tile pyramid of the climate zones, skipping it if it is up to date.
+
+    Every tile holds the parts of the zones inside it, dissolved per GRIDCODE
+    from the geometry tier of its zoom level (see tile_tolerance), and one
+    MultiLineString of the zone borders cut a few pixels beyond it. The zones are drawn without a
+    stroke, so no borders appear along the tile edges. Tiles without zones are
+    not written.
+
+    geometry_tiers (GeometryTiers): Simplified zones of the shapefile.
+
+    Returns:
+        str: Folder of the tile pyramid.
+    """
+    output = tileset_path(geometry_tiers.source_path, tiles_dir)
+    done_marker = os.path.join(output, 'done')
+    if os.path.exists(done_marker):
+        return output
+
+    for z in range(max_zoom + 1):
+        tolerance = tile_tolerance(z, max_zoom)
+        borders = zone_borders(geometry_tiers.by_gridcode(tolerance).geometry.to_numpy())
+        border_tree = shapely.STRtree(borders)
+
+        for x in range(2 ** z):
+            for y in range(2 ** z):
+                west, south, east, north = tile_bounds(z, x, y)
+                zones = geometry_tiers.clipped(tolerance, west, south, east, north)
+                if len(zones) == 0:
+                    continue
+                features = [
+                    f'{{"type":"Feature","properties":{{"GRIDCODE":{int(gridcode)}}},"geometry":{geometry}}}'
+                    for gridcode, geometry in zip(zones['GRIDCODE'], shapely.to_geojson(zones.geometry.to_numpy()))
+                ]
+
+                pad = (east - west) * TILE_BUFFER_PIXELS / 256
+                box = (west - pad, south - pad, east + pad, north + pad)
+                lines = shapely.get_parts(shapely.clip_by_rect(borders[border_tree.query(shapely.box(*box))], *box))
+                lines = lines[shapely.get_type_id(lines) == shapely.GeometryType.LINESTRING]
+                if len(lines):
+                    border = shapely.to_geojson(shapely.multilinestrings(lines))
+                    features.append(f'{{"type":"Feature","properties":{{}},"geometry":{border}}}')
+
+                os.makedirs(os.path.join(output, str(z), str(x)), exist_ok=True)
+                with open(os.path.join(output, str(z), str(x), f'{y}.geojson'), 'w') as f:
+                    f.write(f'{{"type":"FeatureCollection","features":[{",".join(features)}]}}')
+
+    with open(done_marker, 'w') as f:
+        json.dump({'max_zoom': max_zoom, 'tolerances': [tile_tolerance(z, max_zoom) for z in range(max_zoom + 1)]}, f)
+    return output
+
+
+def ready_tiles(geometry_tiers, tiles_dir=TILES_DIR):
+    """
+    The tile pyramid of the climate zones if it is built. Otherwise it is
+    built in a background thread, once per process.
+
+    geometry_tiers (GeometryTiers): Simplified zones of the shapefile.
+
+    Returns:
+        str: Folder of the tile pyramid, None until it is done.
+    """
+    output = tileset_path(geometry_tiers.source_path, tiles_dir)
+    if tiles_built(geometry_tiers.source_path, tiles_dir):
+        return output
+    with _builds_lock:
+        if output not in _builds:
+            logger.info("Building the zone tiles in %s, the zones are shown in the page until they are done", output)
+            _builds[output] = TILES_EXECUTOR.submit(_build_tiles_logged, geometry_tiers, tiles_dir)
+    return None
+
+
+def _build_tiles_logged(geometry_tiers, tiles_dir):
+    # A failed build isn't tried again until the app restarts
+    try:
+        return build_tiles(geometry_tiers, tiles_dir)
+    except Exception:
+        logger.exception("The zone tiles could not be built, the zones stay in the page")
+        raise
+
+
+if __name__ == '__main__':
+    from data_store import get_data_store
+    print(f"Tiles written to {build_tiles(get_data_store().geometry_tiers)}")